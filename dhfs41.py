@@ -1,8 +1,692 @@
 import re
+import calendar
+import csv
+import json
+import os
+import hashlib
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
+from dhfs_image import ImageReader
+from dhfs_hash import Hasher, Manifest, SweepHashers, export_file_hashed, hash_file
+from dhfs_profile import Profiler
+from dhfs_schedule import export_in_disk_order, plan_reads
+from dhfs_logs import (LogIndex, LOG_CHUNK, LOG_FIELDS, LOG_RECORD_SIZE, parse_log_fields,
+                       get_log_dtype, records_to_columns)
+from dhfs_frames import FRAME_DTYPE, FrameIndex, stream_to_extents
+import dhfs_cache
+
+NO_DESC = 0xFFFFFFFF
+
+# Chain linking is Python code holding the GIL: when the partitions hold
+# at least this many descriptors, it runs on a process pool so partitions
+# are linked in parallel. Below, starting processes costs more than it saves.
+LINK_PROCESS_DESCS = 200000
+
+# Descriptor table samples hashed to tell whether a cached catalog is stale
+CACHE_SAMPLES     = 64
+CACHE_SAMPLE_SIZE = 4096
+
+# Whole-area carving: bytes read at a time by each worker, and how far past
+# its end a read goes so signatures up to that size can straddle blocks
+SCAN_BLOCK   = 16 * 1024 * 1024
+SCAN_OVERLAP = 256
+
+# Frames of the video stream: "DHAV", type at byte 4, frame length
+# (header and "dhav" trailer included) at 12:16 and the date, packed as
+# the descriptor timestamps, at 16:20. Probes read PROBE_SIZE at a time.
+DHAV_MAGIC   = b"DHAV"
+DHAV_TRAILER = b"dhav"
+DHAV_I_FRAME = 0xFD
+DHAV_TYPES   = (0xFD, 0xFC, 0xFB, 0xF0, 0xF1)
+PROBE_SIZE   = 64 * 1024
+KEYFRAME_LOOKBACK = 4
+
+# Frame indexes (dhfs_frames) are built reading videos FRAME_READ at a
+# time; the last FRAME_INDEXES built are kept
+FRAME_READ    = 4 * 1024 * 1024
+FRAME_INDEXES = 64
+
+# Bulk descriptor export: rows formatted per batch, and the columns, with
+# the names decode_descriptor uses plus where each descriptor belongs
+EXPORT_BATCH   = 65536
+EXPORT_COLUMNS = ["partition", "desc", "category", "descType", "camera", "begTime", "endTime",
+                  "numFrag", "totFrags", "beginDesc", "prevDesc", "nextDesc", "sizeLast",
+                  "totalSize", "chainLength", "offset", "hex"]
+EXPORT_TIME = "20%02d-%02d-%02d %02d:%02d:%02d"
+
+# Bulk slack container: slacks of a batch read in disk order (reads
+# joining slacks up to SLACK_GAP apart) and written one after another to a
+# single file, indexed in file + ".idx" (dhfs_cache format). With a scan,
+# a slack is kept when SLACK_SIGNATURE and/or SLACK_FRAMES are found in it.
+SLACK_MAGIC     = b"DHFSSLK1"
+SLACK_READ      = 8 * 1024 * 1024
+SLACK_GAP       = 1024 * 1024
+SLACK_SIGNATURE = 1
+SLACK_FRAMES    = 2
+
+# Layout of a 32-byte descriptor; fields at offsets 0, 1, 2, 4, 8, ...
+DESC_DTYPE = np.dtype([('type',       'u1'),
+                       ('camera',     'u1'),
+                       ('frag',       '<u2'),
+                       ('begin_ts',   '<u4'),
+                       ('end_ts',     '<u4'),
+                       ('next',       '<u4'),
+                       ('last_size',  '<u4'),
+                       ('prev',       '<u4'),
+                       ('begin_desc', '<u4'),
+                       ('reserved',   '<u4')])
 
 def extract_bits(numb, position, tam):
     return (numb >> (position + 1 - tam)) & ((1 << tam) - 1)
 
+def timestamps_to_epoch(timestamps):
+    # Packed timestamps (array) to seconds since 1970 of the recorder's
+    # clock, taken as UTC: the recorder keeps no time zone
+    ts = np.asarray(timestamps, dtype=np.int64)
+    years, months, days, hours, minutes, secs = (extract_bits(ts, 31, 6), extract_bits(ts, 25, 4),
+                                                 extract_bits(ts, 21, 5), extract_bits(ts, 16, 5),
+                                                 extract_bits(ts, 11, 6), extract_bits(ts, 5, 6))
+    month_starts = ((years + 30) * 12 + months - 1).astype('datetime64[M]')
+    dates = month_starts.astype('datetime64[D]') + (days - 1)
+    return dates.astype(np.int64) * 86400 + hours * 3600 + minutes * 60 + secs
+
+def valid_timestamps(timestamps):
+    # Packed timestamps that are dates at all (unused slots are zero or garbage)
+    ts = np.asarray(timestamps, dtype=np.int64)
+    months, days = extract_bits(ts, 25, 4), extract_bits(ts, 21, 5)
+    return ((ts != 0) & (months >= 1) & (months <= 12) & (days >= 1) &
+            (extract_bits(ts, 16, 5) < 24) & (extract_bits(ts, 11, 6) < 60) & (extract_bits(ts, 5, 6) < 60))
+
+def text_to_epoch(text):
+    # "YYYY-MM-DD[ HH:MM:SS]" in the recorder's clock to epoch seconds
+    text = text.strip()
+    fmt = "%Y-%m-%d %H:%M:%S" if len(text) > 10 else "%Y-%m-%d"
+    return calendar.timegm(time.strptime(text, fmt))
+
+def epoch_to_text(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+def parse_frame_header(data, pos):
+    # (type, length, epoch seconds) of the frame header at pos, or None
+    # if there is no plausible header there. When the whole frame is in
+    # data its trailer must match too.
+    header = data[pos:pos+20]
+    if len(header) < 20 or header[:4] != DHAV_MAGIC or header[4] not in DHAV_TYPES:
+        return None
+    length = int.from_bytes(header[12:16], byteorder='little')
+    packed = int.from_bytes(header[16:20], byteorder='little')
+    month, day = extract_bits(packed, 25, 4), extract_bits(packed, 21, 5)
+    if length < 32 or not 1 <= month <= 12 or not 1 <= day <= 31:
+        return None
+    if pos + length <= len(data) and data[pos+length-8:pos+length-4] != DHAV_TRAILER:
+        return None
+    return header[4], length, int(timestamps_to_epoch(packed))
+
+def find_frame_headers(data):
+    # [(offset, type, length, epoch seconds)] of the frames starting in data
+    headers = []
+    pos = data.find(DHAV_MAGIC)
+    while pos >= 0:
+        header = parse_frame_header(data, pos)
+        if header:
+            headers.append((pos,) + header)
+            # Skip the payload of the frame, unless it runs past data
+            next_pos = pos + header[1]
+            if next_pos < len(data) and parse_frame_header(data, next_pos):
+                pos = next_pos
+                continue
+        pos = data.find(DHAV_MAGIC, pos + 1)
+    return headers
+
+def parse_bool(value):
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def column_as_array(column):
+    # Copies a uint32 descriptor column into a compact array('I'),
+    # whose items index much faster than numpy scalars.
+    values = array('I')
+    values.frombytes(np.ascontiguousarray(column, dtype='<u4').tobytes())
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+# Image opened by each process of a process pool (see save_videos_at)
+worker_image = None
+
+def open_worker_image(path, use_mmap):
+    global worker_image
+    worker_image = ImageReader(path, use_mmap)
+
+def export_file(image, full_name, extents):
+    with open(full_name, "wb") as fd_out:
+        return sum(image.copy_to(fd_out.fileno(), offset, size) for offset, size in extents)
+
+def export_evidence(image, full_name, extents, hashing=None):
+    # export_file returning (bytes, digests). With hashing, (algorithms,
+    # piece_size), the file is hashed as it is written (see dhfs_hash);
+    # otherwise it is copied in the kernel and digests is None.
+    if not hashing:
+        return export_file(image, full_name, extents), None
+    return export_file_hashed(image, full_name, extents, *hashing)
+
+def export_evidence_in_worker(full_name, extents, hashing=None):
+    return export_evidence(worker_image, full_name, extents, hashing)
+
+def read_slack_index(path):
+    # (header, columns) of the index of a slack container, None if unreadable.
+    # Columns: partition, desc, begin (epoch), camera, offset (in the
+    # image), position (in the container), size and hits.
+    return dhfs_cache.read_cache(path, SLACK_MAGIC)
+
+def scan_signature(image, start, end, pattern):
+    # Offsets in [start, end) where pattern matches. Blocks are read with
+    # SCAN_OVERLAP extra bytes, so matches crossing a block (or chunk)
+    # boundary are found by the block where they begin.
+    hits = array('q')
+    block_start = start
+    while block_start < end:
+        block_size = min(SCAN_BLOCK, end - block_start)
+        data = image.view(block_start, block_size + SCAN_OVERLAP)
+        for match in pattern.finditer(data):
+            if match.start() < block_size:
+                hits.append(block_start + match.start())
+        block_start += block_size
+    return hits
+
+def scan_signature_in_worker(start, end, pattern):
+    return scan_signature(worker_image, start, end, pattern)
+
+def link_chains_in_worker(offset, size):
+    # link_chains of the descriptor table at offset, read by the worker
+    data = worker_image.read_at(offset, size)
+    return link_chains(np.frombuffer(data, dtype=DESC_DTYPE, count=len(data) // DESC_DTYPE.itemsize))
+
+class ChainIndex:
+    # Fragment chains of every main descriptor of a partition, in CSR form.
+    # Each fragment is stored once, in frags[offsets[i]:offsets[i+1]] for
+    # the first chain i that reaches it. A chain running into a fragment
+    # stored for an earlier chain goes on from there: links[i] is that
+    # fragment's position in frags (-1 if none). A chain whose walk closed
+    # a loop goes back to position loops[i] (-1 if none), so a chain
+    # entering it past that point also walks the part before (see
+    # get_parts). owner[f] is the position in heads of the video that holds
+    # fragment f (or -1). Mapping-like, so it can be used where
+    # frags_in_videos was a dict.
+    def __init__(self, heads, offsets, frags, owner, anomalies, links=None, loops=None, lengths=None):
+        self.heads     = heads
+        self.offsets   = offsets
+        self.frags     = frags
+        self.owner     = owner
+        self.anomalies = anomalies
+        self.links     = links if links is not None else np.full(len(heads), -1, dtype=np.int64)
+        self.loops     = loops if loops is not None else np.full(len(heads), -1, dtype=np.int64)
+        self.lengths   = lengths if lengths is not None else np.diff(offsets)
+
+    def __len__(self):
+        return len(self.heads)
+
+    def __iter__(self):
+        return iter(self.heads.tolist())
+
+    def __contains__(self, desc_idx):
+        return self.get_position(desc_idx) >= 0
+
+    def __getitem__(self, desc_idx):
+        return self.get_chain(desc_idx).tolist()
+
+    def get(self, desc_idx, default=None):
+        if desc_idx not in self:
+            return default
+        return self.get_chain(desc_idx).tolist()
+
+    def keys(self):
+        return self.heads.tolist()
+
+    def get_position(self, desc_idx):
+        pos = int(np.searchsorted(self.heads, desc_idx))
+        if pos < len(self.heads) and self.heads[pos] == desc_idx:
+            return pos
+        return -1
+
+    def get_segment(self, flat):
+        # Position of the chain storing frags[flat]
+        return int(np.searchsorted(self.offsets, flat, side='right')) - 1
+
+    def get_parts(self, pos):
+        # (start, end) slices of frags that make up the chain of heads[pos]
+        parts = []
+        seg, start = pos, int(self.offsets[pos])
+        while True:
+            parts.append((start, int(self.offsets[seg + 1])))
+            loop = int(self.loops[seg])
+            if 0 <= loop < start:
+                parts.append((loop, start))
+            link = int(self.links[seg])
+            if loop >= 0 or link < 0:
+                return parts
+            seg, start = self.get_segment(link), link
+
+    def get_chain(self, desc_idx):
+        # Same as self[desc_idx], but as an array: a view over frags for
+        # chains that don't join another
+        pos = self.get_position(desc_idx)
+        if pos < 0:
+            raise KeyError(desc_idx)
+        parts = self.get_parts(pos)
+        if len(parts) == 1:
+            return self.frags[parts[0][0]:parts[0][1]]
+        return np.concatenate([self.frags[start:end] for start, end in parts])
+
+    def get_chain_lengths(self):
+        return self.lengths
+
+    def get_owner(self, frag_idx):
+        if 0 <= frag_idx < len(self.owner) and self.owner[frag_idx] >= 0:
+            return int(self.heads[self.owner[frag_idx]])
+        return None
+
+def get_main_descs(table):
+    return np.flatnonzero((table['type'] == 1) & (table['begin_ts'] != table['end_ts']))
+
+def link_chains(table):
+    # Links the fragments of all main descriptors of a descriptor table
+    # following the next pointers, into a ChainIndex. A walk stops at a
+    # loop in its own chain or at a dangling pointer. A fragment reached
+    # by several chains is in all of them (a broken pointer must not cut
+    # another video short), and belongs to the one whose head is its
+    # begin_desc, else to the first.
+    #
+    # Bounds: each fragment is stored once, however many chains merge into
+    # it, so memory is O(N) in descriptors. Walks stop where they join an
+    # earlier chain, so linking is O(N) too. Finding which video a joined
+    # fragment belongs to and the 'shared' anomalies then costs a step per
+    # chain passed through after a join (one, unless joins pile up).
+    num_descs = len(table)
+    heads     = get_main_descs(table)
+    next_desc = column_as_array(table['next'])
+
+    # Position in frags of each stored fragment, -1 until then
+    placed    = array('q', [-1]) * num_descs
+    frags     = array('I')
+    offsets   = array('q', [0])
+    # By chain position, for the few chains that join another or loop:
+    # where they go on, the length of what follows their own fragments,
+    # and why the walk ended, as (kind, desc)
+    links, loops, tails, ends = {}, {}, {}, {}
+    anomalies = []
+    stored = 0
+    for pos, head in enumerate(heads.tolist()):
+        start = stored
+        desc_idx = head
+        while desc_idx != 0 and desc_idx != NO_DESC:
+            if desc_idx >= num_descs:
+                ends[pos] = ('dangling', desc_idx)
+                break
+            flat = placed[desc_idx]
+            if flat >= start:
+                ends[pos] = ('cycle', desc_idx)
+                loops[pos] = flat
+                break
+            if flat >= 0:
+                links[pos] = flat
+                break
+            placed[desc_idx] = stored
+            stored += 1
+            frags.append(desc_idx)
+            desc_idx = next_desc[desc_idx]
+        offsets.append(stored)
+
+        link = links.get(pos, -1)
+        if link >= 0:
+            # The rest is the walk of the chain that stored it, from there
+            seg = bisect_right(offsets, link) - 1
+            seg_loop = loops.get(seg, -1)
+            tails[pos] = offsets[seg + 1] - link + tails.get(seg, 0)
+            if seg_loop >= 0:
+                if seg_loop < link:
+                    tails[pos] += link - seg_loop
+                    ends[pos] = ('cycle', frags[link])
+                else:
+                    ends[pos] = ('cycle', frags[seg_loop])
+            elif seg in ends:
+                ends[pos] = ends[seg]
+        if pos in ends:
+            anomalies.append((ends[pos][0], head, ends[pos][1]))
+
+    def by_chain(values, default=-1):
+        column = np.full(len(heads), default, dtype=np.int64)
+        column[np.fromiter(values, np.int64, len(values))] = np.fromiter(values.values(), np.int64, len(values))
+        return column
+
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+    lengths = np.diff(offsets) + by_chain(tails, 0)
+    chains = ChainIndex(heads, offsets, np.frombuffer(frags, dtype=np.uint32), None, anomalies,
+                        by_chain(links), by_chain(loops), lengths)
+    frags = chains.frags
+
+    # Owners: the first chain reaching a fragment (the one storing it),
+    # heads their own video, and the video named by begin_desc wherever
+    # its chain reaches
+    stored_by = np.repeat(np.arange(len(heads)), np.diff(offsets))
+    owner = np.full(num_descs, -1, dtype=np.int32)
+    owner[frags] = stored_by
+    owner[heads] = np.arange(len(heads))
+    named = np.searchsorted(heads, table['begin_desc'][frags])
+    named[named == len(heads)] = 0
+    named_head = heads[named] == table['begin_desc'][frags]
+    own = named_head & (named == stored_by)
+    owner[frags[own]] = named[own]
+    # Only later chains can join one and reach its fragments
+    for flat in np.flatnonzero(named_head & (named > stored_by)).tolist():
+        if chain_reaches(chains, int(named[flat]), int(stored_by[flat]), flat):
+            owner[frags[flat]] = named[flat]
+    chains.owner = owner
+
+    # Chains running into fragments that belong to another video: the
+    # first such fragment of each, in its own fragments or else in what
+    # follows them. Owners change at run_starts, so only the start of
+    # each run needs a look there.
+    flat_owner = owner[frags]
+    foreign = np.flatnonzero(flat_owner != stored_by)
+    chain_pos, first = np.unique(stored_by[foreign], return_index=True)
+    shared = dict(zip(chain_pos.tolist(), frags[foreign[first]].tolist()))
+
+    run_starts = np.union1d(np.flatnonzero(flat_owner[1:] != flat_owner[:-1]) + 1, offsets[:-1])
+
+    def first_foreign(pos, start, end):
+        # First position in [start, end) not held by heads[pos], or None
+        if start >= end:
+            return None
+        if flat_owner[start] != pos:
+            return start
+        run = np.searchsorted(run_starts, start, side='right')
+        if run < len(run_starts) and run_starts[run] < end:
+            return int(run_starts[run])
+        return None
+
+    for pos in links:
+        if pos in shared:
+            continue
+        for start, end in chains.get_parts(pos)[1:]:
+            found = first_foreign(pos, start, end)
+            if found is not None:
+                shared[pos] = int(frags[found])
+                break
+    anomalies += [('shared', int(heads[pos]), shared[pos]) for pos in sorted(shared)]
+    return chains
+
+def chain_reaches(chains, pos, seg, flat):
+    # Whether the chain of heads[pos] goes through frags[flat], stored for
+    # the chain of heads[seg]
+    start = int(chains.offsets[pos])
+    while pos > seg:
+        start = int(chains.links[pos])
+        if start < 0:
+            return False
+        pos = chains.get_segment(start)
+    if pos != seg:
+        return False
+    return flat >= start or 0 <= chains.loops[seg] <= flat
+
+class IntervalIndex:
+    # Time intervals [begin, end] (epoch seconds) of catalog rows, sorted
+    # by begin, and split in buckets of similar length (powers of two).
+    # In a bucket whose longest interval lasts L, those overlapping a
+    # window [start, end] begin in [start - L, end]: a slice found by two
+    # binary searches, where nearly every row does overlap. A few
+    # intervals with a corrupted, huge end only slow their own bucket.
+    def __init__(self, rows, begins, ends):
+        order = np.argsort(begins, kind='stable')
+        self.rows    = rows[order]
+        self.begins  = begins[order]
+        self.ends    = np.maximum(ends[order], self.begins)
+        self.max_end = np.maximum.accumulate(self.ends) if len(order) else self.ends
+
+        # (positions, their begins, longest length) of each bucket
+        lengths = self.ends - self.begins
+        classes = np.frexp(lengths + 1.0)[1]
+        self.buckets = []
+        for length_class in np.unique(classes).tolist():
+            positions = np.flatnonzero(classes == length_class)
+            self.buckets.append((positions, self.begins[positions], int(lengths[positions].max())))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def overlap(self, start, end):
+        # Rows recording at some moment of [start, end], in begin order
+        found = []
+        for positions, begins, max_length in self.buckets:
+            lo = np.searchsorted(begins, start - max_length, side='left')
+            hi = np.searchsorted(begins, end, side='right')
+            if lo < hi:
+                candidates = positions[lo:hi]
+                found.append(candidates[self.ends[candidates] >= start])
+        if not found:
+            return self.rows[:0]
+        return self.rows[np.sort(np.concatenate(found))]
+
+    def at(self, moment):
+        return self.overlap(moment, moment)
+
+    def get_coverage(self):
+        # Union of the intervals as (begins, ends) arrays of disjoint
+        # runs, in one sweep: a run starts where a begin is past every
+        # earlier end (a gap of a second or more; ends are inclusive)
+        if not len(self.rows):
+            return self.begins[:0], self.ends[:0]
+        starts = np.flatnonzero(np.concatenate(([True], self.begins[1:] > self.max_end[:-1] + 1)))
+        run_ends = np.concatenate((starts[1:], [len(self.rows)])) - 1
+        return self.begins[starts], self.max_end[run_ends]
+
+    def get_gaps(self, start=None, end=None):
+        # Periods with no recording between start and end (default: the
+        # first begin and the last end), as (begins, ends) arrays
+        run_begins, run_ends = self.get_coverage()
+        if start is None:
+            start = int(run_begins[0]) if len(run_begins) else 0
+        if end is None:
+            end = int(run_ends[-1]) if len(run_ends) else 0
+        gap_begins = np.concatenate(([start], run_ends + 1))
+        gap_ends   = np.concatenate((run_begins - 1, [end]))
+        gap_begins = np.maximum(gap_begins, start)
+        gap_ends   = np.minimum(gap_ends, end)
+        keep = gap_begins <= gap_ends
+        return gap_begins[keep], gap_ends[keep]
+
+class VideoCatalog:
+    # The videos of an image as columns (a row per main descriptor) with
+    # date and camera indexes, so listing, filtering and sorting don't go
+    # back to the descriptors. Text is formatted only for rows shown.
+    # partitions, all by default, are those it holds.
+    def __init__(self, dhfs, partitions=None):
+        self.dhfs = dhfs
+        if partitions is None:
+            partitions = range(dhfs.get_num_partitions())
+        self.partitions = list(partitions)
+        parts, descs, begins, ends, cameras, sizes = [], [], [], [], [], []
+        for part_idx in self.partitions:
+            heads = dhfs.frags_in_videos[part_idx].heads
+            table = dhfs.desc_table[part_idx][heads]
+            parts.append(np.full(len(heads), part_idx, dtype=np.int32))
+            descs.append(heads.astype(np.int64))
+            begins.append(table['begin_ts'])
+            ends.append(table['end_ts'])
+            cameras.append(table['camera'].astype(np.int32) - 48 + 1)
+            sizes.append(table['frag'].astype(np.int64) * dhfs.FRAG_SIZES[part_idx] +
+                         table['last_size'].astype(np.int64) * dhfs.BLK_SIZES[part_idx])
+
+        join = lambda columns, dtype: np.concatenate(columns) if columns else np.empty(0, dtype)
+        self.part     = join(parts, np.int32)
+        self.desc     = join(descs, np.int64)
+        self.begin_ts = join(begins, np.uint32)
+        self.end_ts   = join(ends, np.uint32)
+        self.camera   = join(cameras, np.int32)
+        self.size     = join(sizes, np.int64)
+        # Year, month and day bits of the packed timestamp
+        self.date_key = (self.begin_ts >> 17).astype(np.int32)
+
+        self.date_index   = self.build_index(self.date_key)
+        self.camera_index = self.build_index(self.camera)
+        self.begin_epoch  = timestamps_to_epoch(self.begin_ts)
+        self.end_epoch    = timestamps_to_epoch(self.end_ts)
+        self.interval_indexes = {}
+
+    @staticmethod
+    def build_index(keys):
+        # key -> ascending row numbers with that key
+        order = np.argsort(keys, kind='stable')
+        uniq, starts = np.unique(keys[order], return_index=True)
+        bounds = list(starts) + [len(keys)]
+        return {int(key): order[bounds[i]:bounds[i+1]] for i, key in enumerate(uniq)}
+
+    def __len__(self):
+        return len(self.desc)
+
+    def date_key_to_text(self, date_key):
+        return self.dhfs.timestamp_to_date(date_key << 17)
+
+    def get_dates(self):
+        return [self.date_key_to_text(key) for key in sorted(self.date_index)]
+
+    def get_cameras(self):
+        return sorted(self.camera_index)
+
+    def get_video(self, row):
+        return int(self.part[row]), int(self.desc[row])
+
+    def get_interval_index(self, camera=None):
+        # Built on first use, for one camera or for all of them
+        if camera not in self.interval_indexes:
+            if camera is None:
+                rows = np.arange(len(self), dtype=np.int64)
+            else:
+                rows = self.camera_index.get(camera, np.empty(0, dtype=np.int64))
+            self.interval_indexes[camera] = IntervalIndex(rows, self.begin_epoch[rows],
+                                                          self.end_epoch[rows])
+        return self.interval_indexes[camera]
+
+    def select_time(self, start, end, camera=None):
+        # Rows recording at some moment of [start, end] (epoch seconds),
+        # ascending
+        return np.sort(self.get_interval_index(camera).overlap(start, end))
+
+    def select(self, date=None, camera=None):
+        # Rows of the videos starting at date ("YYYY-MM-DD") on camera
+        rows = np.arange(len(self), dtype=np.int64)
+        if date is not None:
+            year, month, day = (int(n) for n in date.split("-"))
+            date_key = ((year - 2000) << 9) | (month << 5) | day
+            rows = self.date_index.get(date_key, rows[:0])
+        if camera is not None:
+            rows = np.intersect1d(rows, self.camera_index.get(camera, rows[:0]),
+                                  assume_unique=True)
+        return rows
+
+    def get_sort_key(self, col):
+        # Same column order as get_text
+        return (self.part, self.desc, self.date_key, self.begin_ts & 0x1FFFF,
+                self.end_ts & 0x1FFFF, self.camera, self.size)[col]
+
+    def sort_rows(self, rows, col, ascending=True):
+        order = np.argsort(self.get_sort_key(col)[rows], kind='stable')
+        if not ascending:
+            order = order[::-1]
+        return rows[order]
+
+    def get_text(self, row, col):
+        if col == 0: return str(self.part[row])
+        if col == 1: return str(self.desc[row])
+        if col == 2: return self.dhfs.timestamp_to_date(int(self.begin_ts[row]))
+        if col == 3: return self.dhfs.timestamp_to_time(int(self.begin_ts[row]))
+        if col == 4: return self.dhfs.timestamp_to_time(int(self.end_ts[row]))
+        if col == 5: return f"{self.camera[row]:02d}"
+        if col == 6: return f"{self.size[row] / 1024 ** 2:.2f} MB"
+        return ""
+
+class SelectionStats:
+    # Running totals of a set of catalog rows (the videos selected in the
+    # list). Rows are added and removed one at a time or in bulk, so a
+    # selection event costs the same whatever the size of the list.
+    def __init__(self, catalog):
+        self.catalog  = catalog
+        self.selected = np.zeros(len(catalog), dtype=bool)
+        self.count = 0
+        self.bytes = 0
+        # Bytes per camera and per day, indexed by position in the sorted keys
+        self.cameras = catalog.get_cameras()
+        self.date_keys = sorted(catalog.date_index)
+        self.camera_pos = np.searchsorted(self.cameras, catalog.camera)
+        self.date_pos   = np.searchsorted(self.date_keys, catalog.date_key)
+        self.camera_bytes = np.zeros(len(self.cameras), dtype=np.int64)
+        self.date_bytes   = np.zeros(len(self.date_keys), dtype=np.int64)
+
+    def update(self, rows, selected):
+        if isinstance(rows, int):
+            # One row per list event: plain scalar arithmetic
+            if self.selected[rows] == selected:
+                return
+            self.selected[rows] = selected
+            size = int(self.catalog.size[rows]) if selected else -int(self.catalog.size[rows])
+            self.count += 1 if selected else -1
+            self.bytes += size
+            self.camera_bytes[self.camera_pos[rows]] += size
+            self.date_bytes[self.date_pos[rows]] += size
+            return
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        rows = np.unique(rows[self.selected[rows] != selected])
+        if not len(rows):
+            return
+        self.selected[rows] = selected
+        sign = 1 if selected else -1
+        sizes = self.catalog.size[rows]
+        self.count += sign * len(rows)
+        self.bytes += sign * int(sizes.sum())
+        np.add.at(self.camera_bytes, self.camera_pos[rows], sign * sizes)
+        np.add.at(self.date_bytes, self.date_pos[rows], sign * sizes)
+
+    def add(self, rows):
+        self.update(rows, True)
+
+    def remove(self, rows):
+        self.update(rows, False)
+
+    def set_rows(self, rows):
+        # Makes the set exactly rows, touching only the rows that change
+        wanted = np.zeros(len(self.selected), dtype=bool)
+        wanted[np.asarray(rows, dtype=np.int64)] = True
+        self.remove(np.flatnonzero(self.selected & ~wanted))
+        self.add(np.flatnonzero(wanted & ~self.selected))
+
+    def clear(self):
+        self.set_rows([])
+
+    def get_camera_bytes(self):
+        return {camera: int(size) for camera, size in zip(self.cameras, self.camera_bytes) if size}
+
+    def get_date_bytes(self):
+        return {self.catalog.date_key_to_text(key): int(size)
+                for key, size in zip(self.date_keys, self.date_bytes) if size}
+
+    def get_eta(self, throughput):
+        # Seconds to extract the selection at throughput MB/s, if known
+        if not throughput:
+            return None
+        return self.bytes / 1024**2 / throughput
+
+    def get_summary(self, throughput=None):
+        return {'videos'      : self.count,
+                'bytes'       : self.bytes,
+                'cameras'     : self.get_camera_bytes(),
+                'dates'       : self.get_date_bytes(),
+                'eta_seconds' : self.get_eta(throughput)}
+
 class DHFS41:
     def __init__(self, DEBUG=False):
         self.PART_TABLE_OFF = 0x3C00
@@ -10,59 +694,127 @@ class DHFS41:
         self.img_loaded = False
         self.disk      = None
         self.num_parts = 0
+        self.video_catalog = None
+        self.log_index = None
+        # A future per partition being loaded (see load_descs)
+        self.part_loads = []
+        self.load_thread = None
+        self.frame_indexes = OrderedDict()
+        self.frame_indexes_lock = threading.Lock()
+        self.manifests = {}
+        self.manifests_lock = threading.Lock()
+        # MB/s of the last extraction, to estimate the time of the next one
+        self.extract_throughput = None
+        # Long operations stop early, returning what they did so far, once
+        # cancel_event is set; progress_func(done, total, unit) follows them
+        self.cancel_event  = threading.Event()
+        self.progress_func = None
+        # Phase timers and read counters, kept while PROFILE is set
+        self.profiler = Profiler()
 
         self.DEBUG = DEBUG
         self.config={}
         self.config['DEBUG'] = DEBUG
         self.config['CARVE_SIGNAT'] = re.compile(b"^\x44\x48\x49\x49")
+        self.config['MMAP'] = False
+        self.config['EXTRACT_WORKERS'] = min(8, os.cpu_count() or 1)
+        self.config['EXTRACT_POOL'] = "thread"
+        self.config['LOAD_WORKERS'] = min(4, os.cpu_count() or 1)
+        self.config['CARVE_WORKERS'] = os.cpu_count() or 1
+        self.config['CARVE_CHUNK'] = 256 * 1024 * 1024
+        # Largest carved extent, in bytes; 0 for no limit
+        self.config['CARVE_MAX_SIZE'] = 0
+        self.config['CATALOG_CACHE'] = True
+        self.config['CACHE_DIR'] = os.path.join(os.path.expanduser("~"), ".cache", "dhfs_extractor")
+        self.config['HASH'] = []
+        self.config['HASH_PIECES'] = False
+        self.config['PROFILE'] = False
+        self.config['LOG_RECORD_SIZE'] = LOG_RECORD_SIZE
+        self.config['LOG_FIELDS'] = parse_log_fields(LOG_FIELDS)
+        self.config['LOG_TIME'] = "packed"
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def report_progress(self, done, total, unit="bytes"):
+        if self.progress_func:
+            self.progress_func(done, total, unit)
+
+    def set_profiling(self, enabled):
+        self.config['PROFILE'] = enabled
+        self.profiler.enabled  = enabled
+        if self.disk:
+            self.disk.profiler = self.profiler if enabled else None
+
+    def get_profile(self):
+        # {'phases': {name: {seconds, calls}}, 'counters': {name: value}}
+        # since the image was loaded; reads of process pool workers are
+        # not counted
+        return self.profiler.get_report()
 
     def get_num_descs(self, part_idx):
-        return len(self.all_descs[part_idx]) // self.DESC_SIZE
+        return len(self.desc_table[part_idx])
 
     def get_desc(self, part_idx, desc_idx):
         off_desc = desc_idx * self.DESC_SIZE
         return self.all_descs[part_idx][off_desc: off_desc+self.DESC_SIZE]
 
+    def get_desc_table(self, part_idx):
+        # Structured view over the raw descriptor bytes (no copy)
+        return self.desc_table[part_idx]
+
+    def get_desc_column(self, part_idx, field):
+        return self.desc_table[part_idx][field]
+
+    def get_desc_field(self, part_idx, desc_idx, field):
+        column = self.desc_table[part_idx][field]
+        if 0 <= desc_idx < len(column):
+            return int(column[desc_idx])
+        return 0
+
     def get_desc_type(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return  int.from_bytes(desc[0:1], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'type')
 
     def get_begin_desc(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[24:28], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'begin_desc')
 
     def get_next_desc(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[12:16], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'next')
 
     def get_prev_desc(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[20:24], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'prev')
 
     def get_last_desc(self, part_idx, desc_idx):
-        nextDesc = self.get_next_desc(part_idx, desc_idx)
-        if nextDesc == 0:
-            return desc_idx
-        return self.get_last_desc(part_idx, nextDesc)
+        chain = self.walk_chain(part_idx, desc_idx)
+        return chain[-1] if chain else desc_idx
+
+    def get_main_desc(self, part_idx, desc_idx):
+        # Follows begin_desc up to the type 1 descriptor of the video. If
+        # the links loop or leave the table, the descriptor stands for itself.
+        visited = set()
+        main_idx = desc_idx
+        while self.get_desc_type(part_idx, main_idx) != 1:
+            visited.add(main_idx)
+            main_idx = self.get_begin_desc(part_idx, main_idx)
+            if main_idx in visited or main_idx >= self.get_num_descs(part_idx):
+                return desc_idx
+        return main_idx
 
     def get_num_frags(self, part_idx, desc_idx):
-        if self.get_desc_type(part_idx, desc_idx) == 1:
-            desc = self.get_desc(part_idx, desc_idx)
-            return int.from_bytes(desc[2:4], byteorder='little') + 1
-        else:
-            return self.get_num_frags(part_idx,
-                            self.get_begin_desc(part_idx, desc_idx))
+        main_idx = self.get_main_desc(part_idx, desc_idx)
+        return self.get_desc_field(part_idx, main_idx, 'frag') + 1
 
     def get_frag_number(self, part_idx, desc_idx):
         if self.get_desc_type(part_idx, desc_idx) == 1:
             return 0
 
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[2:4], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'frag')
 
     def get_camera(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[1:2], byteorder='little') - 48 + 1
+        return self.get_desc_field(part_idx, desc_idx, 'camera') - 48 + 1
 
     def decode_timestamp(self, ts):
         return extract_bits(ts, 31, 6), extract_bits(ts, 25, 4), \
@@ -70,17 +822,14 @@ class DHFS41:
                extract_bits(ts, 11, 6), extract_bits(ts, 5, 6)
 
     def get_timestamps(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return (int.from_bytes(desc[4:8], byteorder='little'),
-                int.from_bytes(desc[8:12], byteorder='little'))
+        return (self.get_desc_field(part_idx, desc_idx, 'begin_ts'),
+                self.get_desc_field(part_idx, desc_idx, 'end_ts'))
 
     def get_begin_timestamp(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[4:8], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'begin_ts')
 
     def get_end_timestamp(self, part_idx, desc_idx):
-        desc = self.get_desc(part_idx, desc_idx)
-        return int.from_bytes(desc[8:12], byteorder='little')
+        return self.get_desc_field(part_idx, desc_idx, 'end_ts')
 
     def get_begin_date(self, part_idx, desc_idx):
         beginTimeStamp = self.get_begin_timestamp(part_idx, desc_idx)
@@ -124,6 +873,107 @@ class DHFS41:
         }
         return dic
 
+    def get_main_descs_of(self, part_idx, descs):
+        # get_main_desc for an array of descriptors: a few vectorized hops
+        # along begin_desc, and the descriptors still on the way (loops or
+        # unusually long paths) resolved one by one
+        table = self.desc_table[part_idx]
+        types, begins = table['type'], table['begin_desc']
+        main  = descs.astype(np.int64)
+        valid = np.ones(len(main), dtype=bool)
+        active = types[main] != 1
+        for _ in range(8):
+            if not active.any():
+                break
+            pos = np.flatnonzero(active)
+            nxt = begins[main[pos]].astype(np.int64)
+            # Out of the table, or back to itself or to the start: a loop
+            inside = (nxt < len(table)) & (nxt != main[pos]) & (nxt != descs[pos])
+            valid[pos[~inside]] = False
+            active[pos[~inside]] = False
+            main[pos[inside]] = nxt[inside]
+            active[pos[inside]] = types[nxt[inside]] != 1
+        for pos in np.flatnonzero(active).tolist():
+            main[pos] = self.get_main_desc(part_idx, int(descs[pos]))
+        main[~valid] = descs[~valid]
+        return main
+
+    def iter_descriptor_rows(self, part_idx, category, descs, chain_lengths, batch_size):
+        # Column tuples of a batch of descriptors, in EXPORT_COLUMNS order
+        # with begTime and endTime split into their six fields
+        table     = self.desc_table[part_idx]
+        frag_size = self.FRAG_SIZES[part_idx]
+        # "xx xx ..." of each descriptor, cut from the hex of the whole batch
+        hex_rows  = lambda text, size: [text[pos:pos+size*3-1] for pos in range(0, len(text), size*3)]
+        for first in range(0, len(descs), batch_size):
+            batch = descs[first:first+batch_size].astype(np.int64)
+            rows  = table[batch]
+            main  = table[self.get_main_descs_of(part_idx, batch)]
+            ts_fields = []
+            for column in ('begin_ts', 'end_ts'):
+                ts = rows[column].astype(np.int64)
+                ts_fields += [extract_bits(ts, 31, 6), extract_bits(ts, 25, 4), extract_bits(ts, 21, 5),
+                              extract_bits(ts, 16, 5), extract_bits(ts, 11, 6), extract_bits(ts, 5, 6)]
+            tot_frags = main['frag'].astype(np.int64) + 1
+            size_last = main['last_size'].astype(np.int64) * self.BLK_SIZES[part_idx]
+            columns = ([np.full(len(batch), part_idx), batch, [category] * len(batch),
+                        rows['type'], rows['camera'].astype(np.int64) - 48 + 1] + ts_fields +
+                       [np.where(rows['type'] == 1, 0, rows['frag']), tot_frags,
+                        rows['begin_desc'], rows['prev'], rows['next'], size_last,
+                        (tot_frags - 1) * frag_size + size_last,
+                        chain_lengths[first:first+batch_size],
+                        self.PART_OFFS[part_idx] + self.VID_OFF[part_idx] + batch * frag_size,
+                        hex_rows(rows.tobytes().hex(" "), self.DESC_SIZE)])
+            yield zip(*[column if isinstance(column, list) else column.tolist() for column in columns])
+
+    def get_descriptor_sets(self, part_idx, categories):
+        # (category, descs, chain lengths) of the descriptors to export
+        chains = self.frags_in_videos[part_idx]
+        if "main" in categories:
+            yield "main", chains.heads, chains.get_chain_lengths()
+        if "free" in categories:
+            free = self.free_frags[part_idx]
+            yield "free", free, np.ones(len(free), dtype=np.int64)
+        if "dirty" in categories:
+            # Length of the dirty chain each descriptor is saved in
+            dirty  = self.dirty_frags[part_idx]
+            dirty_chains = self.build_dirty_chains(part_idx)
+            lengths = dirty_chains.get_chain_lengths()[dirty_chains.owner[dirty]]
+            yield "dirty", dirty, lengths
+
+    def export_descriptors(self, out_file, fmt="csv", categories=("main", "free", "dirty"),
+                           batch_size=EXPORT_BATCH):
+        # Writes main, free and dirty descriptors of every partition to the
+        # text file out_file as CSV (";" separated, with a header) or JSON
+        # lines. Rows are formatted a batch at a time from the table
+        # columns, so memory doesn't grow with the number of descriptors.
+        # Returns the number of rows written.
+        if fmt == "csv":
+            out_file.write(";".join(EXPORT_COLUMNS) + "\n")
+            template = ";".join(["%d", "%d", "%s", "%d", "%02d", EXPORT_TIME, EXPORT_TIME] +
+                                ["%d"] * 9 + ["%s"]) + "\n"
+        else:
+            fields = []
+            for name in EXPORT_COLUMNS:
+                if name in ("category", "hex"):
+                    fields.append(f'"{name}": "%s"')
+                elif name in ("begTime", "endTime"):
+                    fields.append(f'"{name}": "{EXPORT_TIME}"')
+                else:
+                    fields.append(f'"{name}": %d')
+            template = "{" + ", ".join(fields) + "}\n"
+
+        total = 0
+        for part_idx in range(self.get_num_partitions()):
+            for category, descs, chain_lengths in self.get_descriptor_sets(part_idx, categories):
+                for rows in self.iter_descriptor_rows(part_idx, category, descs, chain_lengths, batch_size):
+                    if self.is_cancelled():
+                        return total
+                    lines = [template % row for row in rows]
+                    out_file.write("".join(lines))
+                    total += len(lines)
+        return total
+
     def load_partition_table(self):
         self.PART_OFFS = []
         self.SB_OFFS   = []
@@ -144,51 +994,144 @@ class DHFS41:
     def get_num_partitions(self):
         return self.num_parts
 
-    def load_image(self, path):
+    def load_image(self, path, use_mmap=None, on_partition=None, wait=True):
+        # on_partition(part_idx, error) is called, from a loading thread,
+        # as each partition is loaded (error is None) or fails. With
+        # wait=False this returns once the superblocks are read: partitions
+        # are used as they are ready (see wait_partition), and the catalog
+        # holds those ready so far. Otherwise a loader's error is raised.
+        self.wait_loaded()
         if self.img_loaded:
             self.disk.close()
             self.img_loaded = False
-
-        self.disk = open(path, "rb")
+        self.part_loads = []
+        self.video_catalog = None
+        self.log_index = None
+        with self.frame_indexes_lock:
+            self.frame_indexes.clear()
+
+        if use_mmap is None:
+            use_mmap = self.config['MMAP']
+        self.profiler.reset()
+        self.disk = ImageReader(path, use_mmap)
+        self.set_profiling(self.config['PROFILE'])
         if self.disk.read(7) in [b'DHFS4.1']:
-            self.load_partition_table()
-
-            #TODO: It needs processing each partition
-            self.disk.seek(self.PART_OFFS[0] + self.SB_OFFS[0] + 0x10)
-            self.first_date = int.from_bytes(self.disk.read(4), byteorder='little')
-            self.last_date = int.from_bytes(self.disk.read(4), byteorder='little')
-
-            self.disk.seek(self.PART_OFFS[0] + self.SB_OFFS[0] + 0x2c)
-            self.BLK_SIZE = int.from_bytes(self.disk.read(4), byteorder='little')
-            self.FRAG_SIZE = int.from_bytes(self.disk.read(4),byteorder='little') * self.BLK_SIZE
-
-            self.disk.seek(self.PART_OFFS[0] + self.SB_OFFS[0] + 0x38)
-            self.FRAG_RESERVED = (int.from_bytes(self.disk.read(4), byteorder='little'))
-
-            self.disk.seek(self.PART_OFFS[0] + self.SB_OFFS[0] + 0xF8)
-            self.logs_offset = int.from_bytes(self.disk.read(4), byteorder='little') * self.BLK_SIZE
+            with self.profiler.phase("partition_table"):
+                self.load_partition_table()
+            with self.profiler.phase("superblocks"):
+                self.load_superblocks()
+
+            # Partition 0 values, kept for code that assumes a single geometry
+            self.first_date    = self.FIRST_DATES[0]
+            self.last_date     = self.LAST_DATES[0]
+            self.BLK_SIZE      = self.BLK_SIZES[0]
+            self.FRAG_SIZE     = self.FRAG_SIZES[0]
+            self.FRAG_RESERVED = self.FRAGS_RESERVED[0]
+            self.logs_offset   = self.LOGS_OFFS[0]
 
             self.img_loaded = True
-            self.load_descs()
+            with self.profiler.phase("load_descs"):
+                self.load_descs(on_partition, wait)
             self.print_metadata()
             #print ("Last offset: ", self.PART_OFFS[0] + self.VID_OFF + self.NUM_FRAGS*self.FRAG_SIZE )
 
         return self.img_loaded
 
+    def load_superblocks(self):
+        # Each partition has its own superblock, and so its own geometry
+        self.FIRST_DATES    = []
+        self.LAST_DATES     = []
+        self.BLK_SIZES      = []
+        self.FRAG_SIZES     = []
+        self.FRAGS_RESERVED = []
+        self.LOGS_OFFS      = []
+        self.DESC_OFF  = []
+        self.VID_OFF   = []
+        self.NUM_FRAGS = []
+
+        for part_idx, part_offset in enumerate(self.PART_OFFS):
+            sb = self.disk.read_at(part_offset + self.SB_OFFS[part_idx], 0x100)
+            field = lambda off: int.from_bytes(sb[off:off+4], byteorder='little')
+
+            blk_size = field(0x2c)
+            self.FIRST_DATES.append(field(0x10))
+            self.LAST_DATES.append(field(0x14))
+            self.BLK_SIZES.append(blk_size)
+            self.FRAG_SIZES.append(field(0x30) * blk_size)
+            self.FRAGS_RESERVED.append(field(0x38))
+            self.DESC_OFF.append(field(0x44) * blk_size)
+            self.VID_OFF.append(field(0x48) * blk_size)
+            self.NUM_FRAGS.append(field(0x4C))
+            self.LOGS_OFFS.append(field(0xF8) * blk_size)
+
+    def get_video_catalog(self):
+        # Over the partitions ready so far, rebuilt as more are ready
+        ready = self.get_ready_partitions()
+        if self.video_catalog is None or self.video_catalog.partitions != ready:
+            with self.profiler.phase("catalog"):
+                self.video_catalog = VideoCatalog(self, ready)
+        return self.video_catalog
+
+    def find_videos(self, start, end=None, camera=None):
+        # (part_idx, desc_idx) of the videos recording at some moment
+        # between start and end ("YYYY-MM-DD[ HH:MM:SS]" or epoch
+        # seconds; end defaults to start, a point in time query)
+        if isinstance(start, str):
+            start = text_to_epoch(start)
+        if end is None:
+            end = start
+        elif isinstance(end, str):
+            end = text_to_epoch(end) + (86399 if len(end.strip()) == 10 else 0)
+        catalog = self.get_video_catalog()
+        return [catalog.get_video(row) for row in catalog.select_time(start, end, camera).tolist()]
+
+    def get_coverage(self, camera=None):
+        # Recorded periods of camera (all cameras if None) as a list of
+        # ("YYYY-MM-DD HH:MM:SS", "YYYY-MM-DD HH:MM:SS") runs
+        run_begins, run_ends = self.get_video_catalog().get_interval_index(camera).get_coverage()
+        return [(epoch_to_text(b), epoch_to_text(e)) for b, e in zip(run_begins.tolist(), run_ends.tolist())]
+
+    def get_gaps(self, camera=None, start=None, end=None):
+        if isinstance(start, str):
+            start = text_to_epoch(start)
+        if isinstance(end, str):
+            end = text_to_epoch(end) + (86399 if len(end.strip()) == 10 else 0)
+        gap_begins, gap_ends = self.get_video_catalog().get_interval_index(camera).get_gaps(start, end)
+        return [(epoch_to_text(b), epoch_to_text(e)) for b, e in zip(gap_begins.tolist(), gap_ends.tolist())]
+
+    def wait_partition(self, part_idx, timeout=None):
+        # Waits for a partition to be loaded, raising its loader's error
+        # (or TimeoutError)
+        self.part_loads[part_idx].result(timeout)
+
+    def is_partition_ready(self, part_idx):
+        load = self.part_loads[part_idx]
+        return load.done() and load.exception() is None
+
+    def get_ready_partitions(self):
+        return [part_idx for part_idx in range(len(self.part_loads)) if self.is_partition_ready(part_idx)]
+
+    def wait_loaded(self):
+        # Waits for a load_image(wait=False) to finish, errors aside
+        if self.load_thread:
+            self.load_thread.join()
+            self.load_thread = None
+
     def get_image_metadata(self):
         if self.img_loaded:
             message  =  "*"*20+" Disk Metadata "+"*"*20+"\n"
-            message += f"Block size: {self.BLK_SIZE}\n"
-            message += f"Fragment Size: {self.FRAG_SIZE}\n"
-            message += f"Fragments Reserved: {self.FRAG_RESERVED}/partition\n"
             for part_idx in range(self.num_parts):
                 part_offset = self.PART_OFFS[part_idx]
+                frag_size   = self.FRAG_SIZES[part_idx]
                 message += "-"*20+f" Partition {part_idx} "+"-"*20+"\n"
+                message += f"\tBlock size: {self.BLK_SIZES[part_idx]}\n"
+                message += f"\tFragment Size: {frag_size}\n"
+                message += f"\tFragments Reserved: {self.FRAGS_RESERVED[part_idx]}\n"
                 message += f"\tDescriptors offset: {part_offset + self.DESC_OFF[part_idx]}\n"
                 message += f"\tNumber of fragmentes: {self.NUM_FRAGS[part_idx]}\n"
                 message += f"\tVideos offset: {part_offset + self.VID_OFF[part_idx]}\n"
                 message += "\tVideos offset after reserved: "
-                message += f"{part_offset + self.VID_OFF[part_idx] + self.FRAG_RESERVED*self.FRAG_SIZE}\n"
+                message += f"{part_offset + self.VID_OFF[part_idx] + self.FRAGS_RESERVED[part_idx]*frag_size}\n"
             return message
         else:
             return "No image loaded!!!"
@@ -197,295 +1140,1191 @@ class DHFS41:
         print (self.get_image_metadata())
 
     def get_desc_types(self, part_idx):
-        all_desc_types = {}
-        for indx in range(self.NUM_FRAGS[part_idx]):
-            desc_type = self.get_desc_type(part_idx, indx)
-            all_desc_types[desc_type] = all_desc_types.get(desc_type, 0) + 1
-        return all_desc_types
+        counts = np.bincount(self.desc_table[part_idx]['type'], minlength=1)
+        return {desc_type: int(count) for desc_type, count in enumerate(counts) if count}
 
     def get_last_frag_size(self, part_idx, desc_idx):
-        if self.get_desc_type(part_idx, desc_idx) == 1:
-            desc = self.get_desc(part_idx, desc_idx)
-            return int.from_bytes(desc[16:20], byteorder='little') * self.BLK_SIZE
-        else:
-            return self.get_last_frag_size(part_idx,
-                            self.get_begin_desc(part_idx, desc_idx))
-
-    def get_frags_video(self, part_idx, desc_idx):
-        allFrags = []
-        begDesc = desc_idx
-        numFrags = self.get_num_frags(part_idx, desc_idx)
-
-        idx = 0
-        while desc_idx != 0 and desc_idx != 0xFFFFFFFF:
-            allFrags.append(desc_idx)
-            idx += 1
+        main_idx = self.get_main_desc(part_idx, desc_idx)
+        return self.get_desc_field(part_idx, main_idx, 'last_size') * self.BLK_SIZES[part_idx]
+
+    def walk_chain(self, part_idx, desc_idx):
+        # Follows next pointers, stopping at the end marker, at a pointer
+        # out of the table or when a descriptor repeats.
+        chain = []
+        visited = set()
+        while desc_idx != 0 and desc_idx != NO_DESC:
+            if desc_idx in visited or desc_idx >= self.get_num_descs(part_idx):
+                break
+            visited.add(desc_idx)
+            chain.append(desc_idx)
             desc_idx = self.get_next_desc(part_idx, desc_idx)
+        return chain
 
-        if  self.DEBUG and (idx > numFrags):
-            print (f"\t\tVideo {begDesc} in partition {part_idx} has more frags "+
-                   "than in main desc. 'Extract' will use greater size!")
-        return allFrags
+    def get_frags_video(self, part_idx, desc_idx):
+        frags = self.frags_in_videos[part_idx].get(desc_idx)
+        if frags is None:
+            frags = self.walk_chain(part_idx, desc_idx)
+        return frags
+
+    def build_chain_index(self, part_idx, linking=None):
+        # See link_chains; linking is the future of a worker doing it
+        chains = linking.result() if linking else link_chains(self.desc_table[part_idx])
+        if self.DEBUG:
+            num_frags = self.desc_table[part_idx]['frag'][chains.heads]
+            for head in chains.heads[chains.lengths > num_frags.astype(np.int64) + 1].tolist():
+                print (f"\t\tVideo {head} in partition {part_idx} has more frags "+
+                       "than in main desc. 'Extract' will use greater size!")
+            for kind, head, desc_idx in chains.anomalies:
+                print (f"\t\tVideo {head} in partition {part_idx}: {kind} "+
+                       f"link to desc {desc_idx}.")
+        return chains
+
+    def get_main_descs_array(self, part_idx):
+        return get_main_descs(self.desc_table[part_idx])
+
+    def get_free_descs_array(self, part_idx):
+        return np.flatnonzero(self.desc_table[part_idx]['type'] == 0)
+
+    def get_dirty_descs_array(self, part_idx):
+        # Type 2 descriptors that are not in the chain of their begin desc
+        table  = self.desc_table[part_idx]
+        chains = self.frags_in_videos[part_idx]
+        descs  = np.flatnonzero(table['type'] == 2)
+        owner  = chains.owner[descs]
+        in_video   = owner >= 0
+        owner_head = np.full(len(descs), -1, dtype=np.int64)
+        owner_head[in_video] = chains.heads[owner[in_video]]
+        return descs[owner_head != table['begin_desc'][descs]]
 
     def get_main_descs(self, part_idx):
         if self.img_loaded:
-            for desc_idx in range(self.NUM_FRAGS[part_idx]):
-                desc_type  = self.get_desc_type(part_idx, desc_idx)
-                begin_time, end_time = self.get_timestamps(part_idx, desc_idx)
-
-                if (desc_type in [1]) and begin_time != end_time:
-                    yield desc_idx
+            yield from self.get_main_descs_array(part_idx).tolist()
         return
 
     def get_free_descs(self, part_idx):
         if self.img_loaded:
-            for desc_idx in range(self.NUM_FRAGS[part_idx]):
-                desc_type  = self.get_desc_type(part_idx, desc_idx)
-                if desc_type == 0:
-                    yield desc_idx
+            yield from self.get_free_descs_array(part_idx).tolist()
         return
 
     def get_dirty_descs(self, part_idx):
         if self.img_loaded:
-            for desc_idx in range(self.NUM_FRAGS[part_idx]):
-                desc_type  = self.get_desc_type(part_idx, desc_idx)
-
-                if desc_type == 2:
-                    begin_desc = self.get_begin_desc(part_idx, desc_idx)
-                    frags_begin = self.frags_in_videos[part_idx].get(begin_desc, [])
-                    if desc_idx not in frags_begin:
-                        yield desc_idx
+            yield from self.get_dirty_descs_array(part_idx).tolist()
         return
 
-    def load_descs(self):
-        self.DESC_OFF = []
-        self.VID_OFF = []
-        self.NUM_FRAGS = []
-        self.all_descs = []
-        self.num_videos = []
-
-        for part_offset in self.PART_OFFS:
-            self.disk.seek(part_offset + self.SB_OFFS[0] + 0x44)
-            self.DESC_OFF.append(int.from_bytes(self.disk.read(4),
-                                        byteorder='little') * self.BLK_SIZE)
-            self.VID_OFF.append(int.from_bytes(self.disk.read(4),
-                                        byteorder='little') * self.BLK_SIZE)
-            self.NUM_FRAGS.append(int.from_bytes(self.disk.read(4),
-                                        byteorder='little'))
-
-            self.disk.seek(part_offset + self.DESC_OFF[-1])
-            self.all_descs.append(self.disk.read(self.DESC_SIZE * self.NUM_FRAGS[-1]))
-
-        self.frags_in_videos = []
-        self.free_frags = []
-        self.dirty_frags = []
-
+    def load_descs(self, on_partition=None, wait=True):
+        num_parts = self.num_parts
+        self.all_descs       = [None] * num_parts
+        self.desc_table      = [None] * num_parts
+        self.frags_in_videos = [None] * num_parts
+        self.free_frags      = [None] * num_parts
+        self.dirty_frags     = [None] * num_parts
+        self.part_loads      = []
+
+        identity = None
+        if self.config['CATALOG_CACHE']:
+            with self.profiler.phase("cache_lookup"):
+                identity = self.get_image_identity()
+                cached = self.load_catalog_cache(identity)
+            if cached:
+                for part_idx in range(num_parts):
+                    self.part_loads.append(Future())
+                    self.part_loads[-1].set_result(None)
+                    if on_partition:
+                        on_partition(part_idx, None)
+                return
+
+        # Partitions are independent: each is read and classified by a
+        # thread, and linked on a process pool (see LINK_PROCESS_DESCS)
+        # when there are several to link, so they load in parallel.
+        # Linking jobs are all queued here, before any loading thread runs.
+        workers = max(min(self.config['LOAD_WORKERS'], num_parts), 1)
+        linker  = None
+        linking = [None] * num_parts
+        if workers > 1 and sum(self.NUM_FRAGS) >= LINK_PROCESS_DESCS:
+            linker  = ProcessPoolExecutor(workers, initializer=open_worker_image,
+                                          initargs=(self.disk.path, self.disk.use_mmap))
+            linking = [linker.submit(link_chains_in_worker, *self.get_desc_table_extent(part_idx))
+                       for part_idx in range(num_parts)]
+        executor = ThreadPoolExecutor(workers)
+        self.part_loads = [executor.submit(self.load_partition, part_idx, linking[part_idx])
+                           for part_idx in range(num_parts)]
+        if on_partition:
+            for part_idx, load in enumerate(self.part_loads):
+                load.add_done_callback(lambda load, part_idx=part_idx:
+                                       on_partition(part_idx, load.exception()))
+
+        def finish_load():
+            try:
+                for load in self.part_loads:
+                    load.result()
+            finally:
+                executor.shutdown()
+                if linker:
+                    linker.shutdown()
+            if identity:
+                with self.profiler.phase("cache_save"):
+                    self.save_catalog_cache(identity)
+
+        if wait:
+            finish_load()
+            return
+
+        def finish_in_background():
+            try:
+                finish_load()
+            except Exception:
+                # Kept by the failed partition's future (see wait_partition)
+                pass
+        self.load_thread = threading.Thread(target=finish_in_background, daemon=True)
+        self.load_thread.start()
+
+    def get_desc_table_extent(self, part_idx):
+        return self.PART_OFFS[part_idx] + self.DESC_OFF[part_idx], self.DESC_SIZE * self.NUM_FRAGS[part_idx]
+
+    def load_partition(self, part_idx, linking=None):
+        # linking, if given, is the future of link_chains_in_worker for it
+        profiler = self.profiler
+        with profiler.phase("read_descs"):
+            all_descs = self.disk.read_at(*self.get_desc_table_extent(part_idx))
+            self.all_descs[part_idx]  = all_descs
+            self.desc_table[part_idx] = np.frombuffer(all_descs, dtype=DESC_DTYPE,
+                                                      count=len(all_descs) // self.DESC_SIZE)
+        profiler.count("descs_read", len(self.desc_table[part_idx]))
+        if self.DEBUG or profiler.enabled:
+            with profiler.phase("count_types"):
+                desc_types = self.get_desc_types(part_idx)
+        if self.DEBUG:
+            print (f"Partition {part_idx}: {desc_types}")
+            print (f"\tPartition {part_idx}: linking fragments to each main desc...")
+        with profiler.phase("chain_linking"):
+            self.frags_in_videos[part_idx] = self.build_chain_index(part_idx, linking)
+        profiler.count("frags_linked", len(self.frags_in_videos[part_idx].frags))
+
+        if self.DEBUG:
+            print (f"\tPartition {part_idx}: getting free and dirty fragments...")
+        with profiler.phase("classify"):
+            self.free_frags[part_idx]  = self.get_free_descs_array(part_idx)
+            self.dirty_frags[part_idx] = self.get_dirty_descs_array(part_idx)
+
+    def get_image_identity(self):
+        # Cheap fingerprint of the image: size, mtime and a digest of the
+        # header, the superblocks and evenly spaced samples of each
+        # descriptor table (first and last blocks included)
+        digest = hashlib.sha256(self.disk.read_at(0, self.PART_TABLE_OFF + 0x400))
+        for part_idx, part_offset in enumerate(self.PART_OFFS):
+            digest.update(self.disk.read_at(part_offset + self.SB_OFFS[part_idx], 0x100))
+            table_offset = part_offset + self.DESC_OFF[part_idx]
+            table_size   = self.DESC_SIZE * self.NUM_FRAGS[part_idx]
+            step = max(table_size // CACHE_SAMPLES, CACHE_SAMPLE_SIZE)
+            for sample_off in list(range(0, table_size, step)) + [table_size - CACHE_SAMPLE_SIZE]:
+                sample_off = max(sample_off, 0)
+                digest.update(self.disk.read_at(table_offset + sample_off,
+                                                min(CACHE_SAMPLE_SIZE, table_size - sample_off)))
+        return {'size'  : self.disk.get_size(),
+                'mtime' : self.disk.get_mtime(),
+                'digest': digest.hexdigest()}
+
+    def get_cache_path(self):
+        image_key = hashlib.sha256(os.path.realpath(self.disk.path).encode()).hexdigest()
+        return os.path.join(self.config['CACHE_DIR'], image_key[:32] + ".dhfscat")
+
+    def save_catalog_cache(self, identity):
+        arrays = {}
+        partitions = []
         for part_idx in range(self.num_parts):
+            chains = self.frags_in_videos[part_idx]
+            arrays[f"{part_idx}.descs"]   = np.frombuffer(self.all_descs[part_idx], dtype=np.uint8)
+            arrays[f"{part_idx}.heads"]   = chains.heads
+            arrays[f"{part_idx}.offsets"] = chains.offsets
+            arrays[f"{part_idx}.frags"]   = chains.frags
+            arrays[f"{part_idx}.owner"]   = chains.owner
+            arrays[f"{part_idx}.links"]   = chains.links
+            arrays[f"{part_idx}.loops"]   = chains.loops
+            arrays[f"{part_idx}.lengths"] = chains.lengths
+            arrays[f"{part_idx}.free"]    = self.free_frags[part_idx]
+            arrays[f"{part_idx}.dirty"]   = self.dirty_frags[part_idx]
+            partitions.append({'anomalies': chains.anomalies})
+        try:
+            os.makedirs(self.config['CACHE_DIR'], exist_ok=True)
+            dhfs_cache.write_cache(self.get_cache_path(),
+                                   {'identity': identity, 'partitions': partitions}, arrays)
+        except OSError as e:
             if self.DEBUG:
-                print ("Partition: ", part_idx)
-                print ("\tGetting desc types...")
-
-            all_desc_types = self.get_desc_types(part_idx)
-
-            if self.DEBUG:
-                print ("\tLinking fragments to each main desc...")
-            frags_in_videos = {}
-            for desc_idx in self.get_main_descs(part_idx):
-                frags_in_videos[desc_idx] = self.get_frags_video(part_idx, desc_idx)
-            self.frags_in_videos.append(frags_in_videos)
-
-            if self.DEBUG:
-                print ("\tGetting free fragments...")
-            self.free_frags.append([])
-            for desc_idx in self.get_free_descs(part_idx):
-                self.free_frags[part_idx].append(desc_idx)
-
+                print ("Catalog cache not saved:", e)
+
+    def load_catalog_cache(self, identity):
+        cache = dhfs_cache.read_cache(self.get_cache_path())
+        if cache is None:
+            return False
+        header, arrays = cache
+        if header['identity'] != identity or len(header['partitions']) != self.num_parts:
             if self.DEBUG:
-                print ("\tGetting dirty fragments...")
-            self.dirty_frags.append([])
-            for desc_idx in self.get_dirty_descs(part_idx):
-                self.dirty_frags[part_idx].append(desc_idx)
-                
-        #print ("Fragmentos encadeados em videos", fragsInVideos)
-        #print ("Fragmentos alocdos", fragsAloc)
+                print ("Catalog cache is stale, rebuilding...")
+            return False
+
+        for part_idx, part_info in enumerate(header['partitions']):
+            descs = arrays[f"{part_idx}.descs"]
+            self.all_descs[part_idx]  = memoryview(descs)
+            self.desc_table[part_idx] = np.frombuffer(descs, dtype=DESC_DTYPE,
+                                                      count=len(descs) // self.DESC_SIZE)
+            self.frags_in_videos[part_idx] = ChainIndex(arrays[f"{part_idx}.heads"],
+                                                        arrays[f"{part_idx}.offsets"],
+                                                        arrays[f"{part_idx}.frags"],
+                                                        arrays[f"{part_idx}.owner"],
+                                                        [tuple(a) for a in part_info['anomalies']],
+                                                        arrays[f"{part_idx}.links"],
+                                                        arrays[f"{part_idx}.loops"],
+                                                        arrays[f"{part_idx}.lengths"])
+            self.free_frags[part_idx]  = arrays[f"{part_idx}.free"]
+            self.dirty_frags[part_idx] = arrays[f"{part_idx}.dirty"]
+        if self.DEBUG:
+            print ("Catalog loaded from cache", self.get_cache_path())
+        return True
 
     def get_slack_size(self, part_idx, desc_idx):
-        if self.get_desc_type(part_idx, desc_idx) == 1:
-            desc = self.get_desc(part_idx, desc_idx)
-            return self.FRAG_SIZE - self.get_last_frag_size(part_idx, desc_idx)
-        else:
-            return self.get_slack_size(part_idx,
-                            self.get_begin_desc(part_idx, desc_idx))
+        return self.FRAG_SIZES[part_idx] - self.get_last_frag_size(part_idx, desc_idx)
 
     def get_video_size(self, part_idx, desc_idx):
-        return ((self.get_num_frags(part_idx, desc_idx) - 1) * self.FRAG_SIZE +
+        return ((self.get_num_frags(part_idx, desc_idx) - 1) * self.FRAG_SIZES[part_idx] +
                 self.get_last_frag_size(part_idx, desc_idx))
 
+    def get_frag_offset(self, part_idx, fIndx):
+        return (self.PART_OFFS[part_idx] + self.VID_OFF[part_idx] +
+                fIndx * self.FRAG_SIZES[part_idx])
+
     def read_fragment(self, part_idx, fIndx):
-        self.disk.seek(self.PART_OFFS[part_idx] + self.VID_OFF[part_idx] +
-                        fIndx * self.FRAG_SIZE)
-        return self.disk.read(self.FRAG_SIZE)
+        return self.disk.view(self.get_frag_offset(part_idx, fIndx), self.FRAG_SIZES[part_idx])
 
     def read_last_fragment(self, part_idx, fIndx):
-        self.disk.seek(self.PART_OFFS[part_idx] + self.VID_OFF[part_idx] +
-                        fIndx * self.FRAG_SIZE)
-        return self.disk.read(self.get_last_frag_size(part_idx, fIndx))
+        return self.disk.view(self.get_frag_offset(part_idx, fIndx),
+                              self.get_last_frag_size(part_idx, fIndx))
 
     def read_slack_fragment (self, part_idx, fIndx):
         posSlack = self.get_last_frag_size(part_idx, fIndx)
-        self.disk.seek(self.PART_OFFS[part_idx] + self.VID_OFF[part_idx] +
-                        fIndx * self.FRAG_SIZE + posSlack)
-        return self.disk.read(self.FRAG_SIZE - posSlack)
+        return self.disk.view(self.get_frag_offset(part_idx, fIndx) + posSlack,
+                              self.FRAG_SIZES[part_idx] - posSlack)
+
+    def get_frags_extents(self, part_idx, frags):
+        # (offset, size) of whole fragments on the image, joining those
+        # that are physically adjacent
+        frag_size = self.FRAG_SIZES[part_idx]
+        extents = []
+        for frag_idx in frags:
+            offset = self.get_frag_offset(part_idx, frag_idx)
+            if extents and extents[-1][0] + extents[-1][1] == offset:
+                extents[-1][1] += frag_size
+            else:
+                extents.append([offset, frag_size])
+        return extents
+
+    def get_video_extents(self, part_idx, desc_idx):
+        frags = self.get_frags_video(part_idx, desc_idx)
+        extents = self.get_frags_extents(part_idx, frags)
+        if extents:
+            extents[-1][1] -= self.FRAG_SIZES[part_idx] - self.get_last_frag_size(part_idx, frags[-1])
+        return [tuple(extent) for extent in extents]
+
+    def find_first_frame(self, part_idx, frag_idx):
+        # (offset in the fragment, epoch seconds) of the first frame
+        # starting in a fragment, reading only up to its header; None if
+        # there is none
+        frag_offset = self.get_frag_offset(part_idx, frag_idx)
+        frag_size   = self.FRAG_SIZES[part_idx]
+        for pos in range(0, frag_size, PROBE_SIZE):
+            # A little more than PROBE_SIZE, so headers can't straddle reads
+            data = self.disk.read_at(frag_offset + pos, min(PROBE_SIZE + 20, frag_size - pos))
+            headers = find_frame_headers(data)
+            if headers:
+                return pos + headers[0][0], headers[0][3]
+        return None
+
+    def probe_frag_time(self, part_idx, frag_idx):
+        first_frame = self.find_first_frame(part_idx, frag_idx)
+        return first_frame[1] if first_frame else None
+
+    def find_frag_at(self, part_idx, frags, moment, estimate, unknown_after):
+        # Position in frags of the last fragment whose first frame is not
+        # after moment, searched from estimate: gallops away from it and
+        # then bisects, probing one header per step. Fragments without
+        # frames count as after moment if unknown_after, else as before.
+        probes = {}
+        def not_after(pos):
+            if pos not in probes:
+                probes[pos] = self.probe_frag_time(part_idx, frags[pos])
+            if probes[pos] is None:
+                return not unknown_after
+            return probes[pos] <= moment
+
+        if not_after(estimate):
+            lo, step = estimate, 1
+            while lo + step < len(frags) and not_after(lo + step):
+                lo, step = lo + step, step * 2
+            hi = min(lo + step, len(frags))
+        else:
+            hi, step = estimate, 1
+            while hi - step >= 0 and not not_after(hi - step):
+                hi, step = hi - step, step * 2
+            lo = hi - step
+            if lo < 0:
+                return 0
+        # not_after(lo) holds and not_after(hi) doesn't (or hi is the end)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if not_after(mid):
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def build_frame_index(self, part_idx, desc_idx):
+        # FrameIndex of a video, reading it in order and hopping from frame
+        # to frame by their length; after a bad header the next "DHAV" is
+        # searched. None if cancelled.
+        extents = self.get_video_extents(part_idx, desc_idx)
+        total   = sum(size for _, size in extents)
+        frames  = []
+        data    = b""
+        base    = 0     # stream position of data
+        pos     = 0     # next header, relative to data
+        done    = 0
+        with self.profiler.phase("frame_index"):
+            for offset, size in extents:
+                for chunk_pos in range(0, size, FRAME_READ):
+                    if self.is_cancelled():
+                        return None
+                    chunk = self.disk.read_at(offset + chunk_pos, min(FRAME_READ, size - chunk_pos))
+                    done += len(chunk)
+                    if pos >= len(data) + len(chunk):
+                        # Inside a frame longer than the read
+                        pos  -= len(data) + len(chunk)
+                        base += len(data) + len(chunk)
+                        data  = b""
+                        continue
+                    data = data[pos:] + chunk if pos < len(data) else chunk[pos - len(data):]
+                    base += pos
+                    pos   = 0
+                    while pos + 20 <= len(data):
+                        header = parse_frame_header(data, pos)
+                        if header:
+                            frames.append((base + pos,) + header)
+                            pos += header[1]
+                            continue
+                        next_pos = data.find(DHAV_MAGIC, pos + 1)
+                        # Not found: a magic may still straddle into the next read
+                        pos = next_pos if next_pos >= 0 else max(len(data) - 3, pos + 1)
+                        if next_pos < 0:
+                            break
+                    self.report_progress(done, total)
+        return FrameIndex(np.array(frames, dtype=FRAME_DTYPE))
+
+    def get_frame_index(self, part_idx, desc_idx, build=True):
+        # Cached FrameIndex of a video, built when first asked (unless
+        # not build); None if cancelled or not built
+        key = (part_idx, desc_idx)
+        with self.frame_indexes_lock:
+            index = self.frame_indexes.get(key)
+            if index is not None:
+                self.frame_indexes.move_to_end(key)
+                return index
+        if not build:
+            return None
+        index = self.build_frame_index(part_idx, desc_idx)
+        if index is not None:
+            with self.frame_indexes_lock:
+                self.frame_indexes[key] = index
+                if len(self.frame_indexes) > FRAME_INDEXES:
+                    self.frame_indexes.popitem(last=False)
+        return index
+
+    def read_video_range(self, part_idx, desc_idx, position, size):
+        # size bytes from position of the video stream, read from the
+        # image extents holding them only
+        extents = stream_to_extents(self.get_video_extents(part_idx, desc_idx), position, size)
+        return b"".join(self.disk.read_at(offset, length) for offset, length in extents)
+
+    def find_keyframe(self, part_idx, desc_idx, moment):
+        # (position, length, epoch) of the I-frame of a video to start
+        # from to show moment (epoch seconds), None without I-frames
+        index = self.get_frame_index(part_idx, desc_idx)
+        row = index.find_keyframe(moment) if index is not None else None
+        if row is None:
+            return None
+        position, _, length, epoch = index.get_frame(row)
+        return position, length, epoch
+
+    def read_keyframe(self, part_idx, desc_idx, moment):
+        # (epoch, DHAV frame) of the I-frame nearest before moment, for
+        # thumbnails and previews; None without I-frames
+        keyframe = self.find_keyframe(part_idx, desc_idx, moment)
+        if keyframe is None:
+            return None
+        position, length, epoch = keyframe
+        return epoch, self.read_video_range(part_idx, desc_idx, position, length)
+
+    def get_indexed_window_extents(self, index, part_idx, desc_idx, start, end):
+        # get_window_extents from the frame index of the video: from the
+        # last I-frame not after start to the first frame after end
+        extents = self.get_video_extents(part_idx, desc_idx)
+        video_size = sum(size for _, size in extents)
+        first = index.find_keyframe(start)
+        head  = index.get_frame(first)[0] if first is not None else 0
+        tail  = index.find_end(end, first + 1 if first is not None else 0)
+        if tail is None or tail > video_size:
+            tail = video_size
+        return stream_to_extents(extents, head, tail - head)
+
+    def get_window_extents(self, part_idx, desc_idx, start, end):
+        # Extents of the part of a video recorded between start and end
+        # (epoch seconds), [] if it doesn't overlap. The fragments at the
+        # edges are estimated from the recording times, assuming a steady
+        # bitrate, then found by probing frame headers. The output starts
+        # at the last I-frame not after start, so it can be decoded, and
+        # ends before the first frame after end. If the video has a frame
+        # index already, the cut is taken from it.
+        frags  = self.get_frags_video(part_idx, desc_idx)
+        begin_ts, end_ts = self.get_timestamps(part_idx, desc_idx)
+        video_begin, video_end = (int(t) for t in timestamps_to_epoch([begin_ts, end_ts]))
+        if not frags or start > video_end or end < video_begin:
+            return []
+        index = self.get_frame_index(part_idx, desc_idx, build=False)
+        if index is not None and len(index):
+            return self.get_indexed_window_extents(index, part_idx, desc_idx, start, end)
+
+        frag_size  = self.FRAG_SIZES[part_idx]
+        last_size  = self.get_last_frag_size(part_idx, frags[-1])
+        video_size = (len(frags) - 1) * frag_size + last_size
+        def estimate(moment):
+            position = (moment - video_begin) * video_size // max(video_end - video_begin + 1, 1)
+            return min(max(position // frag_size, 0), len(frags) - 1)
+
+        first = self.find_frag_at(part_idx, frags, start, estimate(start), True)
+        last  = max(self.find_frag_at(part_idx, frags, end, estimate(end), False), first)
+
+        # Cuts inside the edge fragments. Without an I-frame up to start
+        # in the first fragment, the previous ones are tried (a few: a
+        # group of pictures is much smaller than a fragment)
+        head = 0
+        for _ in range(KEYFRAME_LOOKBACK):
+            headers = find_frame_headers(self.disk.read_at(self.get_frag_offset(part_idx, frags[first]),
+                                                           frag_size))
+            starts = [pos for pos, frame_type, _, moment in headers
+                      if frame_type == DHAV_I_FRAME and moment <= start]
+            if starts or first == 0:
+                head = starts[-1] if starts else 0
+                break
+            first -= 1
+
+        last_len = last_size if last == len(frags) - 1 else frag_size
+        tail = last_len
+        headers = find_frame_headers(self.disk.read_at(self.get_frag_offset(part_idx, frags[last]),
+                                                       last_len))
+        ends = [pos for pos, _, _, moment in headers if moment > end and (last > first or pos > head)]
+        if ends:
+            tail = ends[0]
+        elif last + 1 < len(frags):
+            # The last frame may go on into the next fragment, up to the
+            # first frame starting there
+            first_frame = self.find_first_frame(part_idx, frags[last+1])
+            if first_frame and first_frame[0] > 0:
+                last += 1
+                tail = first_frame[0]
+
+        extents = self.get_frags_extents(part_idx, frags[first:last+1])
+        extents[-1][1] -= frag_size - tail
+        extents[0][0]  += head
+        extents[0][1]  -= head
+        return [tuple(extent) for extent in extents if extent[1] > 0]
+
+    def get_hashing(self, part_idx):
+        # (algorithms, piece_size) for export_evidence, None if not hashing
+        if not self.config['HASH']:
+            return None
+        return self.config['HASH'], self.FRAG_SIZES[part_idx] if self.config['HASH_PIECES'] else 0
+
+    def get_manifest(self, path):
+        with self.manifests_lock:
+            path = os.path.abspath(path)
+            if path not in self.manifests:
+                self.manifests[path] = Manifest(path)
+            return self.manifests[path]
+
+    def add_to_manifest(self, full_name, extents, written, digests, record):
+        record = dict(record, file=os.path.basename(full_name), bytes=written,
+                      extents=[[int(offset), int(size)] for offset, size in extents])
+        record.update(digests)
+        self.get_manifest(os.path.dirname(full_name)).add(record)
+
+    def save_extents(self, full_name, extents, part_idx, record):
+        # Saves extents of the image to full_name, hashing them on the way
+        # and adding them to the manifest of the directory when HASH is set.
+        # record says what was saved (kind, partition, desc).
+        with self.profiler.phase("export"):
+            written, digests = export_evidence(self.disk, full_name, extents, self.get_hashing(part_idx))
+        self.profiler.count("bytes_extracted", written)
+        if digests:
+            self.add_to_manifest(full_name, extents, written, digests, record)
+        return written
+
+    def export_extents(self, fd_out, extents, log_func=None, file_name=""):
+        total_size = sum(size for _, size in extents)
+        saved = 0
+        for offset, size in extents:
+            saved += self.disk.copy_to(fd_out.fileno(), offset, size)
+            if log_func:
+                log_func(f"Saving {file_name} ({saved*100/total_size:4.2f}%)")
+        return saved
+
+    def get_video_file_name(self, part_idx, desc_idx, window=None):
+        date     = self.get_begin_date(part_idx, desc_idx)
+        begin    = self.get_begin_time(part_idx, desc_idx)
+        end      = self.get_end_time(part_idx, desc_idx)
+        cam      = self.get_camera(part_idx, desc_idx)
+        if window:
+            # Times of the part saved
+            video_begin, video_end = timestamps_to_epoch(self.get_timestamps(part_idx, desc_idx)).tolist()
+            date, begin = epoch_to_text(max(window[0], video_begin)).split()
+            end = epoch_to_text(min(window[1], video_end)).split()[1]
+
+        file_name  = f"Video-p{part_idx}-{desc_idx:06d}-{date.replace('-','')}-"
+        file_name += f"{begin.replace(':','')}-{end.replace(':','')}-"
+        file_name += f"ch{cam:02d}.h264"
+        return file_name
 
     def save_video_at (self, part_idx, desc_idx, path, logFunc = None):
         if self.img_loaded:
-            date     = self.get_begin_date(part_idx, desc_idx)
-            begin    = self.get_begin_time(part_idx, desc_idx)
-            end      = self.get_end_time(part_idx, desc_idx)
-            cam      = self.get_camera(part_idx, desc_idx)
-            totFrag  = self.get_num_frags(part_idx, desc_idx)
-
-            file_name  = f"Video-p{part_idx}-{desc_idx:06d}-{date.replace('-','')}-"
-            file_name += f"{begin.replace(':','')}-{end.replace(':','')}-"
-            file_name += f"ch{cam:02d}.h264"
+            file_name  = self.get_video_file_name(part_idx, desc_idx)
             fullName   = path+"/"+file_name
 
-            with open (fullName, "wb") as fd_out:
-                frags = self.frags_in_videos[part_idx][desc_idx]
-                frag_idx = 0
-                for frag_idx in range(len(frags) - 1):
-                    fd_out.write(self.read_fragment(part_idx, frags[frag_idx]))
-                    frag_idx += 1
-                    if logFunc:
-                        logFunc(f"Saving {file_name} ({frag_idx*100/len(frags):4.2f}%)")
-                fd_out.write(self.read_last_fragment(part_idx, frags[frag_idx]))
-                fd_out.close()
+            if self.get_hashing(part_idx):
+                if logFunc: logFunc(f"Saving {file_name}")
+                self.save_extents(fullName, self.get_video_extents(part_idx, desc_idx), part_idx,
+                                  {'kind': "video", 'partition': part_idx, 'desc': desc_idx})
+                return file_name
+            with open (fullName, "wb") as fd_out, self.profiler.phase("export"):
+                written = self.export_extents(fd_out, self.get_video_extents(part_idx, desc_idx),
+                                              logFunc, file_name)
+            self.profiler.count("bytes_extracted", written)
             return file_name
         else:
             return None
 
-    def save_slack_at (self, idx, part_idx, desc_idx, path, log_func = None):
-        if self.img_loaded and self.get_slack_size(part_idx, desc_idx) > 0:
-            date     = self.get_begin_date(part_idx, desc_idx)
-            begin    = self.get_begin_time(part_idx, desc_idx)
-            end      = self.get_end_time(part_idx, desc_idx)
-            cam      = self.get_camera(part_idx, desc_idx)
-            size_last = self.get_camera(part_idx, desc_idx)
-            file_name = f"{idx:04d}-Slack-p{part_idx}-{desc_idx:06d}-"
-            file_name += f"{date.replace('-','')}-"
-            file_name += f"{begin.replace(':','')}-{end.replace(':','')}-"
-            file_name += f"ch{cam:02d}.h264"
-            full_name = path+"/"+file_name
-
-            with open (full_name, "wb") as fd_out:
-                if log_func: log_func(f"Saving {file_name}")
-
-                last_desc = self.frags_in_videos[part_idx][desc_idx][-1]
-                fd_out.write(self.read_slack_fragment(part_idx, last_desc))
-                fd_out.close()
-            return file_name
+    def iter_video_exports(self, videos, path, window=None):
+        # (full_name, extents, record) of each video of a batch, skipping
+        # those with nothing in the window; stops when cancelled
+        for part_idx, desc_idx in videos:
+            if self.is_cancelled():
+                break
+            if window:
+                extents = self.get_window_extents(part_idx, desc_idx, *window)
+                if not extents:
+                    continue
+            else:
+                extents = self.get_video_extents(part_idx, desc_idx)
+            yield (path+"/"+self.get_video_file_name(part_idx, desc_idx, window), extents,
+                   {'kind': "video", 'partition': part_idx, 'desc': desc_idx})
+
+    def save_exports_in_disk_order(self, exports, log_func=None):
+        # Saves a batch of (full_name, extents, record) in a single sweep
+        # over the image (see dhfs_schedule). Pieces are written out of
+        # file order; with HASH they are hashed in file order as they come
+        # (see SweepHashers). Files left incomplete by a cancel are removed.
+        # Returns the stats of save_videos_at and the bytes written to each
+        # file (None if removed).
+        stats = {'videos': 0, 'bytes': 0, 'seconds': 0.0, 'throughput': 0.0}
+        start = time.perf_counter()
+        hashers = SweepHashers()
+
+        def on_piece(file_idx, file_pos, data):
+            hashing = self.get_hashing(exports[file_idx][2]['partition'])
+            if hashing:
+                hashers.add(file_idx, *hashing, file_pos, data)
+
+        def on_file(file_idx, written):
+            full_name, extents, record = exports[file_idx]
+            hashing = self.get_hashing(record['partition'])
+            if hashing:
+                self.add_to_manifest(full_name, extents, written,
+                                     hashers.finish(file_idx, *hashing, full_name), record)
+            stats['videos'] += 1
+            stats['bytes']  += written
+            self.profiler.count("frags_extracted", -(-written // self.FRAG_SIZES[record['partition']]))
+            stats['seconds'] = time.perf_counter() - start
+            stats['throughput'] = stats['bytes'] / 1024**2 / max(stats['seconds'], 1e-9)
+            if log_func:
+                log_func(f"Saved {os.path.basename(full_name)} ({stats['videos']}/{len(exports)}, "+
+                         f"{stats['throughput']:.1f} MB/s)")
+
+        with self.profiler.phase("sweep"):
+            written = export_in_disk_order(self.disk, [(full_name, extents) for full_name, extents, _ in exports],
+                                           self.is_cancelled, on_file, self.report_progress,
+                                           on_piece=on_piece)
+        for file_idx, ((full_name, _, _), file_written) in enumerate(zip(exports, written)):
+            if file_written is None:
+                hashers.discard(file_idx)
+                if os.path.exists(full_name):
+                    os.remove(full_name)
+        if hashers.read_back:
+            # Too many pieces out of order to keep them all for hashing
+            self.profiler.count("bytes_read_back", hashers.read_back)
+            message = (f"Warning: {hashers.read_back / 1024**2:.1f} MB of the output were read "+
+                       "back to hash pieces saved out of order")
+            if log_func:
+                log_func(message)
+            if self.DEBUG:
+                print (message)
+        self.profiler.count("bytes_extracted", stats['bytes'])
+        if stats['bytes']:
+            self.extract_throughput = stats['throughput']
+        return stats, written
+
+    def save_videos_at (self, videos, path, log_func = None, workers = None, pool = None, window = None):
+        # Extracts a batch of (part_idx, desc_idx) videos on a thread or
+        # process pool. Workers use positional reads, so they don't share a
+        # file position. pool "disk" reads the whole batch in one sweep in
+        # disk order instead, for spinning drives. With window=(start, end),
+        # in epoch seconds, only the part of each video recorded in it is
+        # saved. Returns the number of videos, bytes and seconds spent, and
+        # the aggregate throughput in MB/s.
+        stats = {'videos': 0, 'bytes': 0, 'seconds': 0.0, 'throughput': 0.0}
+        if not self.img_loaded:
+            return stats
+
+        workers = workers or self.config['EXTRACT_WORKERS']
+        pool    = pool or self.config['EXTRACT_POOL']
+        if pool == "disk":
+            with self.profiler.phase("extract"):
+                stats, _ = self.save_exports_in_disk_order(list(self.iter_video_exports(videos, path, window)),
+                                                           log_func)
+            self.profiler.count("videos_extracted", stats['videos'])
+            return stats
+        if pool == "process":
+            executor = ProcessPoolExecutor(workers, initializer=open_worker_image,
+                                           initargs=(self.disk.path, self.disk.use_mmap))
         else:
+            executor = ThreadPoolExecutor(workers)
+
+        start = time.perf_counter()
+        total_bytes = 0
+        phase = self.profiler.phase("extract")
+        with executor, phase:
+            jobs = {}
+            for full_name, extents, record in self.iter_video_exports(videos, path, window):
+                total_bytes += sum(size for _, size in extents)
+                hashing = self.get_hashing(record['partition'])
+                if pool == "process":
+                    job = executor.submit(export_evidence_in_worker, full_name, extents, hashing)
+                else:
+                    job = executor.submit(export_evidence, self.disk, full_name, extents, hashing)
+                jobs[job] = (full_name, extents, record)
+
+            cancelled = False
+            for job in as_completed(jobs):
+                if not cancelled and self.is_cancelled():
+                    # Videos already being written are finished, the rest dropped
+                    for pending in jobs:
+                        pending.cancel()
+                    cancelled = True
+                if job.cancelled():
+                    continue
+                full_name, extents, record = jobs[job]
+                written, digests = job.result()
+                if digests:
+                    self.add_to_manifest(full_name, extents, written, digests, record)
+                stats['videos'] += 1
+                stats['bytes']  += written
+                self.profiler.count("frags_extracted", -(-written // self.FRAG_SIZES[record['partition']]))
+                stats['seconds'] = time.perf_counter() - start
+                stats['throughput'] = stats['bytes'] / 1024**2 / max(stats['seconds'], 1e-9)
+                self.report_progress(stats['bytes'], total_bytes)
+                if log_func:
+                    log_func(f"Saved {os.path.basename(full_name)} ({stats['videos']}/{len(jobs)}, "+
+                             f"{stats['throughput']:.1f} MB/s)")
+        self.profiler.count("videos_extracted", stats['videos'])
+        self.profiler.count("bytes_extracted", stats['bytes'])
+        if stats['bytes']:
+            self.extract_throughput = stats['throughput']
+        return stats
+
+    def get_slack_extent(self, part_idx, desc_idx):
+        # (offset, size) of the slack of a video, None if it has none
+        if self.get_slack_size(part_idx, desc_idx) <= 0:
+            return None
+        last_desc = self.frags_in_videos[part_idx][desc_idx][-1]
+        pos_slack = self.get_last_frag_size(part_idx, last_desc)
+        return self.get_frag_offset(part_idx, last_desc) + pos_slack, self.FRAG_SIZES[part_idx] - pos_slack
+
+    def get_slack_export(self, idx, part_idx, desc_idx, path):
+        # (full_name, extents, record) of the slack of a video, None if it has none
+        extent = self.get_slack_extent(part_idx, desc_idx)
+        if extent is None:
             return None
+        date     = self.get_begin_date(part_idx, desc_idx)
+        begin    = self.get_begin_time(part_idx, desc_idx)
+        end      = self.get_end_time(part_idx, desc_idx)
+        cam      = self.get_camera(part_idx, desc_idx)
+        file_name = f"{idx:04d}-Slack-p{part_idx}-{desc_idx:06d}-"
+        file_name += f"{date.replace('-','')}-"
+        file_name += f"{begin.replace(':','')}-{end.replace(':','')}-"
+        file_name += f"ch{cam:02d}.h264"
+        return path+"/"+file_name, [extent], {'kind': "slack", 'partition': part_idx, 'desc': desc_idx}
 
-    def save_recovered_at_free (self, part_idx, path, log_func):
-        tot_videos = 0
-        file_desc = None
+    def save_slack_at (self, idx, part_idx, desc_idx, path, log_func = None):
+        export = self.get_slack_export(idx, part_idx, desc_idx, path) if self.img_loaded else None
+        if export is None:
+            return None
+        full_name, extents, record = export
+        file_name = os.path.basename(full_name)
+        if log_func: log_func(f"Saving {file_name}")
+        self.save_extents(full_name, extents, part_idx, record)
+        return file_name
+
+    def save_slacks_at(self, videos, path, log_func = None):
+        # Slacks of a batch of (part_idx, desc_idx) videos, numbered by
+        # their position in it; in one sweep when EXTRACT_POOL is "disk".
+        # Returns (part_idx, desc_idx, file_name) of those saved.
+        saved = []
+        if not self.img_loaded:
+            return saved
+        if self.config['EXTRACT_POOL'] == "disk":
+            exports, sources = [], []
+            for idx, (part_idx, desc_idx) in enumerate(videos):
+                export = self.get_slack_export(idx, part_idx, desc_idx, path)
+                if export:
+                    exports.append(export)
+                    sources.append((part_idx, desc_idx))
+            _, written = self.save_exports_in_disk_order(exports, log_func)
+            return [(part_idx, desc_idx, os.path.basename(full_name))
+                    for (part_idx, desc_idx), (full_name, _, _), file_written in zip(sources, exports, written)
+                    if file_written is not None]
+
+        for idx, (part_idx, desc_idx) in enumerate(videos):
+            if self.is_cancelled():
+                break
+            self.report_progress(idx, len(videos), "files")
+            file_name = self.save_slack_at(idx, part_idx, desc_idx, path, log_func)
+            if file_name:
+                saved.append((part_idx, desc_idx, file_name))
+        return saved
+
+    def get_scan_pattern(self):
+        # CARVE_SIGNAT matching anywhere, not only at the start
         signature = self.config['CARVE_SIGNAT']
-
-        for frag_idx in self.free_frags[part_idx]:
-            frag_data = self.read_fragment(part_idx, frag_idx)
-
-            #Looks for signature in first 32 bytes
-            if signature.search(frag_data[:32]):
-                if file_desc:
-                    tot_videos += 1
-                    file_desc.close()
-
-                fileName = f"FragFree-{frag_idx:06d}.h264"
-                file_desc = open(path+"/"+fileName, "wb")
-                file_desc.write(frag_data)
-                if log_func:
-                    log_func(f"Saving vídeo {fileName}")
-            elif file_desc:
-                file_desc.write(frag_data)
-
-        if file_desc:
+        return re.compile(signature.pattern.lstrip(b"^"), signature.flags)
+
+    def scan_slack(self, data, pattern):
+        # SLACK_SIGNATURE and/or SLACK_FRAMES if found in data, else 0
+        data = bytes(data)
+        hits = SLACK_SIGNATURE if pattern.search(data) else 0
+        if find_frame_headers(data):
+            hits |= SLACK_FRAMES
+        return hits
+
+    def save_slack_container(self, videos, full_name, log_func = None, scan = False):
+        # Slacks of a batch of (part_idx, desc_idx) videos in one container
+        # file, instead of a file each, with its index (see read_slack_index)
+        # in full_name + ".idx". With scan, only slacks holding the carving
+        # signature or DHAV frame headers are kept. Returns the number of
+        # slacks found, kept, and bytes written.
+        stats = {'slacks': 0, 'kept': 0, 'bytes': 0}
+        if not self.img_loaded:
+            return stats
+        slacks = []
+        for part_idx, desc_idx in videos:
+            extent = self.get_slack_extent(part_idx, desc_idx)
+            if extent:
+                slacks.append((part_idx, desc_idx, extent))
+        stats['slacks'] = len(slacks)
+
+        columns = {'partition': np.zeros(len(slacks), dtype=np.uint16),
+                   'desc'     : np.zeros(len(slacks), dtype=np.uint32),
+                   'begin'    : np.zeros(len(slacks), dtype=np.int64),
+                   # Signed: get_camera is negative for camera bytes below '0'
+                   'camera'   : np.zeros(len(slacks), dtype=np.int16),
+                   'offset'   : np.zeros(len(slacks), dtype=np.uint64),
+                   'position' : np.zeros(len(slacks), dtype=np.uint64),
+                   'size'     : np.zeros(len(slacks), dtype=np.uint32),
+                   'hits'     : np.zeros(len(slacks), dtype=np.uint8)}
+        pattern = self.get_scan_pattern()
+        hashing = self.get_hashing(0)
+        hasher  = Hasher(hashing[0]) if hashing else None
+        # Reads at least as large as any slack, so none is cut in pieces:
+        # each target is a whole slack, scanned and indexed once
+        max_read = max([SLACK_READ] + [size for _, _, (_, size) in slacks])
+        reads   = plan_reads([[extent] for _, _, extent in slacks], max_read, SLACK_GAP)
+        total   = sum(end - start for start, end, _ in reads)
+        done    = 0
+        kept    = 0
+        try:
+            with open(full_name, "wb") as fd_out, self.profiler.phase("slack_container"):
+                for start, end, targets in reads:
+                    if self.is_cancelled():
+                        break
+                    data = self.disk.view(start, end - start)
+                    for slack_idx, _, read_pos, size in targets:
+                        piece = data[read_pos:read_pos+size]
+                        hits  = self.scan_slack(piece, pattern) if scan else 0
+                        if scan and not hits:
+                            continue
+                        part_idx, desc_idx, (offset, _) = slacks[slack_idx]
+                        for name, value in (('partition', part_idx), ('desc', desc_idx),
+                                            ('camera', self.get_camera(part_idx, desc_idx)),
+                                            ('offset', offset), ('position', stats['bytes']),
+                                            ('size', len(piece)), ('hits', hits)):
+                            columns[name][kept] = value
+                        columns['begin'][kept] = timestamps_to_epoch(self.get_begin_timestamp(part_idx, desc_idx))
+                        fd_out.write(piece)
+                        if hasher:
+                            hasher.update(piece)
+                        stats['bytes'] += len(piece)
+                        kept += 1
+                    done += end - start
+                    self.report_progress(done, total)
+                    if log_func:
+                        log_func(f"Saving slacks ({done * 100 / max(total, 1):4.2f}%, {kept} kept)")
+        finally:
+            digests = hasher.finish() if hasher else None
+        stats['kept'] = kept
+
+        # Index in container order (disk order)
+        index_name = full_name + ".idx"
+        dhfs_cache.write_cache(index_name, {'image': self.disk.path, 'scan': scan, 'slacks': kept},
+                               {name: column[:kept] for name, column in columns.items()}, SLACK_MAGIC)
+        if digests:
+            record = {'kind': "slack container", 'partition': None, 'slacks': kept}
+            self.add_to_manifest(full_name, [], stats['bytes'], digests, record)
+            self.add_to_manifest(index_name, [], os.path.getsize(index_name),
+                                 hash_file(index_name, hashing[0]), {'kind': "slack index", 'partition': None})
+        return stats
+
+    def get_free_runs(self, part_idx):
+        # First phase of carving: probes only the first 32 bytes of each
+        # free fragment and returns the runs of free fragments that start
+        # with the carving signature, as (first, end) positions in free_frags
+        signature = self.config['CARVE_SIGNAT']
+        free_frags = self.free_frags[part_idx]
+        headers = self.disk.read_headers([self.get_frag_offset(part_idx, frag_idx)
+                                          for frag_idx in free_frags.tolist()], 32)
+
+        starts = [pos for pos, header in enumerate(headers) if signature.search(header)]
+        return list(zip(starts, starts[1:] + [len(free_frags)]))
+
+    def save_exports(self, exports, log_func = None):
+        # Saves a batch of (full_name, extents, record) one after another,
+        # or in a single sweep when EXTRACT_POOL is "disk". Returns the
+        # number of files saved.
+        if self.config['EXTRACT_POOL'] == "disk":
+            stats, _ = self.save_exports_in_disk_order(exports, log_func)
+            return stats['videos']
+        tot_videos = 0
+        for export_idx, (full_name, extents, record) in enumerate(exports):
+            if self.is_cancelled():
+                break
+            self.report_progress(export_idx, len(exports), "videos")
+            if log_func:
+                log_func(f"Saving vídeo {os.path.basename(full_name)}")
+            self.save_extents(full_name, extents, record['partition'], record)
             tot_videos += 1
-            file_desc.close()
-
         return tot_videos
 
-    def save_recovered_at_dirty (self, part_idx, path, log_func):
-        tot_videos = 0
-        file_desc = None
+    def get_free_exports(self, part_idx, path):
+        # Second phase: (full_name, extents, record) of the runs found
+        free_frags = self.free_frags[part_idx]
+        return [(path+"/"+f"FragFree-{free_frags[first]:06d}.h264",
+                 self.get_frags_extents(part_idx, free_frags[first:end].tolist()),
+                 {'kind': "free", 'partition': part_idx, 'desc': int(free_frags[first])})
+                for first, end in self.get_free_runs(part_idx)]
+
+    def save_recovered_at_free (self, part_idx, path, log_func):
+        return self.save_exports(self.get_free_exports(part_idx, path), log_func)
+
+    def build_dirty_chains(self, part_idx):
+        # Groups dirty fragments into chains: each not yet visited dirty
+        # desc, in disk order, starts a chain that follows next pointers
+        # while they stay in the same video (same begin_desc). Descriptors
+        # are visited once, except for chains that run into an earlier one,
+        # whose tail is repeated just as the extraction always did.
+        table     = self.desc_table[part_idx]
+        num_descs = len(table)
+        starts    = self.dirty_frags[part_idx]
+        next_desc = column_as_array(table['next'])
+        begin     = column_as_array(table['begin_desc'])
+
+        visited = bytearray(num_descs)
+        owner   = array('i', [-1]) * num_descs
+        heads   = array('q')
+        frags   = array('I')
+        offsets = array('q', [0])
+        anomalies = []
+        for desc_idx in starts.tolist():
+            if visited[desc_idx]:
+                continue
+            pos = len(heads)
+            heads.append(desc_idx)
+            while True:
+                visited[desc_idx] = 1
+                owner[desc_idx] = pos
+                frags.append(desc_idx)
+                next_idx = next_desc[desc_idx]
+                if (next_idx == 0 or next_idx >= num_descs or
+                        begin[next_idx] != begin[desc_idx]):
+                    break
+                if owner[next_idx] == pos:
+                    anomalies.append(('cycle', heads[pos], next_idx))
+                    break
+                desc_idx = next_idx
+            offsets.append(len(frags))
+
+            if self.DEBUG:
+                print (f"part_idx {part_idx} dirty chain {heads[pos]}: "+
+                       f"{offsets[-1] - offsets[-2]} frags, baseDesc {begin[heads[pos]]}")
 
-        already_saved = []
-        beg_desc  = -1
+        return ChainIndex(np.frombuffer(heads, dtype=np.int64),
+                          np.frombuffer(offsets, dtype=np.int64),
+                          np.frombuffer(frags, dtype=np.uint32),
+                          np.frombuffer(owner, dtype=np.int32),
+                          anomalies)
 
-        tot_dirty_frags = len(self.dirty_frags[part_idx])
-        idx  = 0
+    def get_dirty_exports(self, part_idx, path):
+        chains = self.build_dirty_chains(part_idx)
 
-        while len(already_saved) < tot_dirty_frags:
-            if self.dirty_frags[part_idx][idx] not in already_saved:
-                desc_idx = self.dirty_frags[part_idx][idx]
+        exports = []
+        for desc_idx in chains:
+            date     = self.get_begin_date(part_idx, desc_idx)
+            begin    = self.get_begin_time(part_idx, desc_idx)
+            cam      = self.get_camera(part_idx, desc_idx)
+            file_name = f"FragDirty-p{part_idx}-{desc_idx:06d}-{date.replace('-','')}-"
+            file_name += f"{begin.replace(':','')}-"
+            file_name += f"ch{cam:02d}.h264"
+            exports.append((path+"/"+file_name,
+                            self.get_frags_extents(part_idx, chains.get_chain(desc_idx).tolist()),
+                            {'kind': "dirty", 'partition': part_idx, 'desc': desc_idx}))
+        return exports
 
-                date     = self.get_begin_date(part_idx, desc_idx)
-                begin    = self.get_begin_time(part_idx, desc_idx)
-                cam      = self.get_camera(part_idx, desc_idx)
-                file_name = f"FragDirty-p{part_idx}-{desc_idx:06d}-{date.replace('-','')}-"
-                file_name += f"{begin.replace(':','')}-"
-                file_name += f"ch{cam:02d}.h264"
-                full_name = path+"/"+file_name
+    def save_recovered_at_dirty (self, part_idx, path, log_func):
+        return self.save_exports(self.get_dirty_exports(part_idx, path), log_func)
+
+    def get_video_area(self, part_idx):
+        start = self.PART_OFFS[part_idx] + self.VID_OFF[part_idx]
+        end   = min(start + self.NUM_FRAGS[part_idx] * self.FRAG_SIZES[part_idx], self.disk.get_size())
+        return start, end
+
+    def save_carved_at_area(self, part_idx, path, log_func = None, workers = None):
+        # Carving for formatted disks: ignores the descriptors and scans
+        # the whole video area for CARVE_SIGNAT (anywhere, not only at
+        # fragment starts) in chunks spread over a process pool. As for
+        # free runs, each hit starts an extent that goes on to the next hit
+        # (or to the end of the area), up to CARVE_MAX_SIZE bytes if set.
+        # Extents are saved as soon as they are complete.
+        area_start, area_end = self.get_video_area(part_idx)
+        frag_size = self.FRAG_SIZES[part_idx]
+        pattern   = self.get_scan_pattern()
+        chunk     = max(self.config['CARVE_CHUNK'] // frag_size, 1) * frag_size
+        chunk_starts = range(area_start, area_end, chunk)
+        workers   = workers or self.config['CARVE_WORKERS']
+
+        max_size  = self.config['CARVE_MAX_SIZE']
 
-                file_desc = open(full_name, "wb")
+        tot_videos = 0
+        begin = None
+        def save_extent(begin, end):
+            if max_size:
+                end = min(end, begin + max_size)
+            fileName = f"Carved-p{part_idx}-{begin:012x}.h264"
+            if log_func:
+                log_func(f"Saving vídeo {fileName}")
+            self.save_extents(path+"/"+fileName, [(begin, end - begin)], part_idx,
+                              {'kind': "carved", 'partition': part_idx, 'offset': begin})
+
+        with ProcessPoolExecutor(workers, initializer=open_worker_image,
+                                 initargs=(self.disk.path, self.disk.use_mmap)) as executor, \
+             self.profiler.phase("carve"):
+            scans = executor.map(scan_signature_in_worker, chunk_starts,
+                                 [min(start + chunk, area_end) for start in chunk_starts],
+                                 [pattern] * len(chunk_starts))
+            for chunk_idx, hits in enumerate(scans):
+                if self.is_cancelled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                for hit in hits:
+                    if begin is not None:
+                        save_extent(begin, hit)
+                        tot_videos += 1
+                    begin = hit
+                self.report_progress(min(chunk_starts[chunk_idx] + chunk, area_end) - area_start,
+                                     area_end - area_start)
                 if log_func:
-                    log_func(f"Saving vídeo {file_name}")
-
-                file_desc.write(self.read_fragment(part_idx, desc_idx))
-                already_saved.append(desc_idx)
-                nextDesc = self.get_next_desc(part_idx, desc_idx)
-                if self.DEBUG:
-                    print (f"part_idx {part_idx} desc_idx {desc_idx} nextDesc {nextDesc}"+
-                           f"baseDesc {self.get_begin_desc(part_idx, desc_idx)} "+
-                           f"baseNext {self.get_begin_desc(part_idx, nextDesc)}")
-
-                while (nextDesc != 0) and (self.get_begin_desc(part_idx, desc_idx) ==
-                                           self.get_begin_desc(part_idx, nextDesc)):
-                    desc_idx = nextDesc
-                    file_desc.write(self.read_fragment(part_idx, desc_idx))
-                    already_saved.append(desc_idx)
-                    nextDesc = self.get_next_desc(part_idx, desc_idx)
-
-                    if self.DEBUG:
-                        print (f"part_idx {part_idx} desc_idx {desc_idx} nextDesc {nextDesc}"+
-                               f"baseDesc {self.get_begin_desc(part_idx, desc_idx)} "+
-                               f"baseNext {self.get_begin_desc(part_idx, nextDesc)}")
-
-                file_desc.close()
-                tot_videos += 1
-            idx += 1
+                    log_func(f"Carving partition {part_idx} "+
+                             f"({(chunk_idx + 1) * 100 / len(chunk_starts):4.2f}%)")
+        # When cancelled, where the last extent ends isn't known
+        if begin is not None and not self.is_cancelled():
+            save_extent(begin, area_end)
+            tot_videos += 1
         return tot_videos
 
     def save_recovered_videos(self, part_idx, path, log_func = None):
         tot_videos = 0
         if self.img_loaded:
-            tot_videos  = self.save_recovered_at_free (part_idx, path, log_func)
-            tot_videos += self.save_recovered_at_dirty(part_idx, path, log_func)
+            with self.profiler.phase("recover"):
+                tot_videos  = self.save_recovered_at_free (part_idx, path, log_func)
+                tot_videos += self.save_recovered_at_dirty(part_idx, path, log_func)
         return tot_videos
 
 
-    def save_logs(self, fullPath):
-        self.disk.seek(self.logs_offset)
-        logs_header = self.disk.read(2 * self.BLK_SIZE)
+    def get_logs_extent(self):
+        # (offset, size) of the log records, after the two header blocks
+        logs_header = self.disk.read_at(self.logs_offset, 2 * self.BLK_SIZE)
         logs_size = int.from_bytes(logs_header[:4], byteorder='little') - 2 * self.BLK_SIZE
+        logs_start = self.logs_offset + 2 * self.BLK_SIZE
+        return logs_start, max(min(logs_size, self.disk.get_size() - logs_start), 0)
 
-        file_desc = open(fullPath, "wb")
-        file_desc.write(self.disk.read(logs_size))
-        file_desc.close()
+    def save_logs(self, fullPath):
+        # Raw copy of the log records, streamed (and hashed, with HASH)
+        self.save_extents(fullPath, [self.get_logs_extent()], 0, {'kind': "logs", 'partition': 0})
+
+    def get_log_dtype(self):
+        return get_log_dtype(self.config['LOG_FIELDS'], self.config['LOG_RECORD_SIZE'])
+
+    def get_num_log_records(self):
+        return self.get_logs_extent()[1] // self.config['LOG_RECORD_SIZE']
+
+    def iter_log_chunks(self):
+        # (number of the first record, records) over the whole log area,
+        # LOG_CHUNK bytes at a time; stops when cancelled
+        dtype = self.get_log_dtype()
+        logs_start, logs_size = self.get_logs_extent()
+        num_records = logs_size // dtype.itemsize
+        per_chunk = max(LOG_CHUNK // dtype.itemsize, 1)
+        for first in range(0, num_records, per_chunk):
+            if self.is_cancelled():
+                return
+            count = min(per_chunk, num_records - first)
+            data = self.disk.read_at(logs_start + first * dtype.itemsize, count * dtype.itemsize)
+            yield first, np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+            self.report_progress(first + count, num_records, "records")
+
+    def get_log_times(self, records):
+        # (epoch seconds, valid) of decoded records
+        times = records['time'].astype(np.int64)
+        if self.config['LOG_TIME'] == "unix":
+            return times, times > 0
+        return timestamps_to_epoch(times), valid_timestamps(times)
+
+    def get_log_index(self):
+        # Built in one pass over the log area, then kept until the next
+        # image is loaded. None if cancelled.
+        if self.log_index is None:
+            names = self.get_log_dtype().names
+            numbers, epochs, types, channels = [], [], [], []
+            with self.profiler.phase("log_index"):
+                for first, records in self.iter_log_chunks():
+                    record_epochs, valid = self.get_log_times(records)
+                    numbers.append((np.flatnonzero(valid) + first).astype(np.uint32))
+                    epochs.append(record_epochs[valid])
+                    if 'type' in names:
+                        types.append(records['type'][valid].astype(np.int64))
+                    if 'channel' in names:
+                        channels.append(records['channel'][valid].astype(np.int64))
+            if self.is_cancelled():
+                return None
+            join = lambda parts, dtype: np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+            self.log_index = LogIndex(join(numbers, np.uint32), join(epochs, np.int64),
+                                      join(types, np.int64) if 'type' in names else None,
+                                      join(channels, np.int64) if 'channel' in names else None)
+        return self.log_index
+
+    def find_log_events(self, start=None, end=None, types=None, channels=None):
+        # Numbers of the log records in [start, end] (epoch seconds), of
+        # the given types and channels, in time order
+        log_index = self.get_log_index()
+        if log_index is None:
+            return np.zeros(0, dtype=np.uint32)
+        return log_index.find(start, end, types, channels)
+
+    def read_log_records(self, numbers):
+        # Decodes the records with the given numbers, in that order.
+        # Numbers less than a chunk apart are read together.
+        dtype = self.get_log_dtype()
+        logs_start, _ = self.get_logs_extent()
+        numbers = np.asarray(numbers, dtype=np.int64)
+        order   = np.argsort(numbers, kind='stable')
+        ordered = numbers[order]
+        records = np.zeros(len(numbers), dtype=dtype)
+        per_chunk = max(LOG_CHUNK // dtype.itemsize, 1)
+        pos = 0
+        while pos < len(ordered):
+            first = int(ordered[pos])
+            stop  = int(np.searchsorted(ordered, first + per_chunk, 'left'))
+            count = int(ordered[stop - 1]) - first + 1
+            data  = self.disk.read_at(logs_start + first * dtype.itemsize, count * dtype.itemsize)
+            chunk = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+            records[order[pos:stop]] = chunk[ordered[pos:stop] - first]
+            pos = stop
+        return records
+
+    def iter_log_rows(self, numbers=None, batch_size=EXPORT_BATCH):
+        # Lists of rows [record, time, other fields...]: of the given
+        # records, or of every valid record in disk order, streamed
+        names = [name for name in self.get_log_dtype().names if name != 'time']
+
+        def all_batches():
+            for first, records in self.iter_log_chunks():
+                epochs, valid = self.get_log_times(records)
+                yield np.flatnonzero(valid) + first, records[valid], epochs[valid]
+
+        def selected_batches():
+            for pos in range(0, len(numbers), batch_size):
+                if self.is_cancelled():
+                    return
+                records = self.read_log_records(numbers[pos:pos+batch_size])
+                yield numbers[pos:pos+batch_size], records, self.get_log_times(records)[0]
+
+        for batch_numbers, records, epochs in (all_batches() if numbers is None else selected_batches()):
+            columns = ([batch_numbers.tolist(), [epoch_to_text(epoch) for epoch in epochs.tolist()]] +
+                       records_to_columns(records, names))
+            yield [list(row) for row in zip(*columns)]
+
+    def export_logs(self, out_file, fmt="csv", start=None, end=None, types=None, channels=None,
+                    batch_size=EXPORT_BATCH):
+        # Writes decoded log records to the text file out_file as CSV (";"
+        # separated, with a header) or JSON lines. Without filters every
+        # record is streamed in disk order; with them, the index gives the
+        # records, in time order. Returns the number written.
+        columns = ["record", "time"] + [name for name in self.get_log_dtype().names if name != 'time']
+        numbers = None
+        if (start, end, types, channels) != (None, None, None, None):
+            numbers = self.find_log_events(start, end, types, channels)
+        if fmt == "csv":
+            writer = csv.writer(out_file, delimiter=";", lineterminator="\n")
+            writer.writerow(columns)
+
+        total = 0
+        for rows in self.iter_log_rows(numbers, batch_size):
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                out_file.write("".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows))
+            total += len(rows)
+        return total
 
     def set_config(self, fileName):
         castings = {"CARVE_SIGNAT" : lambda e: re.compile(("^"+e).encode()),
-                    "DEBUG" : bool}
+                    "DEBUG" : parse_bool,
+                    "MMAP"  : parse_bool,
+                    "EXTRACT_WORKERS" : int,
+                    "EXTRACT_POOL" : lambda e: e.lower(),
+                    "HASH"         : lambda e: [hashlib.new(name.strip().lower()).name
+                                                for name in e.split(",") if name.strip()],
+                    "HASH_PIECES"  : parse_bool,
+                    "LOAD_WORKERS" : int,
+                    "CARVE_WORKERS" : int,
+                    "CARVE_CHUNK" : int,
+                    "CARVE_MAX_SIZE" : int,
+                    "CATALOG_CACHE" : parse_bool,
+                    "PROFILE" : parse_bool,
+                    "LOG_RECORD_SIZE" : int,
+                    "LOG_FIELDS" : parse_log_fields,
+                    "LOG_TIME" : lambda e: e.lower(),
+                    "CACHE_DIR" : os.path.expanduser}
 
         file_desc = open (fileName, "r")
         for line in file_desc:
@@ -497,4 +2336,5 @@ class DHFS41:
                     value = line[eq_pos+1:].strip()
                     self.config[key] = castings[key](value)
         file_desc.close()
-        self.DEBUG = self.config['DEBUG']
\ No newline at end of file
+        self.DEBUG = self.config['DEBUG']
+        self.set_profiling(self.config['PROFILE'])
\ No newline at end of file
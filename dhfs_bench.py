@@ -0,0 +1,244 @@
+# encoding: utf-8
+#
+# Benchmark of DHFS41 on synthetic images (dhfs_synth.py) at several
+# scales. Each scale runs in its own process, so the peak memory of one
+# doesn't hide the next. Results are JSON lines tagged with the git
+# commit, to be appended to a file and compared between commits:
+#
+#   python dhfs_bench.py --scales 10000,100000 -o bench.jsonl
+#   python dhfs_bench.py --compare old.jsonl new.jsonl
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from dhfs41 import DHFS41
+import dhfs_synth
+
+# Phases, in the order they run; rates are per second of the phase
+PHASES = ["generate", "open", "read_descs", "classify", "chain_linking", "catalog",
+          "open_cached", "select", "extract", "recover", "carve"]
+
+def get_peak_rss_mb():
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, unit=None):
+        # The block may set record['amount'] to get a rate in unit/s
+        record = {}
+        start = time.perf_counter()
+        yield record
+        seconds = time.perf_counter() - start
+        result = {'seconds': round(seconds, 4), 'peak_rss_mb': round(get_peak_rss_mb(), 1)}
+        if unit and 'amount' in record:
+            result['amount'] = record['amount']
+            result['unit']   = unit
+            result['rate']   = round(record['amount'] / seconds, 2) if seconds else None
+        self.phases[name] = result
+
+def get_image(args, scale):
+    # Images are kept in the work directory and reused by later runs
+    # with the same parameters
+    synth = dhfs_synth.build_parser().parse_args(args.synth)
+    synth.frags = scale
+    params = json.dumps(vars(synth), sort_keys=True).encode()
+    path = os.path.join(args.work, f"synth-{scale}-{hashlib.sha1(params).hexdigest()[:10]}.dd")
+    summary_path = path + ".json"
+    if os.path.exists(path) and os.path.exists(summary_path):
+        with open(summary_path) as fd_in:
+            return path, json.load(fd_in), None
+    start = time.perf_counter()
+    summary = dhfs_synth.write_image(path, synth)
+    seconds = time.perf_counter() - start
+    with open(summary_path, "w") as fd_out:
+        json.dump(summary, fd_out)
+    return path, summary, seconds
+
+def run_scale(args, scale):
+    timer = PhaseTimer()
+    path, summary, gen_seconds = get_image(args, scale)
+    if gen_seconds is not None:
+        timer.phases['generate'] = {'seconds': round(gen_seconds, 4)}
+    out = tempfile.mkdtemp(prefix="dhfs_bench_", dir=args.work)
+
+    dhfs = DHFS41()
+    dhfs.config['CATALOG_CACHE'] = False
+    dhfs.config['CACHE_DIR'] = os.path.join(out, "cache")
+    if args.workers:
+        dhfs.config['EXTRACT_WORKERS'] = args.workers
+        dhfs.config['CARVE_WORKERS'] = args.workers
+    num_descs = scale * len(summary['partitions'])
+
+    dhfs.set_profiling(True)
+    with timer.phase("open", "descs") as record:
+        dhfs.load_image(path)
+        record['amount'] = num_descs
+    profile = dhfs.get_profile()
+    dhfs.set_profiling(False)
+    parts = range(dhfs.get_num_partitions())
+
+    # The phases of open, again one by one
+    with timer.phase("read_descs", "MB") as record:
+        size = 0
+        for part_idx in parts:
+            size += len(dhfs.disk.read_at(dhfs.PART_OFFS[part_idx] + dhfs.DESC_OFF[part_idx],
+                                          dhfs.DESC_SIZE * dhfs.NUM_FRAGS[part_idx]))
+        record['amount'] = round(size / 1024 / 1024, 2)
+    with timer.phase("classify", "descs") as record:
+        for part_idx in parts:
+            dhfs.get_desc_types(part_idx)
+            dhfs.get_free_descs_array(part_idx)
+            dhfs.get_dirty_descs_array(part_idx)
+        record['amount'] = num_descs
+    with timer.phase("chain_linking", "descs") as record:
+        for part_idx in parts:
+            dhfs.build_chain_index(part_idx)
+        record['amount'] = num_descs
+    with timer.phase("catalog", "videos") as record:
+        dhfs.video_catalog = None
+        catalog = dhfs.get_video_catalog()
+        record['amount'] = len(catalog)
+
+    dhfs.config['CATALOG_CACHE'] = True
+    dhfs.load_image(path)
+    with timer.phase("open_cached", "descs") as record:
+        dhfs.load_image(path)
+        record['amount'] = num_descs
+    catalog = dhfs.get_video_catalog()
+
+    with timer.phase("select", "queries") as record:
+        queries = 0
+        for camera in catalog.get_cameras():
+            for date in catalog.get_dates():
+                catalog.select(date=date, camera=camera)
+                queries += 1
+        record['amount'] = queries
+
+    rows = catalog.select()[:args.extract_videos]
+    videos = [catalog.get_video(row) for row in rows]
+    for name in ("videos", "recovered", "carved"):
+        os.makedirs(os.path.join(out, name))
+    with timer.phase("extract", "MB") as record:
+        stats = dhfs.save_videos_at(videos, os.path.join(out, "videos"))
+        record['amount'] = round(stats['bytes'] / 1024 / 1024, 2)
+
+    with timer.phase("recover", "videos") as record:
+        record['amount'] = dhfs.save_recovered_videos(0, os.path.join(out, "recovered"))
+
+    area_start, area_end = dhfs.get_video_area(0)
+    area_mb = (area_end - area_start) / 1024 / 1024
+    if area_mb <= args.carve_max_mb:
+        with timer.phase("carve", "MB") as record:
+            dhfs.save_carved_at_area(0, os.path.join(out, "carved"))
+            record['amount'] = round(area_mb, 2)
+
+    dhfs.disk.close()
+    shutil.rmtree(out, ignore_errors=True)
+    return {'scale': scale, 'image': {'size': summary['size'], 'frag_size': summary['frag_size'],
+                                      'partitions': summary['partitions']},
+            'phases': timer.phases, 'open_profile': profile, 'peak_rss_mb': round(get_peak_rss_mb(), 1)}
+
+def compare(old_file, new_file):
+    # Seconds of each phase, old against new, for the scales in both
+    def load(file_name):
+        results = {}
+        with open(file_name) as fd_in:
+            for line in fd_in:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result['scale']] = result
+        return results
+    old, new = load(old_file), load(new_file)
+    print(f"{'scale':>10} {'phase':<14} {'old s':>10} {'new s':>10} {'speedup':>8}")
+    for scale in sorted(set(old) & set(new)):
+        for name in PHASES:
+            if name == "generate" or name not in old[scale]['phases'] or name not in new[scale]['phases']:
+                continue
+            old_s = old[scale]['phases'][name]['seconds']
+            new_s = new[scale]['phases'][name]['seconds']
+            speedup = f"{old_s / new_s:7.2f}x" if new_s else "-"
+            print(f"{scale:>10} {name:<14} {old_s:>10.4f} {new_s:>10.4f} {speedup:>8}")
+        print(f"{scale:>10} {'peak_rss_mb':<14} {old[scale]['peak_rss_mb']:>10} {new[scale]['peak_rss_mb']:>10}")
+
+def run_scales(args, json_out):
+    # Runs each scale in a child process, writing its result as a JSON line
+    common = {'commit': get_commit(), 'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'cpus': os.cpu_count(), 'synth': args.synth}
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        command = [sys.executable, os.path.abspath(__file__), "--run-scale", str(scale), "--work", args.work,
+                   "--extract-videos", str(args.extract_videos), "--carve-max-mb", str(args.carve_max_mb),
+                   "--synth", " ".join(args.synth)]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        child = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if child.returncode:
+            print(f"Scale {scale} failed", file=sys.stderr)
+            continue
+        result = dict(common, **json.loads(child.stdout.strip().splitlines()[-1]))
+        line = json.dumps(result)
+        json_out.write(line + "\n")
+        json_out.flush()
+        if args.output:
+            with open(args.output, "a") as fd_out:
+                fd_out.write(line + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DHFS41 benchmark on synthetic images")
+    parser.add_argument("--scales", default="10000,100000",
+                        help="fragments per partition, comma separated (default %(default)s)")
+    parser.add_argument("--work", default=os.path.join(tempfile.gettempdir(), "dhfs_bench"),
+                        help="where images are generated and kept (default %(default)s)")
+    parser.add_argument("-o", "--output", help="append results to this JSON lines file")
+    parser.add_argument("--extract-videos", type=int, default=500, help="videos extracted (default %(default)s)")
+    parser.add_argument("--carve-max-mb", type=float, default=8192,
+                        help="skip carving on larger video areas (default %(default)s)")
+    parser.add_argument("--workers", type=int, help="extraction and carving workers")
+    parser.add_argument("--synth", default="", help="dhfs_synth.py options, quoted (e.g. '--dirty 0.1')")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.synth = args.synth.split()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    os.makedirs(args.work, exist_ok=True)
+    # Keep stdout for JSON lines only: DHFS41 prints (the metadata banner
+    # of load_image, DEBUG) go to stderr
+    json_out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.run_scale:
+            json_out.write(json.dumps(run_scale(args, args.run_scale)) + "\n")
+        else:
+            run_scales(args, json_out)
+    json_out.flush()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import json
+import mmap
+import os
+import numpy as np
+
+# Catalog cache file: magic, JSON header length (8 bytes, little endian),
+# JSON header and then the arrays listed in the header, each aligned to
+# ALIGN bytes so they can be used in place from a mapping of the file.
+CACHE_MAGIC   = b"DHFSCAT1"
+CACHE_VERSION = 1
+ALIGN = 64
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def write_cache(path, header, arrays, magic=CACHE_MAGIC):
+    directory = {}
+    offset = 0
+    for name, values in arrays.items():
+        offset = align(offset)
+        directory[name] = [values.dtype.str, offset, len(values)]
+        offset += values.nbytes
+
+    header = dict(header, version=CACHE_VERSION, arrays=directory)
+    header_json = json.dumps(header).encode()
+    base = align(len(CACHE_MAGIC) + 8 + len(header_json))
+
+    # Written aside and renamed, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fd_out:
+        fd_out.write(magic + len(header_json).to_bytes(8, byteorder='little'))
+        fd_out.write(header_json)
+        for name, values in arrays.items():
+            fd_out.seek(base + directory[name][1])
+            fd_out.write(np.ascontiguousarray(values).tobytes())
+        fd_out.truncate(base + offset)
+    os.replace(tmp_path, path)
+
+def read_cache(path, magic=CACHE_MAGIC):
+    # Returns (header, arrays) with the arrays backed by a read-only
+    # mapping of the file, or None if there is no usable cache. Other
+    # indexes use the same format with their own magic.
+    try:
+        with open(path, "rb") as fd_in:
+            cache_map = mmap.mmap(fd_in.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if cache_map[:len(magic)] != magic:
+        return None
+    header_len = int.from_bytes(cache_map[8:16], byteorder='little')
+    try:
+        header = json.loads(cache_map[16:16+header_len])
+    except ValueError:
+        return None
+    if header.get('version') != CACHE_VERSION:
+        return None
+
+    base = align(16 + header_len)
+    arrays = {}
+    for name, (dtype, offset, count) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        if base + offset + count * dtype.itemsize > len(cache_map):
+            return None
+        arrays[name] = np.frombuffer(cache_map, dtype=dtype, count=count, offset=base + offset)
+    return header, arrays
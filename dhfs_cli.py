@@ -0,0 +1,399 @@
+# encoding: utf-8
+#
+# Command line front end for DHFS41. It doesn't import wx, so it runs on
+# headless machines. Every command writes JSON lines to stdout; messages
+# and DEBUG output go to stderr.
+#
+#   python dhfs_cli.py IMAGE list --camera 2 --since "2023-01-02 10:00:00"
+#   python dhfs_cli.py IMAGE extract -o out --date 2023-01-02
+#   python dhfs_cli.py IMAGE batch jobs.txt
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import shlex
+import sys
+import time
+
+import numpy as np
+
+from dhfs41 import DHFS41, text_to_epoch, epoch_to_text
+from dhfs_hash import read_manifest, verify_file
+
+# Where JSON lines go; sys.stdout is redirected to stderr while working
+json_out = None
+
+def emit(record):
+    (json_out or sys.stdout).write(json.dumps(record) + "\n")
+
+def log_stderr(message):
+    print(message, file=sys.stderr)
+
+def add_filters(parser):
+    parser.add_argument("-p", "--partition", type=int, action="append",
+                        help="only this partition (repeatable)")
+    parser.add_argument("--camera", type=int, action="append",
+                        help="only this camera (repeatable)")
+    parser.add_argument("--date", action="append",
+                        help="only videos starting at this date, YYYY-MM-DD (repeatable)")
+    parser.add_argument("--since", help="videos ending at or after 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument("--until", help="videos starting at or before 'YYYY-MM-DD[ HH:MM:SS]'")
+
+def get_partitions(dhfs, args):
+    partitions = range(dhfs.get_num_partitions())
+    if getattr(args, "partition", None):
+        partitions = [p for p in partitions if p in args.partition]
+    return partitions
+
+def get_window(args):
+    # --since/--until as (start, end) epoch seconds
+    start = text_to_epoch(args.since) if args.since else 0
+    end   = text_to_epoch(args.until) if args.until else 2**62
+    if args.until and len(args.until.strip()) == 10:
+        end += 86399
+    return start, end
+
+def select_videos(dhfs, args):
+    # Filters on the catalog columns; --since/--until is an overlap
+    # query on the time index
+    catalog = dhfs.get_video_catalog()
+    if args.since or args.until:
+        rows = catalog.select_time(*get_window(args))
+    else:
+        rows = np.arange(len(catalog), dtype=np.int64)
+    if args.date:
+        rows = np.intersect1d(rows, np.concatenate([catalog.select(date) for date in args.date]))
+    if args.camera:
+        rows = rows[np.isin(catalog.camera[rows], args.camera)]
+    rows = rows[np.isin(catalog.part[rows], list(get_partitions(dhfs, args)))]
+    for row in rows.tolist():
+        yield catalog.get_video(row)
+
+def video_record(dhfs, part_idx, desc_idx):
+    return {'partition': part_idx,
+            'desc'     : desc_idx,
+            'date'     : dhfs.get_begin_date(part_idx, desc_idx),
+            'begin'    : dhfs.get_begin_time(part_idx, desc_idx),
+            'end'      : dhfs.get_end_time(part_idx, desc_idx),
+            'camera'   : dhfs.get_camera(part_idx, desc_idx),
+            'frags'    : dhfs.get_num_frags(part_idx, desc_idx),
+            'size'     : dhfs.get_video_size(part_idx, desc_idx)}
+
+def cmd_list(dhfs, args):
+    for part_idx, desc_idx in select_videos(dhfs, args):
+        emit(video_record(dhfs, part_idx, desc_idx))
+
+def cmd_metadata(dhfs, args):
+    for part_idx, desc_idx in select_videos(dhfs, args):
+        record = {'partition': part_idx, 'desc': desc_idx}
+        record.update(dhfs.decode_descriptor(part_idx, desc_idx))
+        emit(record)
+
+def cmd_extract(dhfs, args):
+    os.makedirs(args.output, exist_ok=True)
+    videos = list(select_videos(dhfs, args))
+    window = get_window(args) if args.clip else None
+    stats = dhfs.save_videos_at(videos, args.output, log_stderr if args.verbose else None,
+                                args.workers, args.pool, window)
+    emit(dict(stats, command="extract", output=args.output))
+
+def cmd_slack(dhfs, args):
+    os.makedirs(args.output, exist_ok=True)
+    videos = list(select_videos(dhfs, args))
+    if args.container:
+        full_name = os.path.join(args.output, args.container)
+        stats = dhfs.save_slack_container(videos, full_name, log_stderr if args.verbose else None, args.scan)
+        emit(dict(stats, command="slack", container=full_name, index=full_name + ".idx"))
+        return
+    saved = dhfs.save_slacks_at(videos, args.output, log_stderr if args.verbose else None)
+    for part_idx, desc_idx, file_name in saved:
+        emit({'partition': part_idx, 'desc': desc_idx, 'file': file_name})
+    emit({'command': "slack", 'slacks': len(saved), 'output': args.output})
+
+def cmd_frames(dhfs, args):
+    # Frame index of each video; with --at, the I-frame to start from to
+    # show that moment is saved to the output directory
+    moment = text_to_epoch(args.at) if args.at else None
+    if moment is not None:
+        os.makedirs(args.output, exist_ok=True)
+    for part_idx, desc_idx in select_videos(dhfs, args):
+        index = dhfs.get_frame_index(part_idx, desc_idx)
+        if index is None:
+            break
+        if args.list:
+            for row in range(len(index)):
+                position, frame_type, length, epoch = index.get_frame(row)
+                emit({'partition': part_idx, 'desc': desc_idx, 'position': position,
+                      'type': frame_type, 'length': length, 'time': epoch_to_text(epoch)})
+        span = index.get_span()
+        record = {'partition': part_idx, 'desc': desc_idx, 'frames': len(index),
+                  'keyframes': len(index.keyframes),
+                  'first': epoch_to_text(span[0]) if span else None,
+                  'last': epoch_to_text(span[1]) if span else None}
+        keyframe = dhfs.read_keyframe(part_idx, desc_idx, moment) if moment is not None else None
+        if keyframe:
+            epoch, frame = keyframe
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(epoch))
+            file_name = os.path.join(args.output, f"p{part_idx}-{desc_idx:06d}-{stamp}.dhav")
+            with open(file_name, "wb") as fd_out:
+                fd_out.write(frame)
+            record.update(keyframe=epoch_to_text(epoch), file=file_name)
+        emit(record)
+
+def cmd_recover(dhfs, args):
+    os.makedirs(args.output, exist_ok=True)
+    for part_idx in get_partitions(dhfs, args):
+        total_videos = dhfs.save_recovered_videos(part_idx, args.output,
+                                                  log_stderr if args.verbose else None)
+        emit({'command': "recover", 'partition': part_idx, 'videos': total_videos})
+
+def cmd_carve(dhfs, args):
+    os.makedirs(args.output, exist_ok=True)
+    for part_idx in get_partitions(dhfs, args):
+        total_videos = dhfs.save_carved_at_area(part_idx, args.output,
+                                                log_stderr if args.verbose else None,
+                                                args.workers)
+        emit({'command': "carve", 'partition': part_idx, 'videos': total_videos})
+
+def cmd_logs(dhfs, args):
+    dhfs.save_logs(args.output)
+    emit({'command': "logs", 'output': args.output})
+
+def cmd_events(dhfs, args):
+    # Decoded log records; with no output, a summary of the log index
+    start, end = get_window(args) if args.since or args.until else (None, None)
+    if not args.output:
+        log_index = dhfs.get_log_index()
+        span = log_index.get_span()
+        emit({'command': "events", 'records': len(log_index),
+              'first': epoch_to_text(span[0]) if span else None,
+              'last': epoch_to_text(span[1]) if span else None,
+              'types': log_index.get_type_counts(), 'channels': log_index.get_channel_counts(),
+              'selected': len(dhfs.find_log_events(start, end, args.type, args.channel))})
+    elif args.output == "-":
+        dhfs.export_logs(json_out or sys.stdout, args.format, start, end, args.type, args.channel)
+    else:
+        with open(args.output, "w", newline="") as out_file:
+            total = dhfs.export_logs(out_file, args.format, start, end, args.type, args.channel)
+        emit({'command': "events", 'records': total, 'output': args.output})
+
+def cmd_descriptors(dhfs, args):
+    categories = args.only or ["main", "free", "dirty"]
+    if args.output == "-":
+        total = dhfs.export_descriptors(json_out or sys.stdout, args.format, categories)
+    else:
+        with open(args.output, "w") as out_file:
+            total = dhfs.export_descriptors(out_file, args.format, categories)
+        emit({'command': "descriptors", 'rows': total, 'output': args.output})
+
+def cmd_info(dhfs, args):
+    for part_idx in range(dhfs.get_num_partitions()):
+        emit({'partition'   : part_idx,
+              'desc_types'  : dhfs.get_desc_types(part_idx),
+              'videos'      : len(dhfs.frags_in_videos[part_idx]),
+              'free_frags'  : len(dhfs.free_frags[part_idx]),
+              'dirty_frags' : len(dhfs.dirty_frags[part_idx])})
+
+def get_cameras(dhfs, args):
+    cameras = dhfs.get_video_catalog().get_cameras()
+    if args.camera:
+        cameras = [camera for camera in cameras if camera in args.camera]
+    return cameras
+
+def cmd_coverage(dhfs, args):
+    for camera in get_cameras(dhfs, args):
+        for begin, end in dhfs.get_coverage(camera):
+            emit({'camera': camera, 'begin': begin, 'end': end})
+
+def cmd_gaps(dhfs, args):
+    for camera in get_cameras(dhfs, args):
+        for begin, end in dhfs.get_gaps(camera, args.since, args.until):
+            emit({'camera': camera, 'begin': begin, 'end': end})
+
+def cmd_verify(dhfs, args):
+    # Checks the files of an export directory against its manifest; with
+    # --sample only that many pieces of each file are read
+    records = {}
+    for record in read_manifest(args.output):
+        # A file saved twice is described by its last record
+        records[record['file']] = record
+    for name, record in records.items():
+        full_name = os.path.join(args.output, name)
+        pieces = None
+        if args.sample and record.get('pieces'):
+            pieces = sorted(random.sample(range(len(record['pieces'])),
+                                          min(args.sample, len(record['pieces']))))
+        try:
+            mismatches = verify_file(full_name, record, pieces)
+        except OSError as e:
+            mismatches = [str(e)]
+        emit({'file': name, 'ok': not mismatches, 'mismatches': mismatches})
+
+def cmd_serve(dhfs, args):
+    # Serves the image over HTTP until interrupted (see dhfs_server)
+    import dhfs_server
+    def on_ready(url):
+        emit({'command': "serve", 'url': url})
+        json_out.flush()
+    dhfs_server.serve(dhfs, args.host, args.port, log_stderr if args.verbose else None, on_ready)
+
+def cmd_batch(dhfs, args):
+    # Runs one command per line of the job file on the already loaded image
+    parser = build_command_parser()
+    with open(args.jobs) as jobs:
+        for line in jobs:
+            line = line.strip()
+            if line and line[0] != "#":
+                job_args = parser.parse_args(shlex.split(line))
+                job_args.func(dhfs, job_args)
+
+def build_command_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(prog="job")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("info", help="partition summary")
+    cmd.set_defaults(func=cmd_info)
+
+    cmd = commands.add_parser("list", help="list videos")
+    add_filters(cmd)
+    cmd.set_defaults(func=cmd_list)
+
+    cmd = commands.add_parser("metadata", help="decoded main descriptor of each video")
+    add_filters(cmd)
+    cmd.set_defaults(func=cmd_metadata)
+
+    cmd = commands.add_parser("descriptors", help="export main, free and dirty descriptors")
+    cmd.add_argument("-o", "--output", required=True, help="output file, - for stdout")
+    cmd.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    cmd.add_argument("--only", choices=["main", "free", "dirty"], action="append",
+                     help="only this kind of descriptor (repeatable)")
+    cmd.set_defaults(func=cmd_descriptors)
+
+    cmd = commands.add_parser("extract", help="save videos")
+    add_filters(cmd)
+    cmd.add_argument("-o", "--output", required=True, help="output directory")
+    cmd.add_argument("-w", "--workers", type=int, help="parallel extraction workers")
+    cmd.add_argument("--pool", choices=["thread", "process", "disk"],
+                     help="disk: one sweep in disk order, for spinning drives")
+    cmd.add_argument("--clip", action="store_true",
+                     help="save only the part of each video between --since and --until")
+    cmd.add_argument("-v", "--verbose", action="store_true")
+    cmd.set_defaults(func=cmd_extract)
+
+    cmd = commands.add_parser("slack", help="save the slack of videos")
+    add_filters(cmd)
+    cmd.add_argument("-o", "--output", required=True, help="output directory")
+    cmd.add_argument("--container", metavar="NAME",
+                     help="save all the slacks in one file NAME, indexed in NAME.idx")
+    cmd.add_argument("--scan", action="store_true",
+                     help="with --container, keep only slacks with the carving signature or frames")
+    cmd.add_argument("-v", "--verbose", action="store_true")
+    cmd.set_defaults(func=cmd_slack)
+
+    cmd = commands.add_parser("frames", help="index the frames of videos (DHAV headers), save keyframes")
+    add_filters(cmd)
+    cmd.add_argument("--list", action="store_true", help="a line per frame")
+    cmd.add_argument("--at", help="save the I-frame showing 'YYYY-MM-DD HH:MM:SS' of each video")
+    cmd.add_argument("-o", "--output", default=".", help="output directory of --at")
+    cmd.set_defaults(func=cmd_frames)
+
+    cmd = commands.add_parser("recover", help="recover videos from free and dirty fragments")
+    cmd.add_argument("-p", "--partition", type=int, action="append")
+    cmd.add_argument("-o", "--output", required=True, help="output directory")
+    cmd.add_argument("-v", "--verbose", action="store_true")
+    cmd.set_defaults(func=cmd_recover)
+
+    cmd = commands.add_parser("carve", help="scan the whole video area for signatures (formatted disks)")
+    cmd.add_argument("-p", "--partition", type=int, action="append")
+    cmd.add_argument("-o", "--output", required=True, help="output directory")
+    cmd.add_argument("-w", "--workers", type=int, help="scanning processes")
+    cmd.add_argument("-v", "--verbose", action="store_true")
+    cmd.set_defaults(func=cmd_carve)
+
+    cmd = commands.add_parser("coverage", help="recorded periods of each camera")
+    cmd.add_argument("--camera", type=int, action="append", help="only this camera (repeatable)")
+    cmd.set_defaults(func=cmd_coverage)
+
+    cmd = commands.add_parser("gaps", help="periods without recording of each camera")
+    cmd.add_argument("--camera", type=int, action="append", help="only this camera (repeatable)")
+    cmd.add_argument("--since", help="start of the period checked, 'YYYY-MM-DD[ HH:MM:SS]'")
+    cmd.add_argument("--until", help="end of the period checked, 'YYYY-MM-DD[ HH:MM:SS]'")
+    cmd.set_defaults(func=cmd_gaps)
+
+    cmd = commands.add_parser("logs", help="save the filesystem logs")
+    cmd.add_argument("-o", "--output", required=True, help="output file")
+    cmd.set_defaults(func=cmd_logs)
+
+    cmd = commands.add_parser("events", help="decode the log records (layout: LOG_FIELDS)")
+    cmd.add_argument("-o", "--output", help="output file, - for stdout; without it, a summary")
+    cmd.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    cmd.add_argument("--type", type=int, action="append", help="only this event type (repeatable)")
+    cmd.add_argument("--channel", type=int, action="append", help="only this channel (repeatable)")
+    cmd.add_argument("--since", help="events at or after 'YYYY-MM-DD[ HH:MM:SS]'")
+    cmd.add_argument("--until", help="events at or before 'YYYY-MM-DD[ HH:MM:SS]'")
+    cmd.set_defaults(func=cmd_events)
+
+    cmd = commands.add_parser("verify", help="check exported files against the manifest of their directory")
+    cmd.add_argument("-o", "--output", required=True, help="export directory")
+    cmd.add_argument("--sample", type=int, help="check only this many random pieces of each file")
+    cmd.set_defaults(func=cmd_verify)
+
+    cmd = commands.add_parser("serve", help="serve the catalog and videos over HTTP, with range requests")
+    cmd.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    cmd.add_argument("--port", type=int, default=8041)
+    cmd.add_argument("-v", "--verbose", action="store_true", help="log requests")
+    cmd.set_defaults(func=cmd_serve)
+
+    cmd = commands.add_parser("batch", help="run the commands listed in a file")
+    cmd.add_argument("jobs", help="file with one command per line")
+    cmd.set_defaults(func=cmd_batch)
+    return parser
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DHFS4.1 extractor (command line)")
+    parser.add_argument("image", help="DHFS4.1 image or disk")
+    parser.add_argument("-c", "--config", help="configuration file")
+    parser.add_argument("--mmap", action="store_true", help="memory-map the image")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--hash", help="hash exports inline with these algorithms, e.g. md5,sha256")
+    parser.add_argument("--hash-pieces", action="store_true", help="also hash each fragment-sized piece")
+    parser.add_argument("--profile", action="store_true",
+                        help="end with a {\"profile\": ...} line of phase times and read counters")
+    build_command_parser(parser)
+    args = parser.parse_args(argv)
+
+    dhfs = DHFS41(DEBUG=args.debug)
+    if args.config:
+        dhfs.set_config(args.config)
+    if args.mmap:
+        dhfs.config['MMAP'] = True
+    if args.hash:
+        # Checked as set_config does, before any worker uses them
+        try:
+            dhfs.config['HASH'] = [hashlib.new(name.strip().lower()).name
+                                   for name in args.hash.split(",") if name.strip()]
+        except ValueError as e:
+            parser.error(f"--hash: {e}")
+    if args.hash_pieces:
+        dhfs.config['HASH_PIECES'] = True
+    if args.profile:
+        dhfs.set_profiling(True)
+
+    # Keep stdout for JSON lines only
+    global json_out
+    json_out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        if not dhfs.load_image(args.image):
+            log_stderr(f"{args.image}: this does not appear to be a DHFS 4.1 filesystem.")
+            return 1
+        args.func(dhfs, args)
+    if args.profile:
+        emit({'profile': dhfs.get_profile()})
+    json_out.flush()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
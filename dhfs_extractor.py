@@ -13,20 +13,58 @@ The author has made every effort to ensure correct operation, but no warranty, i
 '''
 
 from dhfs41 import *
+from dhfs_jobs import JobQueue
 import sys
 import wx
-import wx.lib.mixins.listctrl as listmix
 import os
 import time
-
-class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
+import numpy as np
+
+class VideoListCtrl(wx.ListCtrl):
+    # Virtual list: shows the catalog rows in self.rows, asking the
+    # catalog for the text of an item only when it is drawn
+    def __init__(self, parent, style):
+        super().__init__(parent, -1, style=style | wx.LC_VIRTUAL)
+        self.catalog = None
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def set_rows(self, catalog, rows):
+        # A virtual list keeps its selection by position, which would now
+        # be other videos: it is cleared while the old rows still apply
+        for item in list(self.get_selected_items()):
+            self.Select(item, False)
+        self.catalog = catalog
+        self.rows = rows
+        self.SetItemCount(len(rows))
+        self.Refresh()
+
+    def get_catalog_row(self, item):
+        return int(self.rows[item])
+
+    def get_selected_items(self):
+        item = self.GetFirstSelected()
+        while item != -1:
+            yield item
+            item = self.GetNextSelected(item)
+
+    def OnGetItemText(self, item, col):
+        return self.catalog.get_text(self.rows[item], col)
+
+    def OnGetItemImage(self, item):
+        # The image list only holds the sort arrows of the headers
+        return -1
+
+class dhfs_extractor(wx.Frame):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.SetSize(840, 530)
         self.dhfs = DHFS41(DEBUG=DEBUG)
+        self.sort_col = None
+        self.sort_ascending = True
+        self.selection_stats = None
+        self.selection_info_pending = False
         self.create_gui()
-        self.itemDataMap = {}                # ID -> tuple of column values
-        listmix.ColumnSorterMixin.__init__(self, len(self.video_list_headers))
+        self.jobs = JobQueue(self.dhfs, self.show_job_status, wx.CallAfter)
 
     def resource_path(self, relative_path):
         """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -37,13 +75,6 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
             base_path = os.path.abspath(".")
         return os.path.join(base_path, relative_path)
 
-    def GetListCtrl(self):
-        return self.video_list
-
-    def GetSortImages(self): # type: ignore
-        # Return the indices of the images in the ImageList, not the bitmaps themselves.
-        return (0, 1)
-
     def create_gui(self):
         art = wx.ArtProvider
         self.CreateStatusBar(3)
@@ -78,6 +109,8 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
                              bitmap=wx.Bitmap(self.resource_path("icons/recover.png")))
         self.toolbar.AddTool(toolId=108, label=center_label("Save\nLogs"), shortHelp="Save the filesystem logs",
                              bitmap=art.GetBitmap(wx.ART_PRINT, wx.ART_TOOLBAR))
+        self.toolbar.AddTool(toolId=112, label=center_label("Cancel"), shortHelp="Cancel the running and queued operations",
+                             bitmap=art.GetBitmap(wx.ART_CROSS_MARK, wx.ART_TOOLBAR))
         self.toolbar.AddTool(toolId=109, label=center_label("Settings"), shortHelp="Configure the application",
                              bitmap=art.GetBitmap(wx.ART_EDIT, wx.ART_TOOLBAR))
         self.toolbar.AddTool(toolId=110, label=center_label("About"), shortHelp="About this application",
@@ -111,12 +144,21 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
         self.camera_list = wx.ListBox(self.left_panel, style=wx.LB_SINGLE)
         left_sizer.Add(camera_label, 0, wx.ALL, 5)
         left_sizer.Add(self.camera_list, 1, wx.EXPAND | wx.ALL, 5)
+
+        window_label = wx.StaticText(self.left_panel, label="Recording between")
+        self.window_start = wx.TextCtrl(self.left_panel, style=wx.TE_PROCESS_ENTER)
+        self.window_end   = wx.TextCtrl(self.left_panel, style=wx.TE_PROCESS_ENTER)
+        self.window_start.SetHint("YYYY-MM-DD HH:MM:SS")
+        self.window_end.SetHint("YYYY-MM-DD HH:MM:SS")
+        left_sizer.Add(window_label, 0, wx.ALL, 5)
+        left_sizer.Add(self.window_start, 0, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+        left_sizer.Add(self.window_end, 0, wx.EXPAND | wx.ALL, 5)
         self.left_panel.SetSizer(left_sizer)
 
         # Right panel sizer
         right_sizer = wx.BoxSizer(wx.VERTICAL)
         
-        self.video_list = wx.ListCtrl(self.right_panel, -1, style=wx.LC_REPORT | wx.BORDER_SUNKEN)
+        self.video_list = VideoListCtrl(self.right_panel, style=wx.LC_REPORT | wx.BORDER_SUNKEN)
         self.video_list.SetBackgroundColour(wx.WHITE)
         
         self.sort_images = wx.ImageList(16, 16)
@@ -143,9 +185,12 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
 
         self.Bind(wx.EVT_LISTBOX, self.filter_videos, self.date_list)
         self.Bind(wx.EVT_LISTBOX, self.filter_videos, self.camera_list)
+        self.Bind(wx.EVT_TEXT_ENTER, self.filter_videos, self.window_start)
+        self.Bind(wx.EVT_TEXT_ENTER, self.filter_videos, self.window_end)
         
         self.video_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.update_selection_info)
         self.video_list.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.update_selection_info)
+        self.video_list.Bind(wx.EVT_LIST_COL_CLICK, self.on_column_click)
 
         self.Show(True)
         
@@ -174,6 +219,7 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
         ID_CONFIG = 109
         ID_ABOUT = 110
         ID_EXIT = 111
+        ID_CANCEL = 112
 
         if   e.GetId() == ID_OPEN_IMAGE: self.on_load_image()
         elif e.GetId() == ID_OPEN_DISK:  self.load_disk()
@@ -185,31 +231,70 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
         elif e.GetId() == ID_LOGS:       self.save_logs()
         elif e.GetId() == ID_CONFIG:     self.config()
         elif e.GetId() == ID_ABOUT:      self.show_about()
+        elif e.GetId() == ID_CANCEL:     self.jobs.cancel_all()
         elif e.GetId() == ID_EXIT:       self.Close()
 
     def update_selection_info(self, event=None):
-        selected_count = 0
-        total_size = 0.0
-        for i in range(self.video_list.GetItemCount()):
-            if self.video_list.IsSelected(i):
-                selected_count += 1
-                size_str = self.video_list.GetItemText(i, 6)
-                if "MB" in size_str:
-                    total_size += float(size_str.replace("MB", "").strip()) / 1024
-                elif "GB" in size_str:
-                    total_size += float(size_str.replace("GB", "").strip())
-
-        if selected_count == 0:
+        # Keeps the statistics of the selection by the row of each event
+        # and redraws the label once per burst of events
+        if self.selection_stats is None:
+            return
+        if event is not None and event.GetIndex() >= 0:
+            row = self.video_list.get_catalog_row(event.GetIndex())
+            self.selection_stats.update(row, event.GetEventType() == wx.wxEVT_LIST_ITEM_SELECTED)
+        if not self.selection_info_pending:
+            self.selection_info_pending = True
+            wx.CallAfter(self.show_selection_info)
+
+    def show_selection_info(self):
+        self.selection_info_pending = False
+        stats = self.selection_stats
+        if stats is None:
+            return
+        # Range selections in virtual lists may not send an event per item
+        if stats.count != self.video_list.GetSelectedItemCount():
+            stats.set_rows([self.video_list.get_catalog_row(item)
+                            for item in self.video_list.get_selected_items()])
+
+        total_size = stats.bytes / 1024**3
+        if stats.count == 0:
             self.selection_info.SetLabel("")
-        elif selected_count == 1:
+        elif stats.count == 1:
             self.selection_info.SetLabel(f"({total_size:.1f} GB)")
         else:
-            self.selection_info.SetLabel(f"{selected_count} selected clips ({total_size:.1f} GB)")
+            self.selection_info.SetLabel(f"{stats.count} selected clips ({total_size:.1f} GB)")
+
+        summary = stats.get_summary(self.dhfs.extract_throughput)
+        details = [f"Camera {camera:02d}: {size / 1024**2:.1f} MB"
+                   for camera, size in summary['cameras'].items()]
+        details += [f"{date}: {size / 1024**2:.1f} MB" for date, size in summary['dates'].items()]
+        if summary['eta_seconds'] is not None:
+            details.append(f"Estimated extraction time: {summary['eta_seconds']:.0f} s")
+        self.selection_info.SetToolTip("\n".join(details))
+
+    def show_job_status(self, text, progress):
+        # Called on the GUI thread by the job queue
+        if text is not None:
+            self.SetStatusText(text, 0)
+        if progress is None:
+            self.SetStatusText("", 2)
+            return
+        status = ""
+        if progress['fraction'] is not None:
+            status += f"{progress['fraction'] * 100:4.1f}%  "
+        if progress['unit'] == "bytes":
+            status += f"{progress['throughput'] / 1024**2:.1f} MB/s"
+        else:
+            status += f"{progress['throughput']:.1f} {progress['unit']}/s"
+        if progress['eta'] is not None:
+            status += f"  ETA {time.strftime('%H:%M:%S', time.gmtime(progress['eta']))}"
+        self.SetStatusText(status, 2)
 
     def clear_ui(self):
         self.date_list.Clear()
         self.camera_list.Clear()
-        self.video_list.DeleteAllItems()
+        self.video_list.set_rows(None, np.empty(0, dtype=np.int64))
+        self.selection_stats = None
         self.selection_info.SetLabel("")
         self.SetStatusText("", 0)
         self.SetStatusText("", 1)
@@ -225,41 +310,43 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
         if dialog.ShowModal() == wx.ID_OK:
             file_path = dialog.GetPath()
 
-            self.SetStatusText("Loading image...")
-            if self.dhfs.load_image(file_path):
-                self.show_videos_info()
-            else:
-                self.SetStatusText("")
-                wx.MessageBox("This does not appear to be a DHFS 4.1 filesystem.", "Invalid Filesystem",
-                                style=wx.OK | wx.ICON_ERROR)
+            # Videos are listed as each partition is ready
+            on_partition = lambda part_idx, error: wx.CallAfter(self.on_partition_loaded, error)
+            self.jobs.submit("Loading image", lambda log: self.dhfs.load_image(file_path, on_partition=on_partition),
+                             self.on_image_loaded)
+
+    def on_partition_loaded(self, error):
+        if error is None:
+            self.date_list.Clear()
+            self.camera_list.Clear()
+            self.show_videos_info()
+
+    def on_image_loaded(self, job):
+        if job.result:
+            self.date_list.Clear()
+            self.camera_list.Clear()
+            self.show_videos_info()
+        elif job.error is None:
+            self.SetStatusText("")
+            wx.MessageBox("This does not appear to be a DHFS 4.1 filesystem.", "Invalid Filesystem",
+                            style=wx.OK | wx.ICON_ERROR)
 
     def show_about(self):
         wx.MessageBox(copyright, "About", style=wx.OK)
 
     def show_metadata(self):
         message = self.dhfs.get_image_metadata()
+        if message and self.dhfs.profiler.enabled:
+            message += self.dhfs.profiler.get_text()
         if message:
             wx.MessageBox(message, "Disk Information", style=wx.OK)
         else:
             wx.MessageBox("No image or disk loaded.", "Warning", style=wx.OK | wx.ICON_WARNING)
 
     def show_videos_info(self):
-        all_video_dates  = []
-        all_cameras      = []
-        for p_idx in range(self.dhfs.get_num_partitions()):
-            for d_idx in self.dhfs.get_main_descs(p_idx):
-                video_date = self.dhfs.get_begin_date(p_idx, d_idx)
-                if video_date not in all_video_dates:
-                    all_video_dates.append(video_date)
-
-                camera = f"{self.dhfs.get_camera(p_idx, d_idx):02d}"
-                if camera not in all_cameras:
-                    all_cameras.append(camera)
-
-        all_video_dates.sort()
-        all_video_dates.insert(0, "All")
-        all_cameras.sort()
-        all_cameras.insert(0, "All")
+        catalog = self.dhfs.get_video_catalog()
+        all_video_dates = ["All"] + catalog.get_dates()
+        all_cameras     = ["All"] + [f"{camera:02d}" for camera in catalog.get_cameras()]
 
         self.date_list.InsertItems(all_video_dates, 0)
         self.date_list.SetSelection(0)
@@ -270,53 +357,75 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
         self.filter_videos(None)
 
     def filter_videos(self, evt):
-        self.video_list.DeleteAllItems()
-
-        videos_scanned = 0
-        video_idx = 0
-        total_videos = sum(len(videos) for videos in self.dhfs.frags_in_videos)
-        for part_idx in range(self.dhfs.get_num_partitions()):
-            for desc_idx in self.dhfs.get_main_descs(part_idx):
-                date = self.dhfs.get_begin_date(part_idx, desc_idx)
-                begin = self.dhfs.get_begin_time(part_idx, desc_idx)
-                end = self.dhfs.get_end_time(part_idx, desc_idx)
-                cam = f"{self.dhfs.get_camera(part_idx, desc_idx):02d}"
-                size = f"{self.dhfs.get_video_size(part_idx, desc_idx) / 1024 ** 2:.2f} MB"
-
-                selected_date = self.date_list.GetStringSelection()
-                selected_cam = self.camera_list.GetStringSelection()
-
-                if (((selected_date == "All") or (selected_date == date)) and
-                        ((selected_cam == "All") or (selected_cam == cam))):
-                    self.video_list.InsertItem(video_idx, str(part_idx))
-                    self.video_list.SetItem(video_idx, 1, str(desc_idx))
-                    self.video_list.SetItem(video_idx, 2, date)
-                    self.video_list.SetItem(video_idx, 3, begin)
-                    self.video_list.SetItem(video_idx, 4, end)
-                    self.video_list.SetItem(video_idx, 5, cam)
-                    self.video_list.SetItem(video_idx, 6, size)
-                        # After inserting and SetItem(…) for columns 1–6:
-                    self.video_list.SetItemData(video_idx, video_idx)
-                    self.itemDataMap[video_idx] = (
-                        part_idx,
-                        desc_idx,
-                        date,
-                        begin,
-                        end,
-                        int(cam),         # convert camera string to int for numeric sort
-                        float(size.split()[0])
-                    )
-
-                    video_idx += 1
-
-                videos_scanned += 1
-                if videos_scanned % 50 == 0:
-                    self.SetStatusText(f"Listing Videos... {(videos_scanned / total_videos) * 100:.2f}%")
+        catalog = self.dhfs.get_video_catalog()
+        selected_date = self.date_list.GetStringSelection()
+        selected_cam = self.camera_list.GetStringSelection()
+
+        rows = catalog.select(None if selected_date == "All" else selected_date,
+                              None if selected_cam == "All" else int(selected_cam))
+        window = self.get_time_window()
+        if window is None:
+            return
+        if window != (None, None):
+            start, end = window
+            rows = np.intersect1d(rows, catalog.select_time(start or 0, end or 2**62),
+                                  assume_unique=True)
+        if self.sort_col is not None:
+            rows = catalog.sort_rows(rows, self.sort_col, self.sort_ascending)
+        self.video_list.set_rows(catalog, rows)
+        if self.selection_stats is None or self.selection_stats.catalog is not catalog:
+            self.selection_stats = SelectionStats(catalog)
+        self.selection_stats.clear()
 
         self.SetStatusText("Done!")
-        self.SetStatusText(f"{video_idx} items", 1)
+        self.SetStatusText(f"{len(rows)} items", 1)
         self.selection_info.SetLabel("")
 
+    def get_time_window(self):
+        # (start, end) epoch seconds of the time window boxes, None for
+        # an empty box; None if a box can't be read
+        window = []
+        for text_ctrl, day_end in ((self.window_start, 0), (self.window_end, 86399)):
+            text = text_ctrl.GetValue().strip()
+            if not text:
+                window.append(None)
+                continue
+            try:
+                window.append(text_to_epoch(text) + (day_end if len(text) == 10 else 0))
+            except ValueError:
+                wx.MessageBox(f"Invalid date: {text}\nUse YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.",
+                              "Time Window", style=wx.OK | wx.ICON_WARNING)
+                return None
+        return tuple(window)
+
+    def on_column_click(self, event):
+        col = event.GetColumn()
+        if self.video_list.catalog is None or col < 0:
+            return
+        if self.sort_col == col:
+            self.sort_ascending = not self.sort_ascending
+        else:
+            if self.sort_col is not None:
+                self.video_list.ClearColumnImage(self.sort_col)
+            self.sort_col = col
+            self.sort_ascending = True
+        # Image 1 is the up arrow, 0 the down one
+        self.video_list.SetColumnImage(col, 1 if self.sort_ascending else 0)
+
+        # Selection is kept by video, not by position
+        catalog  = self.video_list.catalog
+        selected = {self.video_list.get_catalog_row(item)
+                    for item in self.video_list.get_selected_items()}
+        rows = catalog.sort_rows(self.video_list.rows, col, self.sort_ascending)
+        self.video_list.set_rows(catalog, rows)
+        for item in np.flatnonzero(np.isin(rows, list(selected))).tolist():
+            self.video_list.Select(item)
+
+    def get_selected_videos(self):
+        catalog = self.video_list.catalog
+        return [catalog.get_video(self.video_list.get_catalog_row(item))
+                for item in self.video_list.get_selected_items()]
+
     def get_save_path(self):
         self.dlg = wx.DirDialog(self, "Choose a directory to save the files...", os.getcwd(),
                         wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
@@ -327,36 +436,65 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
             wx.MessageBox("No image/disk loaded!", "Warning", style=wx.OK)
             return
 
+        window = self.get_time_window()
+        if window is None:
+            return
+        if window != (None, None):
+            if wx.MessageBox("Save only the part of each video inside the time window?",
+                             "Save Videos", style=wx.YES_NO | wx.YES_DEFAULT) == wx.YES:
+                window = (window[0] or 0, window[1] or 2**62)
+            else:
+                window = None
+        else:
+            window = None
+
         dir_save = self.get_save_path()
         if dir_save:
-            total_videos = 0
-            for lb_video_idx in range(self.video_list.GetItemCount()):
-                if self.video_list.IsSelected(lb_video_idx):
-                    part_idx = int(self.video_list.GetItemText(lb_video_idx, 0))
-                    vid_idx = int(self.video_list.GetItemText(lb_video_idx, 1))
-                    self.dhfs.save_video_at(part_idx, vid_idx, dir_save, self.SetStatusText)
-                    total_videos += 1
-            self.SetStatusText(f"Done. {total_videos} video(s) saved.")
+            videos = self.get_selected_videos()
+            self.jobs.submit("Saving videos",
+                             lambda log: self.dhfs.save_videos_at(videos, dir_save, log, window=window),
+                             self.on_videos_saved)
+
+    def on_videos_saved(self, job):
+        if job.result:
+            stats = job.result
+            self.SetStatusText(f"Done. {stats['videos']} video(s) saved " +
+                               f"({stats['throughput']:.1f} MB/s)" +
+                               (", cancelled." if job.cancelled else "."))
 
     def export_videos_metadata(self):
         if not self.dhfs.img_loaded:
             wx.MessageBox("No image/disk loaded!", "Warning", style=wx.OK)
             return
 
+        all_descs = wx.MessageBox("Export every descriptor of the image (main, free and dirty)?\n" +
+                                  "Choose No to export only the selected videos.",
+                                  "Export Metadata", style=wx.YES_NO | wx.NO_DEFAULT) == wx.YES
+
         file_dialog = wx.FileDialog(self, "Save Video Metadata",
                                      wildcard="csv (*.csv)|*.csv",
                                      style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
         if file_dialog.ShowModal() == wx.ID_CANCEL: return
 
+        if all_descs:
+            file_save = file_dialog.GetPath()
+            def export_descriptors(log):
+                with open(file_save, "w") as fd_out:
+                    return self.dhfs.export_descriptors(fd_out)
+            self.jobs.submit("Exporting descriptors", export_descriptors,
+                             lambda job: job.result is not None and
+                                         self.SetStatusText(f"Done. {job.result} descriptor(s) exported."))
+            return
+
         with open(file_dialog.GetPath(), "w") as fd_out:
             fd_out.write(";".join(self.video_list_headers) + "\n")
             total_videos = 0
-            for lb_video_idx in range(self.video_list.GetItemCount()):
-                if self.video_list.IsSelected(lb_video_idx):
-                    metadata = ";".join([self.video_list.GetItemText(lb_video_idx, i)
-                                            for i in range(7)])
-                    fd_out.write(metadata + "\n")
-                    total_videos += 1
+            catalog = self.video_list.catalog
+            for lb_video_idx in self.video_list.get_selected_items():
+                row = self.video_list.get_catalog_row(lb_video_idx)
+                metadata = ";".join([catalog.get_text(row, i) for i in range(7)])
+                fd_out.write(metadata + "\n")
+                total_videos += 1
 
         if total_videos == 0:
             wx.MessageBox("Please select one or more videos to export.", "No Videos Selected",
@@ -369,14 +507,23 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
 
         dir_save = self.get_save_path()
         if dir_save:
-            total_slacks = 0
-            for lb_video_idx in range(self.video_list.GetItemCount()):
-                if self.video_list.IsSelected(lb_video_idx):
-                    part_idx = int(self.video_list.GetItemText(lb_video_idx, 0))
-                    video_idx = int(self.video_list.GetItemText(lb_video_idx, 1))
-                    self.dhfs.save_slack_at(total_slacks, part_idx, video_idx, dir_save, self.SetStatusText)
-                    total_slacks += 1
-            self.SetStatusText(f"Done. {total_slacks} slack file(s) saved.")
+            videos = self.get_selected_videos()
+            container = wx.MessageBox("Save all slacks in a single container file (slacks.bin),\n" +
+                                      "indexed in slacks.bin.idx, instead of a file each?",
+                                      "Save Slack", style=wx.YES_NO | wx.NO_DEFAULT) == wx.YES
+            scan = container and wx.MessageBox("Keep only slacks with the carving signature or video frames?",
+                                               "Save Slack", style=wx.YES_NO | wx.NO_DEFAULT) == wx.YES
+            def save_slacks(log):
+                if container:
+                    return self.dhfs.save_slack_container(videos, os.path.join(dir_save, "slacks.bin"),
+                                                          log, scan)['kept']
+                return len(self.dhfs.save_slacks_at(videos, dir_save, log))
+            self.jobs.submit("Saving slack", save_slacks, self.on_slacks_saved)
+
+    def on_slacks_saved(self, job):
+        if job.result is not None:
+            self.SetStatusText(f"Done. {job.result} slack file(s) saved" +
+                               (", cancelled." if job.cancelled else "."))
 
     def save_recovered(self):
         if not self.dhfs.img_loaded:
@@ -385,11 +532,23 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
 
         dir_save = self.get_save_path()
         if dir_save:
-            total_videos = 0
-            for part_idx in range(self.dhfs.get_num_partitions()):
-                total_videos += self.dhfs.save_recovered_videos(part_idx, dir_save, self.SetStatusText)
-            self.SetStatusText(f"Done. {total_videos} video(s) recovered.")
-            wx.MessageBox(f"{total_videos} Video(s) sucessfully saved.", style=wx.OK)
+            carve_area = wx.MessageBox("Also scan the whole video area for signatures?\n" +
+                                       "Use it for formatted disks; it reads the entire disk.",
+                                       "Recover Videos", style=wx.YES_NO | wx.NO_DEFAULT) == wx.YES
+            def save_recovered(log):
+                total_videos = 0
+                for part_idx in range(self.dhfs.get_num_partitions()):
+                    total_videos += self.dhfs.save_recovered_videos(part_idx, dir_save, log)
+                    if carve_area:
+                        total_videos += self.dhfs.save_carved_at_area(part_idx, dir_save, log)
+                return total_videos
+            self.jobs.submit("Recovering videos", save_recovered, self.on_recovered_saved)
+
+    def on_recovered_saved(self, job):
+        if job.result is not None:
+            self.SetStatusText(f"Done. {job.result} video(s) recovered" +
+                               (", cancelled." if job.cancelled else "."))
+            wx.MessageBox(f"{job.result} Video(s) sucessfully saved.", style=wx.OK)
 
     def save_logs(self):
         if not self.dhfs.img_loaded:
@@ -397,13 +556,28 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
             return
 
         file_dialog = wx.FileDialog(self, "Save Log file",
-                        wildcard="log (*.log)|*.log",
+                        wildcard="Raw log (*.log)|*.log|Decoded events, CSV (*.csv)|*.csv|" +
+                                 "Decoded events, JSON lines (*.jsonl)|*.jsonl",
                         style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
 
         if file_dialog.ShowModal() == wx.ID_CANCEL: return
 
         file_save = file_dialog.GetPath()
-        self.dhfs.save_logs (file_save)
+        fmt = [None, "csv", "jsonl"][file_dialog.GetFilterIndex()]
+        if fmt is None:
+            self.jobs.submit("Saving logs", lambda log: self.dhfs.save_logs(file_save))
+            return
+
+        # Decoded events, only those in the time window if one is given
+        window = self.get_time_window()
+        if window is None:
+            return
+        def export_logs(log):
+            with open(file_save, "w", newline="") as fd_out:
+                return self.dhfs.export_logs(fd_out, fmt, *window)
+        self.jobs.submit("Decoding logs", export_logs,
+                         lambda job: job.result is not None and
+                                     self.SetStatusText(f"Done. {job.result} log record(s) exported."))
 
     def config(self):
         wx.MessageBox("This will open a configuration file.\n\n" +
@@ -413,7 +587,22 @@ class dhfs_extractor(wx.Frame, listmix.ColumnSorterMixin):
                       "key3 = VALUE3\n\n"+
                       "Currently, the following keys are supported:\n"+
                       "CARVE_SIGNAT: A Python regex for video carving.\n"+
-                      "DEBUG: True or False.",
+                      "DEBUG: True or False.\n"+
+                      "MMAP: True or False (memory-map images when opening).\n"+
+                      "EXTRACT_WORKERS: Number of parallel extraction workers.\n"+
+                      "EXTRACT_POOL: thread, process or disk (one sweep in disk order, for HDDs).\n"+
+                      "LOAD_WORKERS: Number of partitions loaded at the same time (large ones linked in processes).\n"+
+                      "CARVE_WORKERS: Number of processes scanning formatted disks.\n"+
+                      "CARVE_CHUNK: Bytes scanned by each process at a time.\n"+
+                      "CARVE_MAX_SIZE: Largest carved video in bytes, 0 for no limit.\n"+
+                      "CATALOG_CACHE: True or False (reuse catalogs of images already opened).\n"+
+                      "CACHE_DIR: Directory of the catalog cache.\n"+
+                      "HASH: Hash exports while saving them, e.g. md5,sha256 (manifest.jsonl).\n"+
+                      "HASH_PIECES: True or False (also hash each fragment of the exports).\n"+
+                      "PROFILE: True or False (phase times and read counters in Disk Info).\n"+
+                      "LOG_RECORD_SIZE: Bytes of each log record (64).\n"+
+                      "LOG_FIELDS: Layout of a log record, name:offset:format,... (time required).\n"+
+                      "LOG_TIME: packed or unix (encoding of the log time field).",
                       "Configuration", style=wx.OK)
 
         self.dlg = wx.FileDialog(self, "Choose a File", os.getcwd(), "")
@@ -0,0 +1,64 @@
+import numpy as np
+
+# Frame index of a video: position in the video stream (as saved by
+# save_video_at), type, length and embedded time of each DHAV frame, found
+# by hopping from header to header by frame length, without decoding.
+# About 24 bytes a frame, so even long videos index in a few MB.
+FRAME_DTYPE = np.dtype([('position', '<u8'),
+                        ('type',     'u1'),
+                        ('length',   '<u4'),
+                        ('epoch',    '<i8')])
+I_FRAME = 0xFD
+
+def stream_to_extents(extents, position, size):
+    # Extents of the image holding size bytes from position of the stream
+    # made of extents
+    result = []
+    stream_pos = 0
+    for offset, length in extents:
+        if size <= 0:
+            break
+        if position < stream_pos + length:
+            skip = max(position - stream_pos, 0)
+            take = min(length - skip, size)
+            result.append((offset + skip, take))
+            position += take
+            size -= take
+        stream_pos += length
+    return result
+
+class FrameIndex:
+    def __init__(self, frames):
+        self.frames    = frames
+        self.keyframes = np.flatnonzero(frames['type'] == I_FRAME)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_frame(self, row):
+        # (position, type, length, epoch) of a frame
+        frame = self.frames[row]
+        return int(frame['position']), int(frame['type']), int(frame['length']), int(frame['epoch'])
+
+    def get_span(self):
+        if not len(self.frames):
+            return None
+        return int(self.frames['epoch'].min()), int(self.frames['epoch'].max())
+
+    def find_keyframe(self, moment):
+        # Row of the last I-frame not after moment (epoch seconds), the
+        # first I-frame if all are after it, None without I-frames. Frames
+        # are in stream order: a clock going back makes the first I-frame
+        # found from the end win.
+        if not len(self.keyframes):
+            return None
+        before = self.keyframes[self.frames['epoch'][self.keyframes] <= moment]
+        return int(before[-1]) if len(before) else int(self.keyframes[0])
+
+    def find_end(self, moment, after=0):
+        # Stream position where the first frame after moment (from row
+        # after on) starts, None if there is no such frame
+        rows = np.flatnonzero(self.frames['epoch'][after:] > moment)
+        if not len(rows):
+            return None
+        return int(self.frames['position'][after + rows[0]])
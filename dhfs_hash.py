@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+
+# Exports are hashed as they are written: the bytes read from the image
+# go to the output file and to a Hasher, whose thread digests them while
+# the next block is being read (hashlib releases the GIL on large
+# buffers), so evidence files don't have to be read again to hash them.
+HASH_BLOCK = 4 * 1024 * 1024
+MANIFEST_NAME = "manifest.jsonl"
+
+# Pieces of files saved in disk order kept to be hashed in file order,
+# at most this many bytes for all the files of a sweep (see SweepHashers)
+HASH_PENDING = 64 * 1024 * 1024
+
+class Hasher:
+    # Digests of a stream with the given algorithms, plus, if piece_size,
+    # the SHA-256 of each piece_size piece (the last one may be shorter).
+    # Unless threaded is False, the digests are computed by a thread.
+    def __init__(self, algorithms, piece_size=0, threaded=True):
+        self.digests    = {name: hashlib.new(name) for name in algorithms}
+        self.piece_size = piece_size
+        self.pieces     = []
+        self.piece      = hashlib.sha256()
+        self.piece_fill = 0
+        self.thread     = None
+        if threaded:
+            # Bounded, so reading can't run far ahead of hashing
+            self.queue  = queue.Queue(maxsize=4)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def update(self, data):
+        if self.thread:
+            self.queue.put(data)
+        else:
+            self.digest(data)
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            self.digest(data)
+
+    def digest(self, data):
+        for digest in self.digests.values():
+            digest.update(data)
+        if self.piece_size:
+            self.update_pieces(memoryview(data))
+
+    def update_pieces(self, data):
+        while len(data):
+            take = min(len(data), self.piece_size - self.piece_fill)
+            self.piece.update(data[:take])
+            self.piece_fill += take
+            data = data[take:]
+            if self.piece_fill == self.piece_size:
+                self.pieces.append(self.piece.hexdigest())
+                self.piece = hashlib.sha256()
+                self.piece_fill = 0
+
+    def finish(self):
+        # {algorithm: hex digest}, with 'pieces' if piece hashes were asked
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+        result = {name: digest.hexdigest() for name, digest in self.digests.items()}
+        if self.piece_size:
+            if self.piece_fill:
+                self.pieces.append(self.piece.hexdigest())
+            result['piece_size'] = self.piece_size
+            result['pieces'] = self.pieces
+        return result
+
+def copy_hashed(image, fd_out, extents, hasher):
+    # Writes the extents of image to fd_out, feeding the hasher with the
+    # same buffers. Returns the number of bytes written.
+    written = 0
+    for offset, size in extents:
+        for pos in range(0, size, HASH_BLOCK):
+            data = image.view(offset + pos, min(HASH_BLOCK, size - pos))
+            if not len(data):
+                break
+            done = 0
+            while done < len(data):
+                done += os.write(fd_out, data[done:])
+            hasher.update(data)
+            written += len(data)
+    return written
+
+def export_file_hashed(image, full_name, extents, algorithms, piece_size=0):
+    # As dhfs41.export_file, returning (bytes, digests)
+    hasher = Hasher(algorithms, piece_size)
+    try:
+        with open(full_name, "wb") as fd_out:
+            written = copy_hashed(image, fd_out.fileno(), extents, hasher)
+    finally:
+        digests = hasher.finish()
+    return written, digests
+
+def hash_file(full_name, algorithms, piece_size=0):
+    # Digests of a file already written, as Hasher.finish gives them; for
+    # exports written out of order, which can't be hashed on the way
+    hasher = Hasher(algorithms, piece_size)
+    try:
+        with open(full_name, "rb") as fd_in:
+            while True:
+                data = fd_in.read(HASH_BLOCK)
+                if not data:
+                    break
+                hasher.update(data)
+    finally:
+        digests = hasher.finish()
+    return digests
+
+class SweepHashers:
+    # Hashes files written out of order, as a sweep in disk order saves
+    # them. Each file is digested in file order as its pieces come: a
+    # piece ahead of the part hashed is kept until the gap before it is
+    # filled. When the pieces kept would pass max_pending bytes, those of
+    # the file are dropped and, once it is complete, the rest of the file
+    # is read back from the output (read_back counts those bytes).
+    def __init__(self, max_pending=None):
+        self.max_pending = HASH_PENDING if max_pending is None else max_pending
+        self.pending     = 0
+        self.read_back   = 0
+        self.files       = {}
+
+    def get(self, key, algorithms, piece_size):
+        if key not in self.files:
+            # [hasher, bytes hashed, {file position: piece kept}, pieces dropped]
+            self.files[key] = [Hasher(algorithms, piece_size, threaded=False), 0, {}, False]
+        return self.files[key]
+
+    def add(self, key, algorithms, piece_size, file_pos, data):
+        state = self.get(key, algorithms, piece_size)
+        hasher, hashed, kept, dropped = state
+        if dropped:
+            return
+        if file_pos != hashed:
+            if self.pending + len(data) > self.max_pending:
+                self.release(state)
+                state[3] = True
+            else:
+                kept[file_pos] = bytes(data)
+                self.pending += len(data)
+            return
+        hasher.update(data)
+        hashed += len(data)
+        while hashed in kept:
+            data = kept.pop(hashed)
+            self.pending -= len(data)
+            hasher.update(data)
+            hashed += len(data)
+        state[1] = hashed
+
+    def release(self, state):
+        self.pending -= sum(len(data) for data in state[2].values())
+        state[2].clear()
+
+    def finish(self, key, algorithms, piece_size, full_name):
+        # Digests of a complete file, as Hasher.finish gives them
+        state = self.get(key, algorithms, piece_size)
+        del self.files[key]
+        hasher, hashed = state[0], state[1]
+        self.release(state)
+        with open(full_name, "rb") as fd_in:
+            fd_in.seek(hashed)
+            while True:
+                data = fd_in.read(HASH_BLOCK)
+                if not data:
+                    break
+                hasher.update(data)
+                self.read_back += len(data)
+        return hasher.finish()
+
+    def discard(self, key):
+        if key in self.files:
+            self.release(self.files.pop(key))
+
+class Manifest:
+    # manifest.jsonl of an export directory: a JSON line per file saved,
+    # appended as files are completed
+    def __init__(self, path):
+        self.path = os.path.join(path, MANIFEST_NAME)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.path, "a") as fd_out:
+                fd_out.write(line)
+
+def read_manifest(path):
+    # Records of the manifest of an export directory, [] if there is none
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as fd_in:
+            return [json.loads(line) for line in fd_in if line.strip()]
+    except OSError:
+        return []
+
+def verify_file(full_name, record, pieces=None):
+    # Recomputes the digests of an exported file against its manifest
+    # record. With pieces (positions in record['pieces']) only those
+    # pieces are read and checked. Returns the names of what differs.
+    mismatches = []
+    with open(full_name, "rb") as fd_in:
+        if pieces is not None:
+            piece_size = record['piece_size']
+            for pos in pieces:
+                fd_in.seek(pos * piece_size)
+                if hashlib.sha256(fd_in.read(piece_size)).hexdigest() != record['pieces'][pos]:
+                    mismatches.append(f"piece {pos}")
+            return mismatches
+
+        algorithms = [name for name in hashlib.algorithms_available if name in record]
+        digests = {name: hashlib.new(name) for name in algorithms}
+        while True:
+            data = fd_in.read(HASH_BLOCK)
+            if not data:
+                break
+            for digest in digests.values():
+                digest.update(data)
+    return [name for name, digest in digests.items() if digest.hexdigest() != record[name]]
@@ -0,0 +1,260 @@
+import bisect
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from dhfs_schedule import plan_reads
+
+# Split raw images: image.001 (or .000), image.002, ... opened as one
+SEGMENT_SUFFIX = re.compile(r"\.(\d{3,})$")
+
+# Small reads (partition table, superblocks, log header, ...) go through
+# an LRU cache of CACHE_BLOCKS blocks of CACHE_BLOCK bytes
+CACHE_BLOCK    = 64 * 1024
+CACHE_BLOCKS   = 256
+CACHE_MAX_READ = 4096
+
+# Header probes (read_headers) up to HEADER_GAP bytes apart share a read
+# of at most HEADER_READ bytes. The kernel reads whole pages anyway, so a
+# gap of a page costs no extra I/O, and probes never read much more than
+# the headers themselves.
+HEADER_READ = 1024 * 1024
+HEADER_GAP  = 4096
+
+def find_segments(path):
+    # path plus the segments following it, if it is the first segment of
+    # a split raw image; [path] for anything else
+    match = SEGMENT_SUFFIX.search(path)
+    if not match or int(match.group(1)) > 1:
+        return [path]
+    base, width, number = path[:match.start()], len(match.group(1)), int(match.group(1))
+    segments = [path]
+    while True:
+        number += 1
+        segment = f"{base}.{number:0{width}d}"
+        if not os.path.isfile(segment):
+            break
+        segments.append(segment)
+    return segments
+
+class ImageReader:
+    # Read access to an evidence image or disk, which may be a split raw
+    # image read in place as a single device. Besides the sequential
+    # seek/read used while parsing metadata, it offers positional reads and
+    # copies to output files that avoid Python-level buffers when possible:
+    # os.copy_file_range or os.sendfile, or else memoryview slices of an
+    # optional read-only mapping of the image. With a profiler, every
+    # read is counted (bytes, calls and seeks).
+    def __init__(self, path, use_mmap=False):
+        self.path     = path
+        self.segments = find_segments(path)
+        self.files    = [open(segment, "rb") for segment in self.segments]
+        self.fds      = [file.fileno() for file in self.files]
+        self.file     = self.files[0]
+        self.fd       = self.fds[0]
+        self.lock     = threading.Lock()
+        self.position = 0
+        self.profiler = None
+
+        # starts[i] is where segment i begins; starts[-1] is the image size.
+        # Seeking to the end works for block devices too, where fstat
+        # reports no size.
+        self.starts = [0]
+        for file in self.files:
+            self.starts.append(self.starts[-1] + file.seek(0, os.SEEK_END))
+            file.seek(0)
+
+        self.maps = None
+        self.use_mmap = use_mmap
+        if use_mmap:
+            try:
+                self.maps = [mmap.mmap(fd, 0, access=mmap.ACCESS_READ) for fd in self.fds]
+            except (ValueError, OSError):
+                # Block devices and huge images on 32-bit systems can't be mapped
+                self.maps = None
+
+        self.cache      = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+        self.copy_methods = []
+        if hasattr(os, "copy_file_range"):
+            self.copy_methods.append(self.copy_file_range)
+        if hasattr(os, "sendfile"):
+            self.copy_methods.append(self.sendfile)
+
+    def is_mapped(self):
+        return self.maps is not None
+
+    def is_split(self):
+        return len(self.segments) > 1
+
+    def get_size(self):
+        return self.starts[-1]
+
+    def get_mtime(self):
+        return max(os.fstat(fd).st_mtime_ns for fd in self.fds)
+
+    def locate(self, offset):
+        # (segment, offset in it, bytes left in it) of an image offset
+        seg_idx = min(bisect.bisect_right(self.starts, offset) - 1, len(self.fds) - 1)
+        return seg_idx, offset - self.starts[seg_idx], self.starts[seg_idx + 1] - offset
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.get_size()
+        self.position = offset
+        return offset
+
+    def read(self, size=-1):
+        if size < 0:
+            size = max(self.get_size() - self.position, 0)
+        data = self.read_at(self.position, size)
+        self.position += len(data)
+        return data
+
+    def read_at(self, offset, size):
+        # Positional read: safe to use from several threads at once
+        if size <= CACHE_MAX_READ and self.maps is None:
+            return self.read_cached(offset, size)
+        return self.read_raw(offset, size)
+
+    def read_raw(self, offset, size):
+        if len(self.fds) == 1:
+            return self.read_segment(0, offset, size)
+        parts = []
+        while size > 0:
+            seg_idx, seg_offset, available = self.locate(offset)
+            if available <= 0:
+                break
+            take = min(size, available)
+            data = self.read_segment(seg_idx, seg_offset, take)
+            parts.append(data)
+            if len(data) < take:
+                break
+            offset += take
+            size   -= take
+        return b"".join(parts)
+
+    def read_segment(self, seg_idx, offset, size):
+        if self.profiler:
+            self.profiler.count_read(self.starts[seg_idx] + offset, size)
+        if self.maps is not None:
+            return self.maps[seg_idx][offset:offset+size]
+        fd = self.fds[seg_idx]
+        if hasattr(os, "pread"):
+            data = os.pread(fd, size, offset)
+            while 0 < len(data) < size:
+                more = os.pread(fd, size - len(data), offset + len(data))
+                if not more:
+                    break
+                data += more
+            return data
+        with self.lock:
+            self.files[seg_idx].seek(offset)
+            return self.files[seg_idx].read(size)
+
+    def read_cached(self, offset, size):
+        if size <= 0:
+            return b""
+        first = offset // CACHE_BLOCK
+        last  = (offset + size - 1) // CACHE_BLOCK
+        data  = b"".join(self.get_block(block) for block in range(first, last + 1))
+        start = offset - first * CACHE_BLOCK
+        return data[start:start+size]
+
+    def get_block(self, block):
+        with self.cache_lock:
+            data = self.cache.get(block)
+            if data is not None:
+                self.cache.move_to_end(block)
+        if data is not None:
+            if self.profiler:
+                self.profiler.count("cache_hits")
+            return data
+        if self.profiler:
+            self.profiler.count("cache_misses")
+        data = self.read_raw(block * CACHE_BLOCK, CACHE_BLOCK)
+        with self.cache_lock:
+            self.cache[block] = data
+            if len(self.cache) > CACHE_BLOCKS:
+                self.cache.popitem(last=False)
+        return data
+
+    def read_headers(self, offsets, size):
+        # Small reads at many places, batched by plan_reads: issued in
+        # ascending order so a spinning disk sweeps once, with neighbouring
+        # headers taken from one read. Results follow the order of offsets.
+        # They would only evict metadata from the cache, so they skip it.
+        headers = [b""] * len(offsets)
+        for start, end, targets in plan_reads([[(offset, size)] for offset in offsets], HEADER_READ, HEADER_GAP):
+            data = self.read_raw(start, end - start)
+            for pos, _, read_pos, _ in targets:
+                headers[pos] = data[read_pos:read_pos+size]
+        return headers
+
+    def view(self, offset, size):
+        # A memoryview over the mapping (no copy) or, if not mapped or
+        # crossing segments, the bytes
+        if self.maps is not None:
+            seg_idx, seg_offset, available = self.locate(offset)
+            if size <= available or len(self.maps) == 1:
+                if self.profiler:
+                    self.profiler.count_read(offset, size)
+                return memoryview(self.maps[seg_idx])[seg_offset:seg_offset+size]
+        return self.read_raw(offset, size)
+
+    def copy_file_range(self, fd_in, fd_out, offset, size):
+        return os.copy_file_range(fd_in, fd_out, size, offset)
+
+    def sendfile(self, fd_in, fd_out, offset, size):
+        return os.sendfile(fd_out, fd_in, offset, size)
+
+    def copy_to(self, fd_out, offset, size):
+        # Appends size bytes from offset to the file descriptor fd_out.
+        # Returns the number of bytes copied, less than size at end of image.
+        copied = 0
+        while copied < size:
+            seg_idx, seg_offset, available = self.locate(offset + copied)
+            if available <= 0:
+                break
+            take = min(size - copied, available)
+            done = None
+            for method in list(self.copy_methods):
+                try:
+                    done = method(self.fds[seg_idx], fd_out, seg_offset, take)
+                    if self.profiler:
+                        self.profiler.count_read(offset + copied, done)
+                    break
+                except OSError:
+                    # Not supported for this pair of files: try the next method
+                    if method in self.copy_methods:
+                        self.copy_methods.remove(method)
+            if done is None:
+                done = self.write_from_buffer(fd_out, offset + copied, take)
+            if done == 0:
+                break
+            copied += done
+        return copied
+
+    def write_from_buffer(self, fd_out, offset, size):
+        data = self.view(offset, min(size, 64 * 1024 * 1024))
+        written = 0
+        while written < len(data):
+            written += os.write(fd_out, data[written:])
+        return written
+
+    def close(self):
+        if self.maps is not None:
+            for segment_map in self.maps:
+                try:
+                    segment_map.close()
+                except BufferError:
+                    # Fragments are still being referenced; freed when released
+                    pass
+            self.maps = None
+        for file in self.files:
+            file.close()
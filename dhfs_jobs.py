@@ -0,0 +1,133 @@
+import queue
+import threading
+import time
+
+class Job:
+    # An operation queued on a JobQueue: func(log_func) runs on the worker
+    # thread and its return value ends up in result (or the exception in
+    # error). on_done(job) is called, through call_after, when it ends.
+    def __init__(self, name, func, on_done=None):
+        self.name      = name
+        self.func      = func
+        self.on_done   = on_done
+        self.result    = None
+        self.error     = None
+        self.cancelled = False
+        self.started   = None
+        self.finished  = None
+
+class JobQueue:
+    # Runs DHFS41 operations one after another on a worker thread, so a
+    # GUI stays responsive. The operations spread their own work over
+    # pools; running them in sequence keeps them from sharing the image
+    # and the cancel flag of DHFS41. Status and progress are reported at
+    # most every interval seconds through call_after (wx.CallAfter for
+    # the GUI), as on_status(text, progress) where progress is None or a
+    # dict with done, total, unit, fraction, throughput (units/s) and eta (s).
+    def __init__(self, dhfs, on_status, call_after=None, interval=0.25):
+        self.dhfs       = dhfs
+        self.on_status  = on_status
+        self.call_after = call_after or (lambda func, *args: func(*args))
+        self.interval   = interval
+        self.jobs       = queue.Queue()
+        self.pending    = []
+        self.current    = None
+        self.lock       = threading.Lock()
+        self.last_status = 0.0
+        self.progress   = None
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, name, func, on_done=None):
+        job = Job(name, func, on_done)
+        with self.lock:
+            self.pending.append(job)
+        self.jobs.put(job)
+        self.post_status(f"{name}: queued", force=True)
+        return job
+
+    def is_busy(self):
+        with self.lock:
+            return self.current is not None or bool(self.pending)
+
+    def get_pending(self):
+        with self.lock:
+            return list(self.pending)
+
+    def cancel(self, job=None):
+        # Cancels job (the running one by default); queued jobs are
+        # dropped before they start, the running one stops at its next check
+        with self.lock:
+            job = job or self.current
+            if job is None:
+                return False
+            job.cancelled = True
+            if job is self.current:
+                self.dhfs.cancel()
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            for job in self.pending:
+                job.cancelled = True
+        self.cancel()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.pending.remove(job)
+                if job.cancelled:
+                    continue
+                self.current = job
+                self.dhfs.cancel_event.clear()
+            self.progress = None
+            self.dhfs.progress_func = self.report_progress
+            job.started = time.perf_counter()
+            self.post_status(f"{job.name}...", force=True)
+            try:
+                job.result = job.func(self.log)
+            except Exception as e:
+                job.error = e
+            job.finished = time.perf_counter()
+            self.dhfs.progress_func = None
+            with self.lock:
+                self.current = None
+                # A cancel that arrived as the job ended is not left behind
+                job.cancelled = job.cancelled or self.dhfs.is_cancelled()
+                self.dhfs.cancel_event.clear()
+
+            if job.error is not None:
+                self.post_status(f"{job.name}: failed ({job.error})", force=True)
+            elif job.cancelled:
+                self.post_status(f"{job.name}: cancelled", force=True)
+            else:
+                self.post_status(f"{job.name}: done in {job.finished - job.started:.1f} s", force=True)
+            if job.on_done:
+                self.call_after(job.on_done, job)
+
+    def log(self, message):
+        self.post_status(message)
+
+    def report_progress(self, done, total, unit="bytes"):
+        job = self.current
+        if job is None:
+            return
+        elapsed    = max(time.perf_counter() - job.started, 1e-9)
+        throughput = done / elapsed
+        eta = (total - done) / throughput if throughput and total else None
+        self.progress = {'done'       : done,
+                         'total'      : total,
+                         'unit'       : unit,
+                         'fraction'   : done / total if total else None,
+                         'throughput' : throughput,
+                         'eta'        : eta}
+        self.post_status(None)
+
+    def post_status(self, text, force=False):
+        # Throttled: extraction logs a message per fragment or video
+        now = time.perf_counter()
+        if not force and now - self.last_status < self.interval:
+            return
+        self.last_status = now
+        self.call_after(self.on_status, text, self.progress)
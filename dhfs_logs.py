@@ -0,0 +1,86 @@
+import numpy as np
+
+# The log area starts with two header blocks, whose first 4 bytes are the
+# size of the area (header included), followed by fixed-size records.
+# The record layout isn't documented, so it is configurable: LOG_RECORD_SIZE
+# bytes per record and LOG_FIELDS as "name:offset:format,...", formats
+# being numpy integer codes (u1, u2, u4, i4, ...) or Ns for N bytes of
+# text. A "time" field is required; it holds a packed timestamp, like the
+# descriptors, or seconds since 1970 with LOG_TIME = unix. Records whose
+# time isn't valid are empty slots and are skipped.
+LOG_RECORD_SIZE = 64
+LOG_FIELDS = "time:0:u4,type:4:u2,channel:6:u1,text:8:56s"
+LOG_CHUNK  = 1024 * 1024
+
+def parse_log_fields(text):
+    # LOG_FIELDS to [(name, offset, numpy format)]; raises ValueError
+    fields = []
+    for item in text.split(","):
+        name, offset, fmt = [part.strip() for part in item.split(":")]
+        fmt = "S" + fmt[:-1] if fmt.endswith("s") else "<" + fmt
+        np.dtype(fmt)
+        fields.append((name, int(offset, 0), fmt))
+    if "time" not in [name for name, _, _ in fields]:
+        raise ValueError("LOG_FIELDS needs a time field")
+    return fields
+
+def get_log_dtype(fields, record_size):
+    return np.dtype({'names'   : [name for name, _, _ in fields],
+                     'formats' : [fmt for _, _, fmt in fields],
+                     'offsets' : [offset for _, offset, _ in fields],
+                     'itemsize': record_size})
+
+def records_to_columns(records, names):
+    # Fields of decoded records as lists, text fields as str
+    columns = []
+    for name in names:
+        column = records[name]
+        if column.dtype.kind == "S":
+            columns.append([value.rstrip(b"\0").decode("utf-8", errors="replace") for value in column.tolist()])
+        else:
+            columns.append(column.tolist())
+    return columns
+
+class LogIndex:
+    # Time, type and channel of every valid record of the log area, sorted
+    # by time, in a few bytes per record whatever the record size. Queries
+    # give record numbers, decoded from the image only when needed.
+    def __init__(self, numbers, epochs, types=None, channels=None):
+        order = np.argsort(epochs, kind='stable')
+        self.numbers  = numbers[order]
+        self.epochs   = epochs[order]
+        self.types    = types[order] if types is not None else None
+        self.channels = channels[order] if channels is not None else None
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def get_span(self):
+        if not len(self.epochs):
+            return None
+        return int(self.epochs[0]), int(self.epochs[-1])
+
+    def count_by(self, column):
+        if column is None:
+            return {}
+        values, counts = np.unique(column, return_counts=True)
+        return {int(value): int(count) for value, count in zip(values, counts)}
+
+    def get_type_counts(self):
+        return self.count_by(self.types)
+
+    def get_channel_counts(self):
+        return self.count_by(self.channels)
+
+    def find(self, start=None, end=None, types=None, channels=None):
+        # Numbers of the records in [start, end] (epoch seconds) of the
+        # given types and channels, in time order
+        lo = np.searchsorted(self.epochs, start, 'left') if start is not None else 0
+        hi = np.searchsorted(self.epochs, end, 'right') if end is not None else len(self.epochs)
+        mask = np.ones(max(hi - lo, 0), dtype=bool)
+        # Filtering on a field the layout lacks matches nothing
+        if types is not None:
+            mask &= np.isin(self.types[lo:hi], types) if self.types is not None else False
+        if channels is not None:
+            mask &= np.isin(self.channels[lo:hi], channels) if self.channels is not None else False
+        return self.numbers[lo:hi][mask]
@@ -0,0 +1,82 @@
+import threading
+import time
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class Profiler:
+    # Phase timers and counters of a DHFS41. When disabled, phase() hands
+    # back a shared do-nothing context and the image reader isn't given
+    # the profiler at all, so the hot paths cost one check. Phases that
+    # run on several threads at once (partitions load concurrently) add
+    # up their times.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock    = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases   = {}
+            self.counters = {'bytes_read': 0, 'read_calls': 0, 'seeks': 0}
+            self.next_offset = None
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            phase = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            phase['seconds'] += seconds
+            phase['calls']   += 1
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_read(self, offset, size):
+        # A read that doesn't start where the previous one ended is a seek
+        with self.lock:
+            self.counters['read_calls'] += 1
+            self.counters['bytes_read'] += size
+            if offset != self.next_offset:
+                self.counters['seeks'] += 1
+            self.next_offset = offset + size
+
+    def get_report(self):
+        with self.lock:
+            return {'phases'  : {name: {'seconds': round(phase['seconds'], 6), 'calls': phase['calls']}
+                                 for name, phase in self.phases.items()},
+                    'counters': dict(self.counters)}
+
+    def get_text(self):
+        report  = self.get_report()
+        message = "*"*20+" Profile "+"*"*20+"\n"
+        for name, phase in report['phases'].items():
+            message += f"\t{name}: {phase['seconds']*1000:.1f} ms ({phase['calls']} calls)\n"
+        for name, value in report['counters'].items():
+            message += f"\t{name}: {value}\n"
+        return message
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+
+# Batch exports in disk order, for spinning drives: the extents of all the
+# files are sorted by image offset and adjacent (or overlapping) ones are
+# joined into reads of up to SWEEP_READ bytes, so the disk is swept once
+# instead of seeking between interleaved videos. Each read is scattered
+# to the files at the positions its pieces have in them. At most
+# OPEN_FILES outputs are kept open; others are reopened when needed.
+SWEEP_READ = 8 * 1024 * 1024
+OPEN_FILES = 128
+
+def write_at(fd, data, offset):
+    written = 0
+    if hasattr(os, "pwrite"):
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+        return
+    os.lseek(fd, offset, os.SEEK_SET)
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+def plan_reads(file_extents, max_read=SWEEP_READ, max_gap=0):
+    # file_extents[i] is the list of (offset, size) of file i. Returns the
+    # reads in ascending offset, as [start, end, targets], each target a
+    # (file_idx, file_pos, read_pos, size) piece of the read. Pieces up to
+    # max_gap bytes apart share a read, the gap being read and dropped.
+    pieces = []
+    for file_idx, extents in enumerate(file_extents):
+        file_pos = 0
+        for offset, size in extents:
+            for pos in range(0, size, max_read):
+                pieces.append((offset + pos, min(max_read, size - pos), file_idx, file_pos + pos))
+            file_pos += size
+    pieces.sort()
+
+    reads = []
+    for offset, size, file_idx, file_pos in pieces:
+        if reads:
+            start, end, targets = reads[-1]
+            if offset <= end + max_gap and max(end, offset + size) - start <= max_read:
+                reads[-1][1] = max(end, offset + size)
+                targets.append((file_idx, file_pos, offset - start, size))
+                continue
+        reads.append([offset, offset + size, [(file_idx, file_pos, 0, size)]])
+    return reads
+
+class OutputFiles:
+    # Output descriptors by file index, least recently used closed first.
+    # A file is truncated when first opened only.
+    def __init__(self, names, max_open=OPEN_FILES):
+        self.names    = names
+        self.max_open = max_open
+        self.fds      = OrderedDict()
+        self.created  = set()
+
+    def get(self, file_idx):
+        fd = self.fds.pop(file_idx, None)
+        if fd is None:
+            flags = os.O_WRONLY | getattr(os, "O_BINARY", 0)
+            if file_idx not in self.created:
+                flags |= os.O_CREAT | os.O_TRUNC
+                self.created.add(file_idx)
+            fd = os.open(self.names[file_idx], flags, 0o666)
+            if len(self.fds) >= self.max_open:
+                os.close(self.fds.popitem(last=False)[1])
+        self.fds[file_idx] = fd
+        return fd
+
+    def close(self, file_idx=None):
+        if file_idx is not None:
+            fd = self.fds.pop(file_idx, None)
+            if fd is not None:
+                os.close(fd)
+            return
+        while self.fds:
+            os.close(self.fds.popitem()[1])
+
+def export_in_disk_order(image, files, is_cancelled=None, on_file=None, on_progress=None,
+                         max_read=SWEEP_READ, on_piece=None):
+    # Saves files, a list of (full_name, extents), reading image in one
+    # sweep. on_piece(file_idx, file_pos, data) is called as each piece is
+    # written, on_file(file_idx, written) as each file is complete and
+    # on_progress(done, total) after each read. Returns the bytes written
+    # to each file, None for those left incomplete by a cancel.
+    reads   = plan_reads([extents for _, extents in files], max_read)
+    outputs = OutputFiles([full_name for full_name, _ in files])
+    pending = [0] * len(files)
+    written = [0] * len(files)
+    for _, _, targets in reads:
+        for target in targets:
+            pending[target[0]] += 1
+    total = sum(end - start for start, end, _ in reads)
+
+    try:
+        for file_idx, count in enumerate(pending):
+            if count == 0:
+                outputs.get(file_idx)
+                outputs.close(file_idx)
+                if on_file:
+                    on_file(file_idx, 0)
+
+        done = 0
+        for start, end, targets in reads:
+            if is_cancelled and is_cancelled():
+                break
+            data = image.view(start, end - start)
+            for file_idx, file_pos, read_pos, size in targets:
+                piece = data[read_pos:read_pos+size]
+                fd = outputs.get(file_idx)
+                if len(piece):
+                    write_at(fd, piece, file_pos)
+                    if on_piece:
+                        on_piece(file_idx, file_pos, piece)
+                written[file_idx] += len(piece)
+                pending[file_idx] -= 1
+                if pending[file_idx] == 0:
+                    outputs.close(file_idx)
+                    if on_file:
+                        on_file(file_idx, written[file_idx])
+            done += end - start
+            if on_progress:
+                on_progress(done, total)
+    finally:
+        outputs.close()
+    return [written[file_idx] if pending[file_idx] == 0 else None for file_idx in range(len(files))]
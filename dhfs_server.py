@@ -0,0 +1,223 @@
+# encoding: utf-8
+#
+# HTTP server that shows the recordings of an image without extracting
+# them: the catalog as JSON and every video, slack and recovered run (free
+# fragment runs starting with CARVE_SIGNAT and dirty chains) as a virtual
+# file, read from the image as it is sent. Range requests are mapped onto
+# the fragments of the file, so players can seek. Each response streams
+# SERVE_BLOCK bytes at a time and at most MAX_STREAMS are sent at once, so
+# memory stays bounded whatever the number of clients.
+#
+#   python dhfs_cli.py IMAGE serve --port 8041
+#
+#   /catalog.json[?camera=2&since=2023-01-02&until=2023-01-03]
+#   /recovered.json?partition=0
+#   /video/P/DESC  /slack/P/DESC  /free/P/FRAG  /dirty/P/DESC
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from dhfs41 import text_to_epoch, epoch_to_text
+from dhfs_frames import stream_to_extents
+
+SERVE_BLOCK   = 256 * 1024
+MAX_STREAMS   = 32
+CATALOG_BATCH = 1000
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+class DHFSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, dhfs, address, log_func=None):
+        super().__init__(address, DHFSRequestHandler)
+        self.dhfs     = dhfs
+        self.log_func = log_func
+        self.streams  = threading.BoundedSemaphore(MAX_STREAMS)
+        # Recovered runs of each partition, found on first request
+        self.recovered = {}
+        self.recovered_lock = threading.Lock()
+
+    def get_recovered(self, part_idx):
+        # {(kind, desc): (name, extents)} of the free runs and dirty chains
+        with self.recovered_lock:
+            if part_idx not in self.recovered:
+                dhfs = self.dhfs
+                exports = dhfs.get_free_exports(part_idx, "") + dhfs.get_dirty_exports(part_idx, "")
+                self.recovered[part_idx] = {(record['kind'], record['desc']): (full_name[1:], extents)
+                                            for full_name, extents, record in exports}
+            return self.recovered[part_idx]
+
+    def get_file(self, kind, part_idx, desc_idx):
+        # (name, extents) of a virtual file, None if there is no such file
+        dhfs = self.dhfs
+        if not 0 <= part_idx < dhfs.get_num_partitions():
+            return None
+        if kind in ("free", "dirty"):
+            return self.get_recovered(part_idx).get((kind, desc_idx))
+        if desc_idx not in dhfs.frags_in_videos[part_idx]:
+            return None
+        if kind == "video":
+            return dhfs.get_video_file_name(part_idx, desc_idx), dhfs.get_video_extents(part_idx, desc_idx)
+        if kind == "slack":
+            # Without the number of the slack in a batch, meaningless here
+            export = dhfs.get_slack_export(0, part_idx, desc_idx, "")
+            return (export[0][len("/0000-"):], export[1]) if export else None
+        return None
+
+class DHFSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.log_func:
+            self.server.log_func(f"{self.address_string()} {format % args}")
+
+    def do_HEAD(self):
+        self.handle_request(False)
+
+    def do_GET(self):
+        self.handle_request(True)
+
+    def handle_request(self, send_body):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        try:
+            if url.path in ("/", "/catalog.json"):
+                return self.send_catalog(query, send_body)
+            if url.path == "/recovered.json":
+                return self.send_recovered(int(query['partition'][0]), send_body)
+            if len(parts) == 3:
+                virtual_file = self.server.get_file(parts[0], int(parts[1]), int(parts[2]))
+                if virtual_file:
+                    return self.send_file(*virtual_file, send_body)
+        except (KeyError, ValueError):
+            return self.send_error(400)
+        self.send_error(404)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def send_json_lines(self, records, send_body):
+        # A JSON array sent in chunks, so large catalogs aren't built in memory
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if not send_body:
+            return
+        try:
+            separator = b"[\n"
+            batch = []
+            for record in records:
+                batch.append(separator + json.dumps(record).encode())
+                separator = b",\n"
+                if len(batch) == CATALOG_BATCH:
+                    self.send_chunk(b"".join(batch))
+                    batch = []
+            batch.append(b"\n]\n" if separator == b",\n" else b"[]\n")
+            self.send_chunk(b"".join(batch))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send_catalog(self, query, send_body):
+        dhfs = self.server.dhfs
+        catalog = dhfs.get_video_catalog()
+        if 'since' in query or 'until' in query:
+            start = text_to_epoch(query['since'][0]) if 'since' in query else 0
+            end   = text_to_epoch(query['until'][0]) if 'until' in query else 2**62
+            if 'until' in query and len(query['until'][0].strip()) == 10:
+                end += 86399
+            rows = catalog.select_time(start, end)
+        else:
+            rows = np.arange(len(catalog), dtype=np.int64)
+        if 'camera' in query:
+            rows = rows[np.isin(catalog.camera[rows], [int(camera) for camera in query['camera']])]
+
+        def records():
+            for row in rows.tolist():
+                part_idx, desc_idx = catalog.get_video(row)
+                record = {'partition': part_idx, 'desc': desc_idx,
+                          'begin'    : epoch_to_text(int(catalog.begin_epoch[row])),
+                          'end'      : epoch_to_text(int(catalog.end_epoch[row])),
+                          'camera'   : int(catalog.camera[row]),
+                          'size'     : int(catalog.size[row]),
+                          'video'    : f"/video/{part_idx}/{desc_idx}"}
+                if dhfs.get_slack_size(part_idx, desc_idx) > 0:
+                    record['slack'] = f"/slack/{part_idx}/{desc_idx}"
+                yield record
+        self.send_json_lines(records(), send_body)
+
+    def send_recovered(self, part_idx, send_body):
+        if not 0 <= part_idx < self.server.dhfs.get_num_partitions():
+            return self.send_error(404)
+        recovered = self.server.get_recovered(part_idx)
+        self.send_json_lines(({'partition': part_idx, 'kind': kind, 'desc': desc_idx, 'name': name,
+                               'size': sum(size for _, size in extents),
+                               'url': f"/{kind}/{part_idx}/{desc_idx}"}
+                              for (kind, desc_idx), (name, extents) in recovered.items()), send_body)
+
+    def get_range(self, size):
+        # (start, end) requested, end excluded; None for the whole file, or
+        # False if it can't be satisfied. Only single ranges are honored:
+        # the whole file is sent for others, as HTTP allows.
+        match = RANGE_RE.match(self.headers.get("Range", "").strip())
+        if not match or match.group(1) == match.group(2) == "":
+            return None
+        first, last = match.groups()
+        if first == "":
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        if start >= size or start >= end:
+            return False
+        return start, end
+
+    def send_file(self, name, extents, send_body):
+        size = sum(length for _, length in extents)
+        requested = self.get_range(size)
+        if requested is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = requested or (0, size)
+        self.send_response(206 if requested else 200)
+        if requested:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Disposition", f'inline; filename="{name}"')
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if not send_body:
+            return
+
+        disk = self.server.dhfs.disk
+        with self.server.streams:
+            try:
+                for offset, length in stream_to_extents(extents, start, end - start):
+                    for pos in range(0, length, SERVE_BLOCK):
+                        self.wfile.write(disk.view(offset + pos, min(SERVE_BLOCK, length - pos)))
+            except (BrokenPipeError, ConnectionResetError):
+                # Players drop connections when seeking
+                self.close_connection = True
+
+def serve(dhfs, host="127.0.0.1", port=8041, log_func=None, on_ready=None):
+    # Serves the loaded image until interrupted; on_ready(url) once listening
+    server = DHFSServer(dhfs, (host, port), log_func)
+    if on_ready:
+        on_ready(f"http://{server.server_address[0]}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,252 @@
+# encoding: utf-8
+#
+# Writes synthetic DHFS4.1 images, to measure and check the extractor
+# without real evidence disks. Images are sparse: only the structures
+# (partition table, superblocks, descriptors, logs) and the first bytes
+# of each fragment are written, unless frames=True, which fills every
+# video with DHAV frames.
+#
+#   python dhfs_synth.py test.dd --partitions 2 --frags 100000 --dirty 0.05
+
+import argparse
+import json
+import random
+import struct
+import sys
+
+PART_TABLE_OFF = 0x3C00 + 0x34
+SUPERBLOCK_OFF = 0x8000
+DESC_SIZE = 32
+CARVE_MAGIC = b"DHII"
+LOG_RECORD_SIZE = 64
+
+def pack_timestamp(year, month, day, hour, minute, second):
+    return ((year - 2000) << 26) | (month << 22) | (day << 17) | (hour << 12) | (minute << 6) | second
+
+def timestamp_at(seconds):
+    # Packed timestamp of a number of seconds since 2023-01-01 00:00:00
+    days, seconds = divmod(seconds, 86400)
+    year, month, day = 2023, 1, 1 + days
+    month_days = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    while day > month_days[month - 1]:
+        day -= month_days[month - 1]
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+            month_days[1] = 29 if year % 4 == 0 else 28
+    return pack_timestamp(year, month, day, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def make_descriptor(desc_type, camera, frag, begin_ts, end_ts, next_desc, last_size, prev_desc, begin_desc):
+    return struct.pack("<BBHIIIIII4x", desc_type, 48 + camera - 1, frag, begin_ts, end_ts,
+                       next_desc, last_size, prev_desc, begin_desc)
+
+def make_frames(rnd, size, begin, seconds, gop):
+    # A DHAV stream of one frame per second filling size bytes; the rest
+    # (less than a frame) is left as zeros
+    frame_size = max(size // max(seconds, 1), 64)
+    stream = bytearray()
+    for second in range(seconds):
+        if len(stream) + frame_size > size:
+            break
+        frame_type = 0xFD if second % gop == 0 else 0xFC
+        payload = rnd.randbytes(frame_size - 32)
+        stream += (b"DHAV" + bytes([frame_type]) + bytes(7) +
+                   struct.pack("<II", frame_size, timestamp_at(begin + second)) + bytes(4) +
+                   payload + b"dhav" + struct.pack("<I", frame_size))
+    return bytes(stream) + bytes(size - len(stream))
+
+def make_logs(rnd, count, cameras):
+    # Log records in the default layout of dhfs_logs (64 bytes: time,
+    # type, channel, text); one slot in ten is left empty
+    records = []
+    for number in range(count):
+        if rnd.random() < 0.1:
+            records.append(bytes(LOG_RECORD_SIZE))
+            continue
+        event_type = rnd.choice((1, 2, 3, 16, 17))
+        text = f"event {number} type {event_type}".encode()
+        records.append(struct.pack("<IHBx56s", timestamp_at(rnd.randrange(0, 86400 * 30)), event_type,
+                                   rnd.randint(0, cameras), text))
+    return b"".join(records)
+
+def allocate(rnd, num_frags, fragmentation):
+    # Order in which fragments are given to videos: disk order, with a
+    # fraction of the positions swapped with random ones
+    order = list(range(1, num_frags))
+    for pos in range(len(order)):
+        if rnd.random() < fragmentation:
+            other = rnd.randrange(len(order))
+            order[pos], order[other] = order[other], order[pos]
+    return order
+
+def write_partition(image, rnd, part_idx, part_off, args):
+    frag_size = args.block_size * args.frag_blocks
+    num_frags = args.frags
+    desc_off  = SUPERBLOCK_OFF + 0x1000
+    vid_off   = desc_off + (num_frags * DESC_SIZE + frag_size - 1) // frag_size * frag_size
+    descs     = [bytes(DESC_SIZE)] * num_frags
+    truth = {'videos': 0, 'video_frags': 0, 'free': 0, 'dirty': 0, 'corrupted': 0}
+
+    def write_frag(frag_idx, data):
+        image.seek(part_off + vid_off + frag_idx * frag_size)
+        image.write(data)
+
+    order = allocate(rnd, num_frags, args.fragmentation)
+    num_free  = int(len(order) * args.free)
+    num_dirty = int(len(order) * args.dirty)
+    free, dirty, used = order[:num_free], order[num_free:num_free+num_dirty], order[num_free+num_dirty:]
+    free.sort()
+
+    # Videos: each camera records one after another, with short pauses
+    clocks = [rnd.randrange(0, 3600) for _ in range(args.cameras)]
+    videos = []
+    pos = 0
+    while pos < len(used):
+        count  = min(rnd.randint(args.min_video, args.max_video), len(used) - pos)
+        frags  = used[pos:pos+count]
+        pos   += count
+        camera = rnd.randint(1, args.cameras)
+        begin  = clocks[camera - 1]
+        seconds = count * args.seconds_per_frag
+        clocks[camera - 1] += seconds + rnd.randrange(1, 600)
+        last_blocks = rnd.randint(1, args.frag_blocks)
+        begin_ts, end_ts = timestamp_at(begin), timestamp_at(begin + seconds)
+        for i, frag_idx in enumerate(frags):
+            descs[frag_idx] = make_descriptor(1 if i == 0 else 2, camera, count - 1 if i == 0 else i,
+                                              begin_ts, end_ts,
+                                              frags[i+1] if i + 1 < count else 0,
+                                              last_blocks if i == 0 else 0,
+                                              frags[i-1] if i else 0, frags[0])
+        if args.frames:
+            size = (count - 1) * frag_size + last_blocks * args.block_size
+            stream = make_frames(rnd, size, begin, seconds, args.gop)
+            for i, frag_idx in enumerate(frags):
+                write_frag(frag_idx, stream[i*frag_size:(i+1)*frag_size])
+        else:
+            write_frag(frags[0], CARVE_MAGIC + struct.pack("<HI", part_idx, frags[0]))
+        videos.append(frags)
+        truth['videos'] += 1
+        truth['video_frags'] += count
+    frag_heads = [frags[0] for frags in videos]
+
+    # Corruption: broken chains (loops, pointers out of the table, chains
+    # running into another video)
+    for frags in rnd.sample(videos, int(len(videos) * args.corruption)):
+        kind = rnd.choice(("cycle", "dangling", "shared"))
+        last = frags[-1]
+        record = bytearray(descs[last])
+        if kind == "cycle":
+            record[12:16] = frags[0].to_bytes(4, 'little')
+        elif kind == "dangling":
+            record[12:16] = (num_frags + rnd.randrange(1, 1000)).to_bytes(4, 'little')
+        else:
+            record[12:16] = rnd.choice(videos)[-1].to_bytes(4, 'little')
+        descs[last] = bytes(record)
+        truth['corrupted'] += 1
+
+    # Dirty fragments: pieces of overwritten videos, in short chains whose
+    # begin desc now belongs to another video
+    dirty.sort()
+    for first in range(0, len(dirty), 3):
+        chain = dirty[first:first+3]
+        begin_desc = rnd.choice(frag_heads) if frag_heads else 0
+        begin = rnd.randrange(0, 86400 * 4)
+        for i, frag_idx in enumerate(chain):
+            descs[frag_idx] = make_descriptor(2, rnd.randint(1, args.cameras), i + 5,
+                                              timestamp_at(begin), timestamp_at(begin + 300),
+                                              chain[i+1] if i + 1 < len(chain) else 0, 0,
+                                              chain[i-1] if i else 0, begin_desc)
+        write_frag(chain[0], CARVE_MAGIC + struct.pack("<HI", part_idx, chain[0]))
+        truth['dirty'] += len(chain)
+
+    # Free fragments: a third still start with the signature of a video
+    for frag_idx in free:
+        if rnd.random() < 0.3:
+            write_frag(frag_idx, CARVE_MAGIC + struct.pack("<HI", part_idx, frag_idx))
+    truth['free'] = len(free)
+
+    image.seek(part_off + desc_off)
+    for first in range(0, num_frags, 65536):
+        image.write(b"".join(descs[first:first+65536]))
+
+    return desc_off, vid_off, vid_off + num_frags * frag_size, truth
+
+def write_image(path, args):
+    # Returns a summary of what was written, per partition
+    rnd = random.Random(args.seed)
+    frag_size = args.block_size * args.frag_blocks
+    with open(path, "wb") as image:
+        image.write(b"DHFS4.1")
+        part_off = 0x100000
+        entries = []
+        summary = {'path': path, 'partitions': []}
+        for part_idx in range(args.partitions):
+            desc_off, vid_off, part_size, truth = write_partition(image, rnd, part_idx, part_off, args)
+            entries.append((part_off, desc_off, vid_off))
+            truth['offset'] = part_off
+            summary['partitions'].append(truth)
+            part_off += (part_size + 0xFFFFF) // 0x100000 * 0x100000
+
+        logs_off = part_off
+        logs = make_logs(rnd, args.logs, args.cameras)
+        image.seek(logs_off)
+        image.write((2 * args.block_size + len(logs)).to_bytes(4, 'little') +
+                    bytes(2 * args.block_size - 4) + logs)
+
+        for part_off, desc_off, vid_off in entries:
+            base = part_off + SUPERBLOCK_OFF
+            image.seek(base + 0x10)
+            image.write(struct.pack("<II", timestamp_at(0), timestamp_at(86400 * 30)))
+            image.seek(base + 0x2c)
+            image.write(struct.pack("<II", args.block_size, args.frag_blocks))
+            image.seek(base + 0x38)
+            image.write(struct.pack("<I", 2))
+            image.seek(base + 0x44)
+            image.write(struct.pack("<III", desc_off // args.block_size, vid_off // args.block_size, args.frags))
+            image.seek(base + 0xF8)
+            image.write(struct.pack("<I", logs_off // args.block_size))
+
+        image.seek(PART_TABLE_OFF)
+        for part_off, _, _ in entries:
+            entry = bytearray(64)
+            entry[20:24] = (SUPERBLOCK_OFF // 512).to_bytes(4, 'little')
+            entry[48:56] = (part_off // 512).to_bytes(8, 'little')
+            image.write(entry)
+        image.write(b"\xAA\x55\xAA\x55" + bytes(60))
+        logs_end = logs_off + (2 * args.block_size + len(logs) + 0xFFFFF) // 0x100000 * 0x100000
+        image.truncate(logs_end)
+    summary['size'] = logs_end
+    summary['logs'] = args.logs
+    summary['frag_size'] = frag_size
+    return summary
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Synthetic DHFS4.1 image generator")
+    parser.add_argument("--partitions", type=int, default=2)
+    parser.add_argument("--frags", type=int, default=10000, help="fragments (descriptors) per partition")
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--frag-blocks", type=int, default=64, help="blocks per fragment")
+    parser.add_argument("--min-video", type=int, default=1, help="fewest fragments of a video")
+    parser.add_argument("--max-video", type=int, default=8, help="most fragments of a video")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--seconds-per-frag", type=int, default=225)
+    parser.add_argument("--fragmentation", type=float, default=0.1,
+                        help="fraction of fragments allocated out of disk order")
+    parser.add_argument("--free", type=float, default=0.2, help="fraction of free fragments")
+    parser.add_argument("--dirty", type=float, default=0.02, help="fraction of dirty fragments")
+    parser.add_argument("--corruption", type=float, default=0.0, help="fraction of videos with broken chains")
+    parser.add_argument("--frames", action="store_true", help="fill videos with DHAV frames (not sparse)")
+    parser.add_argument("--logs", type=int, default=64, help="log records")
+    parser.add_argument("--gop", type=int, default=10, help="frames between I-frames")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    parser.add_argument("image", help="image file to write")
+    args = parser.parse_args(argv)
+    print(json.dumps(write_image(args.image, args)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
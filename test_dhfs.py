@@ -0,0 +1,415 @@
+# Checks on synthetic images written by dhfs_synth: run with pytest.
+
+import filecmp
+import os
+import shutil
+import struct
+
+import numpy as np
+import pytest
+
+import dhfs41
+import dhfs_hash
+import dhfs_synth
+from dhfs41 import DESC_DTYPE, DHFS41, IntervalIndex, link_chains, read_slack_index
+from dhfs_server import DHFSRequestHandler
+
+def write_image(path, *options):
+    args = dhfs_synth.build_parser().parse_args(["--frags", "2000", *options])
+    return dhfs_synth.write_image(str(path), args)
+
+def load(path, use_mmap=None):
+    dhfs = DHFS41()
+    dhfs.config['CATALOG_CACHE'] = False
+    assert dhfs.load_image(str(path), use_mmap)
+    return dhfs
+
+@pytest.fixture(scope="module")
+def clean_image(tmp_path_factory):
+    path = tmp_path_factory.mktemp("images") / "clean.dd"
+    return path, write_image(path, "--seed", "1")
+
+@pytest.fixture(scope="module")
+def corrupted_image(tmp_path_factory):
+    path = tmp_path_factory.mktemp("images") / "corrupted.dd"
+    return path, write_image(path, "--corruption", "0.05", "--seed", "3")
+
+@pytest.fixture(scope="module")
+def small_image(tmp_path_factory):
+    path = tmp_path_factory.mktemp("images") / "small.dd"
+    return path, write_image(path, "--frags", "300", "--logs", "500", "--seed", "5")
+
+@pytest.fixture(scope="module")
+def frames_image(tmp_path_factory):
+    path = tmp_path_factory.mktemp("images") / "frames.dd"
+    return path, write_image(path, "--frags", "300", "--partitions", "1", "--frames", "--seed", "7")
+
+def reference_dirty(dhfs, part_idx):
+    # Type 2 descriptors not in the walk of their begin desc
+    table = dhfs.desc_table[part_idx]
+    return [desc_idx for desc_idx in np.flatnonzero(table['type'] == 2).tolist()
+            if desc_idx not in dhfs.walk_chain(part_idx, int(table['begin_desc'][desc_idx]))]
+
+@pytest.mark.parametrize("image", ["clean_image", "corrupted_image"])
+def test_chains_match_walks(image, request):
+    path, summary = request.getfixturevalue(image)
+    dhfs = load(path)
+    for part_idx, truth in enumerate(summary['partitions']):
+        chains = dhfs.frags_in_videos[part_idx]
+        assert len(chains) == truth['videos']
+        for head in chains:
+            assert chains[head] == dhfs.walk_chain(part_idx, head)
+        # Descriptor 0 is never given out by the generator, so it is free too
+        assert len(dhfs.free_frags[part_idx]) == truth['free'] + 1
+        assert dhfs.dirty_frags[part_idx].tolist() == reference_dirty(dhfs, part_idx)
+        assert len(dhfs.dirty_frags[part_idx]) == truth['dirty']
+
+def test_merged_chains_stored_once():
+    # Many videos running into one long chain that loops back on itself:
+    # the shared tail is stored once, yet every chain reads as its walk
+    tail, joins = 2000, 300
+    table = np.zeros(1 + tail + joins, dtype=DESC_DTYPE)
+    table['begin_ts'], table['end_ts'] = 1, 2
+    table['type'][1] = 1
+    table['next'][1:tail] = np.arange(2, tail + 1)
+    table['next'][tail] = tail // 2
+    rng = np.random.default_rng(1)
+    table['type'][tail + 1:] = 1
+    table['next'][tail + 1:] = rng.integers(1, tail + 1, joins)
+    table['begin_desc'][1:tail + 1] = rng.choice([1, tail + 1], tail)
+    dhfs = DHFS41()
+    dhfs.desc_table = [table]
+    chains = link_chains(table)
+    assert len(chains.frags) == tail + joins
+    for head in chains:
+        assert chains[head] == dhfs.walk_chain(0, head)
+    assert chains.get_chain_lengths().tolist() == [len(chains[head]) for head in chains]
+    assert sum(kind == 'cycle' for kind, _, _ in chains.anomalies) == len(chains)
+
+def test_partitions_linked_in_processes(clean_image, monkeypatch):
+    path, _ = clean_image
+    in_threads = load(path)
+    monkeypatch.setattr(dhfs41, "LINK_PROCESS_DESCS", 0)
+    dhfs = DHFS41()
+    dhfs.config['CATALOG_CACHE'] = False
+    dhfs.config['LOAD_WORKERS'] = 2
+    assert dhfs.load_image(str(path))
+    for part_idx in range(dhfs.get_num_partitions()):
+        chains = dhfs.frags_in_videos[part_idx]
+        assert chains.keys() == in_threads.frags_in_videos[part_idx].keys()
+        assert all(chains[head] == in_threads.frags_in_videos[part_idx][head] for head in chains)
+        assert chains.anomalies == in_threads.frags_in_videos[part_idx].anomalies
+
+def test_partitions_usable_as_loaded(clean_image, monkeypatch):
+    # Without waiting, each partition is usable once ready and a failed
+    # one raises its error; the catalog holds the partitions ready
+    path, summary = clean_image
+    load_partition = DHFS41.load_partition
+
+    def failing_load(self, part_idx, linking=None):
+        if part_idx == 1:
+            raise OSError("unreadable descriptors")
+        return load_partition(self, part_idx, linking)
+    monkeypatch.setattr(DHFS41, "load_partition", failing_load)
+
+    dhfs = DHFS41()
+    dhfs.config['CATALOG_CACHE'] = False
+    with pytest.raises(OSError):
+        dhfs.load_image(str(path))
+
+    loaded = []
+    assert dhfs.load_image(str(path), on_partition=lambda part_idx, error: loaded.append((part_idx, error)),
+                           wait=False)
+    dhfs.wait_partition(0)
+    with pytest.raises(OSError):
+        dhfs.wait_partition(1)
+    dhfs.wait_loaded()
+    assert sorted((part_idx, error is None) for part_idx, error in loaded) == [(0, True), (1, False)]
+    assert dhfs.get_ready_partitions() == [0]
+    catalog = dhfs.get_video_catalog()
+    assert catalog.partitions == [0]
+    assert len(catalog) == summary['partitions'][0]['videos']
+
+def test_pools_save_the_same_files(clean_image, tmp_path):
+    path, _ = clean_image
+    dhfs = load(path)
+    catalog = dhfs.get_video_catalog()
+    videos = [catalog.get_video(row) for row in range(0, len(catalog), 7)]
+    outputs = {}
+    for pool in ("thread", "process", "disk"):
+        outputs[pool] = tmp_path / pool
+        os.makedirs(outputs[pool])
+        stats = dhfs.save_videos_at(videos, str(outputs[pool]), workers=2, pool=pool)
+        assert stats['videos'] == len(videos)
+    names = sorted(os.listdir(outputs["thread"]))
+    assert len(names) == len(videos)
+    for pool in ("process", "disk"):
+        assert sorted(os.listdir(outputs[pool])) == names
+        match, mismatch, errors = filecmp.cmpfiles(outputs["thread"], outputs[pool], names, shallow=False)
+        assert not mismatch and not errors
+
+@pytest.mark.parametrize("max_pending", [dhfs_hash.HASH_PENDING, 0])
+def test_disk_order_hashes_match(corrupted_image, tmp_path, monkeypatch, max_pending):
+    # Pieces saved out of order (fragments reused by the corruption) are
+    # kept for hashing or, past the limit, read back: either way the
+    # digests are those of a sequential export
+    monkeypatch.setattr(dhfs_hash, "HASH_PENDING", max_pending)
+    path, _ = corrupted_image
+    dhfs = load(path)
+    dhfs.config['HASH'] = ["md5", "sha256"]
+    dhfs.config['HASH_PIECES'] = True
+    catalog = dhfs.get_video_catalog()
+    videos = [catalog.get_video(row) for row in range(0, len(catalog), 5)]
+    manifests = {}
+    for pool in ("thread", "disk"):
+        os.makedirs(tmp_path / pool)
+        messages = []
+        dhfs.save_videos_at(videos, str(tmp_path / pool), workers=2, pool=pool, log_func=messages.append)
+        manifests[pool] = sorted(dhfs_hash.read_manifest(str(tmp_path / pool)), key=lambda record: record['file'])
+    assert len(manifests["thread"]) == len(videos)
+    assert manifests["disk"] == manifests["thread"]
+    assert any("read back" in message for message in messages) == (max_pending == 0)
+
+def test_slack_container_index(clean_image, tmp_path, monkeypatch):
+    # Reads smaller than a fragment must not split slacks into rows
+    monkeypatch.setattr(dhfs41, "SLACK_READ", 4096)
+    path, _ = clean_image
+    dhfs = load(path)
+    catalog = dhfs.get_video_catalog()
+    videos = [catalog.get_video(row) for row in range(len(catalog))]
+    slacks = {video: dhfs.get_slack_extent(*video) for video in videos}
+    slacks = {video: extent for video, extent in slacks.items() if extent}
+    full_name = str(tmp_path / "slacks.bin")
+    stats = dhfs.save_slack_container(videos, full_name)
+    assert stats['slacks'] == stats['kept'] == len(slacks)
+    header, columns = read_slack_index(full_name + ".idx")
+    assert header['slacks'] == len(columns['desc']) == len(slacks)
+    with open(full_name, "rb") as fd_in:
+        container = fd_in.read()
+    assert stats['bytes'] == len(container) == sum(size for _, size in slacks.values())
+    for row in range(len(columns['desc'])):
+        video = int(columns['partition'][row]), int(columns['desc'][row])
+        offset, size = slacks.pop(video)
+        assert (int(columns['offset'][row]), int(columns['size'][row])) == (offset, size)
+        assert int(columns['camera'][row]) == dhfs.get_camera(*video)
+        position = int(columns['position'][row])
+        assert container[position:position+size] == bytes(dhfs.disk.view(offset, size))
+    assert not slacks
+
+def test_log_index_matches_records(small_image, monkeypatch):
+    # Chunks of a few records, so that scans and reads cross them
+    monkeypatch.setattr(dhfs41, "LOG_CHUNK", 10 * 64)
+    path, summary = small_image
+    dhfs = load(path)
+    assert dhfs.get_num_log_records() == summary['logs']
+    logs_start, logs_size = dhfs.get_logs_extent()
+    raw = dhfs.disk.read_at(logs_start, logs_size)
+    times    = np.array([struct.unpack_from("<I", raw, number * 64)[0] for number in range(summary['logs'])])
+    types    = np.array([struct.unpack_from("<H", raw, number * 64 + 4)[0] for number in range(summary['logs'])])
+    channels = np.array([raw[number * 64 + 6] for number in range(summary['logs'])])
+    epochs   = dhfs41.timestamps_to_epoch(times)
+    numbers  = np.flatnonzero(times != 0)
+    rng = np.random.default_rng(5)
+    queries = [(None, None, None, None)]
+    for _ in range(50):
+        start = int(rng.integers(epochs[numbers].min() - 1000, epochs[numbers].max()))
+        end = start + int(rng.integers(0, 86400 * 10))
+        queries.append((start, end,
+                        rng.choice([1, 2, 3, 16, 17], 2, replace=False).tolist() if rng.random() < 0.5 else None,
+                        [int(rng.integers(0, 5))] if rng.random() < 0.5 else None))
+    for start, end, query_types, query_channels in queries:
+        keep = numbers
+        if start is not None:
+            keep = keep[(epochs[keep] >= start) & (epochs[keep] <= end)]
+        if query_types is not None:
+            keep = keep[np.isin(types[keep], query_types)]
+        if query_channels is not None:
+            keep = keep[np.isin(channels[keep], query_channels)]
+        expected = sorted(keep.tolist(), key=lambda number: (epochs[number], number))
+        found = dhfs.find_log_events(start, end, query_types, query_channels).tolist()
+        assert found == expected
+        records = dhfs.read_log_records(found)
+        assert records['time'].tolist() == times[found].tolist()
+        assert records['type'].tolist() == types[found].tolist()
+
+def test_catalog_cache(small_image, tmp_path, monkeypatch):
+    path, _ = small_image
+    image = tmp_path / "cached.dd"
+    shutil.copyfile(path, image)
+    def cached_load():
+        dhfs = DHFS41()
+        dhfs.config['CACHE_DIR'] = str(tmp_path / "cache")
+        assert dhfs.load_image(str(image))
+        return dhfs
+    built = cached_load()
+    assert os.path.isfile(built.get_cache_path())
+
+    # A hit doesn't load any partition, and gives the same catalog
+    with monkeypatch.context() as patch:
+        def no_load(self, part_idx, linking=None):
+            raise AssertionError("partition loaded on a cache hit")
+        patch.setattr(DHFS41, "load_partition", no_load)
+        cached = cached_load()
+    for part_idx in range(built.num_parts):
+        expected, chains = built.frags_in_videos[part_idx], cached.frags_in_videos[part_idx]
+        assert list(chains) == list(expected)
+        assert all(chains[head] == expected[head] for head in expected)
+        assert chains.anomalies == expected.anomalies
+        assert cached.free_frags[part_idx].tolist() == built.free_frags[part_idx].tolist()
+        assert cached.dirty_frags[part_idx].tolist() == built.dirty_frags[part_idx].tolist()
+
+    # Cutting a chain in the image (in the first sample of the descriptor
+    # table, so the digest sees it) makes the cache stale
+    sampled = dhfs41.CACHE_SAMPLE_SIZE // DESC_DTYPE.itemsize
+    head = next(head for head in built.frags_in_videos[0]
+                if head < sampled and len(built.frags_in_videos[0][head]) > 1)
+    table_offset, _ = built.get_desc_table_extent(0)
+    with open(image, "r+b") as image_file:
+        image_file.seek(table_offset + head * DESC_DTYPE.itemsize + 12)
+        image_file.write(struct.pack("<I", 0xFFFFFFFF))
+    with monkeypatch.context() as patch:
+        loads = []
+        real_load = DHFS41.load_partition
+        def counted_load(self, part_idx, linking=None):
+            loads.append(part_idx)
+            return real_load(self, part_idx, linking)
+        patch.setattr(DHFS41, "load_partition", counted_load)
+        rebuilt = cached_load()
+    assert sorted(loads) == list(range(built.num_parts))
+    assert rebuilt.frags_in_videos[0][head] == [head]
+
+def split_image(path, piece_size):
+    # path written again as a split raw image (.001, .002...), as by split -b
+    with open(path, "rb") as image_in:
+        number = 0
+        while True:
+            data = image_in.read(piece_size)
+            if not data:
+                break
+            number += 1
+            with open(f"{path}.{number:03d}", "wb") as piece_out:
+                piece_out.write(data)
+    return f"{path}.001"
+
+def test_split_image_saves_the_same_files(small_image, tmp_path):
+    path, _ = small_image
+    image = tmp_path / "split.dd"
+    shutil.copyfile(path, image)
+    first = split_image(image, 777777)
+    dhfs = load(image)
+    catalog = dhfs.get_video_catalog()
+    videos = [catalog.get_video(row) for row in range(0, len(catalog), 3)]
+    os.makedirs(tmp_path / "whole")
+    dhfs.save_videos_at(videos, str(tmp_path / "whole"), workers=2, pool="thread")
+    names = sorted(os.listdir(tmp_path / "whole"))
+    assert len(names) == len(videos)
+    for use_mmap in (False, True):
+        dhfs = load(first, use_mmap)
+        assert len(dhfs.disk.segments) > 1
+        for pool in ("thread", "process", "disk"):
+            output = tmp_path / f"{pool}-{use_mmap}"
+            os.makedirs(output)
+            dhfs.save_videos_at(videos, str(output), workers=2, pool=pool)
+            assert sorted(os.listdir(output)) == names
+            match, mismatch, errors = filecmp.cmpfiles(tmp_path / "whole", output, names, shallow=False)
+            assert not mismatch and not errors
+
+def parse_frames(stream):
+    # (position, type, length, epoch) of the DHAV frames of a video,
+    # hopping by frame length up to the zeros left at the end
+    frames = []
+    position = 0
+    while stream[position:position+4] == b"DHAV":
+        length, timestamp = struct.unpack_from("<II", stream, position + 12)
+        frames.append((position, stream[position+4], length, int(dhfs41.timestamps_to_epoch([timestamp])[0])))
+        position += length
+    return frames
+
+def reference_window(stream, frames, start, end):
+    keyframes = [frame for frame in frames if frame[1] == 0xFD]
+    before = [frame for frame in keyframes if frame[3] <= start]
+    head = (before[-1] if before else keyframes[0])[0]
+    ends = [frame[0] for frame in frames if frame[0] > head and frame[3] > end]
+    return stream[head:ends[0] if ends else len(stream)]
+
+def read_extents(dhfs, extents):
+    return b"".join(dhfs.disk.read_at(offset, size) for offset, size in extents)
+
+def test_frame_index_matches_stream(frames_image):
+    path, _ = frames_image
+    dhfs = load(path)
+    catalog = dhfs.get_video_catalog()
+    rng = np.random.default_rng(7)
+    for row in range(0, len(catalog), 4):
+        video = catalog.get_video(row)
+        frames = parse_frames(read_extents(dhfs, dhfs.get_video_extents(*video)))
+        index = dhfs.get_frame_index(*video)
+        assert [index.get_frame(row) for row in range(len(index))] == frames
+        keyframes = [frame for frame in frames if frame[1] == 0xFD]
+        for moment in rng.integers(frames[0][3] - 10, frames[-1][3] + 10, 20).tolist():
+            before = [frame for frame in keyframes if frame[3] <= moment]
+            position, _, length, epoch = before[-1] if before else keyframes[0]
+            assert dhfs.find_keyframe(*video, moment) == (position, length, epoch)
+
+def test_window_extraction(frames_image, tmp_path):
+    path, _ = frames_image
+    dhfs = load(path)
+    catalog = dhfs.get_video_catalog()
+    rng = np.random.default_rng(8)
+    windows = {}
+    for row in range(0, len(catalog), 3):
+        video = catalog.get_video(row)
+        stream = read_extents(dhfs, dhfs.get_video_extents(*video))
+        frames = parse_frames(stream)
+        start = int(rng.integers(frames[0][3], frames[-1][3] + 1))
+        end = int(rng.integers(start, frames[-1][3] + 1))
+        windows[video] = (start, end, reference_window(stream, frames, start, end))
+    # Cut by probing frame headers, then from the frame indexes
+    for build_index in (False, True):
+        for video, (start, end, expected) in windows.items():
+            if build_index:
+                assert dhfs.get_frame_index(*video) is not None
+            assert read_extents(dhfs, dhfs.get_window_extents(*video, start, end)) == expected
+
+    # A batch saved with a window holds the part of each video in it
+    start, end, expected = next(iter(windows.values()))
+    video = next(iter(windows))
+    os.makedirs(tmp_path / "window")
+    stats = dhfs.save_videos_at([video], str(tmp_path / "window"), pool="thread", window=(start, end))
+    assert stats['videos'] == 1
+    name = dhfs.get_video_file_name(*video, (start, end))
+    with open(tmp_path / "window" / name, "rb") as saved:
+        assert saved.read() == expected
+
+def test_interval_index_matches_brute_force():
+    rng = np.random.default_rng(1)
+    begins = rng.integers(0, 10**6, 5000)
+    ends = begins + rng.integers(0, 1800, 5000)
+    # Corrupted end times, and ends before begins
+    ends[rng.choice(5000, 20, replace=False)] += 10**9
+    ends[:10] = begins[:10] - 5
+    rows = np.arange(5000)
+    index = IntervalIndex(rows, begins, ends)
+    for _ in range(200):
+        start = int(rng.integers(-1000, 10**6 + 1000))
+        end = start + int(rng.integers(0, 5000))
+        expected = rows[(begins <= end) & (np.maximum(ends, begins) >= start)]
+        expected = expected[np.argsort(begins[expected], kind='stable')]
+        assert index.overlap(start, end).tolist() == expected.tolist()
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 1000)),
+    ("bytes=-100", (900, 1000)),
+    ("bytes=900-5000", (900, 1000)),
+    ("bytes=-5000", (0, 1000)),
+    ("bytes=1000-", False),
+    ("bytes=50-10", False),
+    ("bytes=0-1,5-9", None),
+    ("items=0-10", None),
+])
+def test_range_parsing(header, expected):
+    handler = DHFSRequestHandler.__new__(DHFSRequestHandler)
+    handler.headers = {"Range": header} if header else {}
+    assert handler.get_range(1000) == expected